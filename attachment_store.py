@@ -0,0 +1,118 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict
+
+from mime_streaming import SpooledPart
+
+
+class AttachmentStore:
+    """Content-addressed store of translated attachments.
+
+    Attachments are identified by the SHA-256 of their decoded bytes and the language pair. The outputs produced for
+    the first occurrence of an attachment are kept once in the store, and materialized for the following ones.
+    """
+
+    counter_names = ("hits", "misses", "bytes_saved", "segments_saved", "characters_saved")
+    # Linux ioctl cloning a file on copy-on-write file systems (btrfs, XFS).
+    FICLONE = 0x40049409
+
+    def __init__(self, path: str, link_mode: str):
+        """Open or create an attachment store.
+
+        Args:
+            path (str): Directory of the store
+            link_mode (str): hardlink, reflink or copy
+        """
+        self.path = path
+        self.link_mode = link_mode
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.segments_saved = 0
+        self.characters_saved = 0
+        os.makedirs(path, exist_ok=True)
+
+    def digest(self, data, source: str, target: str) -> str:
+        hash = hashlib.sha256((source + "\0" + target + "\0").encode("utf-8"))
+        if isinstance(data, SpooledPart):
+            with data.open() as part_file:
+                for chunk in iter(lambda: part_file.read(1024 * 1024), b""):
+                    hash.update(chunk)
+        else:
+            hash.update(data)
+        return hash.hexdigest()
+
+    def entry_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], digest)
+
+    def lookup(self, digest: str) -> Dict[str, Any] | None:
+        """Return the metadata of a stored attachment, or None if it was never stored."""
+        try:
+            with open(os.path.join(self.entry_path(digest), "meta.json"), "r", encoding="utf-8") as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def commit(self, capture):
+        """Store the outputs captured while translating an attachment."""
+        entry_path = self.entry_path(capture.digest)
+        if os.path.isdir(entry_path):
+            return
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_path = entry_path + "." + str(os.getpid()) + ".tmp"
+        os.makedirs(temp_path, exist_ok=True)
+        artifacts = {}
+        for suffix, data in capture.artifacts.items():
+            name = "artifact-" + str(len(artifacts))
+            if isinstance(data, Path):
+                shutil.copyfile(data, os.path.join(temp_path, name))
+                artifacts[suffix] = name
+                continue
+            with open(os.path.join(temp_path, name), "wb") as artifact_file:
+                artifact_file.write(data.encode("utf-8") if isinstance(data, str) else data)
+            artifacts[suffix] = name
+        with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump({"artifacts": artifacts, "size": capture.size, "segments": capture.segments,
+                       "characters": capture.characters}, meta_file)
+        try:
+            os.rename(temp_path, entry_path)
+        except OSError:
+            # Another replica stored the same attachment first.
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def materialize_file(self, source: str, file_path: str):
+        temp_path = file_path + "." + str(os.getpid()) + ".tmp"
+        try:
+            if self.link_mode == "hardlink":
+                os.link(source, temp_path)
+            elif self.link_mode == "reflink":
+                with open(source, "rb") as source_file, open(temp_path, "wb") as temp_file:
+                    fcntl.ioctl(temp_file.fileno(), AttachmentStore.FICLONE, source_file.fileno())
+            else:
+                shutil.copyfile(source, temp_path)
+        except OSError:
+            # Not supported by the file system, or the store is on another device.
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, file_path)
+
+    def report(self) -> str:
+        return ("Attachment store " + self.path + ": " + str(self.hits) + " attachments materialized, " +
+                str(self.misses) + " translated.  Saved extracting " + str(self.bytes_saved) + " bytes and " +
+                "translating " + str(self.segments_saved) + " segments (" + str(self.characters_saved) +
+                " characters).")
+
+
+class AttachmentCapture:
+    """Outputs of an attachment being translated, to be committed to the attachment store."""
+
+    def __init__(self, digest: str, base_path: str, size: int):
+        self.digest = digest
+        self.base_path = base_path
+        self.size = size
+        self.artifacts: Dict[str, Any] = {}
+        self.segments = 0
+        self.characters = 0
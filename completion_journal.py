@@ -0,0 +1,40 @@
+import json
+import os
+from typing import Any, Dict
+
+
+class CompletionJournal:
+    """Append-only journal of completed emails, one JSON record per line.
+
+    Records hold the path, size, modification time and status of each email. The last record of a path wins.
+    """
+
+    def __init__(self, path: str):
+        """Load a journal, creating it if needed.
+
+        Args:
+            path (str): Path of the journal file
+        """
+        self.path = path
+        self.entries: Dict[str, Any] = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line of a journal can be truncated by a crash.
+                        continue
+                    self.entries[record["path"]] = record
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def is_complete(self, pathStr: str, stat: os.stat_result) -> bool:
+        record = self.entries.get(pathStr)
+        return (record is not None and record["status"] in ("translated", "skipped", "imported") and
+                record["size"] == stat.st_size and record["mtime"] == stat.st_mtime_ns)
+
+    def record(self, pathStr: str, stat: os.stat_result, status: str):
+        record = {"path": pathStr, "size": stat.st_size, "mtime": stat.st_mtime_ns, "status": status}
+        self.entries[pathStr] = record
+        # A single write of the whole line, so that replicas sharing a journal do not interleave records.
+        os.write(self.fd, (json.dumps(record) + "\n").encode("utf-8"))
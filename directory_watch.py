@@ -0,0 +1,247 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# inotify(7) constants.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding through ctypes, since the standard library has none."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1: " + os.strerror(ctypes.get_errno()))
+        self.watches = {}
+
+    def add_watch(self, directory: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch " + directory + ": " +
+                          os.strerror(ctypes.get_errno()))
+        self.watches[wd] = directory
+
+    def read_events(self, timeout: float) -> list:
+        """Wait up to timeout seconds for events.
+
+        Returns:
+            A list of (path, mask) tuples.  path is None for queue overflows.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(buffer):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].split(b"\0", 1)[0]
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, mask))
+                    continue
+                directory = self.watches.get(wd)
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                elif directory is not None:
+                    events.append((os.path.join(directory, os.fsdecode(name)), mask))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def scan_tree(root: str, directories: list | None = None) -> dict:
+    """Return the size and modification time of the .eml files of a tree, without following symbolic links.
+
+    The directories of the tree are appended to directories when it is given.
+    """
+    found = {}
+    pending = [root]
+    while len(pending) > 0:
+        directory = pending.pop()
+        if directories is not None:
+            directories.append(directory)
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.endswith(".eml") and entry.is_file():
+                    stat = entry.stat()
+                    found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue
+    return found
+
+
+class DirectoryWatcher:
+    """Reports the .eml files created or modified in a directory tree, once they have settled.
+
+    Changes are noticed with inotify, or by scanning the tree every poll_interval seconds when inotify is not
+    available, runs out of watches or mode is "poll".  A file has settled when its size and modification time have
+    not changed for settle_seconds, so that emails still being copied are not read half written.
+    """
+
+    def __init__(self, root: str, settle_seconds: float, poll_interval: float, mode: str = "auto"):
+        """Start watching a tree.  Files already in it are not reported.
+
+        Args:
+            root (str): Directory to watch
+            settle_seconds (float): Seconds without change after which a file is reported
+            poll_interval (float): Seconds between scans when polling
+            mode (str): "auto", "inotify" or "poll"
+
+        Raises:
+            OSError: mode is "inotify" and inotify cannot watch the tree.
+        """
+        self.root = root
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.inotify = None
+        self.snapshot = None
+        self.next_poll = 0.0
+        # Path to [arrival time, (size, mtime) when last seen changing, time last seen changing].
+        self.settling = {}
+        if mode != "poll":
+            try:
+                self.inotify = Inotify()
+                directories = []
+                scan_tree(root, directories)
+                for directory in directories:
+                    self.inotify.add_watch(directory)
+            except OSError:
+                if self.inotify is not None:
+                    self.inotify.close()
+                    self.inotify = None
+                if mode == "inotify":
+                    raise
+        if self.inotify is None:
+            self.start_polling()
+
+    @property
+    def mode(self) -> str:
+        return "poll" if self.inotify is None else "inotify"
+
+    def start_polling(self):
+        self.snapshot = scan_tree(self.root)
+        self.next_poll = time.time() + self.poll_interval
+
+    def changed(self, path: str):
+        now = time.time()
+        try:
+            stat = os.stat(path)
+            key = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            key = None
+        entry = self.settling.get(path)
+        if entry is None:
+            self.settling[path] = [now, key, now]
+        elif entry[1] != key:
+            entry[1] = key
+            entry[2] = now
+
+    def rescan(self):
+        """Look again at the whole tree after missing inotify events."""
+        for path in scan_tree(self.root):
+            self.changed(path)
+
+    def process_events(self, timeout: float):
+        for path, mask in self.inotify.read_events(timeout):
+            if path is None:
+                self.rescan()
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have been created in the directory before it was watched.
+                    directories = []
+                    found = scan_tree(path, directories)
+                    try:
+                        for directory in directories:
+                            self.inotify.add_watch(directory)
+                    except OSError:
+                        self.inotify.close()
+                        self.inotify = None
+                        self.start_polling()
+                        return
+                    for found_path in found:
+                        self.changed(found_path)
+            elif path.endswith(".eml"):
+                self.changed(path)
+
+    def poll(self):
+        snapshot = scan_tree(self.root)
+        for path, key in snapshot.items():
+            if self.snapshot.get(path) != key:
+                self.changed(path)
+        self.snapshot = snapshot
+        self.next_poll = time.time() + self.poll_interval
+
+    def pending_count(self) -> int:
+        """Number of files changed which have not settled yet."""
+        return len(self.settling)
+
+    def wait(self, timeout: float) -> list:
+        """Wait up to timeout seconds for files to settle.
+
+        Returns:
+            A list of (path, arrival time) tuples, oldest first.  The arrival time is when the file was first
+            seen changing, from time.time().
+        """
+        deadline = time.time() + timeout
+        while True:
+            now = time.time()
+            settled = []
+            for path, (arrival, key, last_change) in list(self.settling.items()):
+                if now - last_change < self.settle_seconds:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Removed or renamed before settling.
+                    del self.settling[path]
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) == key:
+                    settled.append((path, arrival))
+                    del self.settling[path]
+                else:
+                    self.changed(path)
+            if len(settled) > 0 or now >= deadline:
+                return sorted(settled, key=lambda item: item[1])
+            next_check = deadline
+            if len(self.settling) > 0:
+                next_check = min(next_check, min(entry[2] for entry in self.settling.values()) +
+                                 self.settle_seconds)
+            if self.inotify is not None:
+                self.process_events(max(0.0, min(next_check, deadline) - now))
+            else:
+                if now >= self.next_poll:
+                    self.poll()
+                    continue
+                time.sleep(max(0.0, min(next_check, deadline, self.next_poll) - now))
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,260 @@
+import posixpath
+import re
+import struct
+import zipfile
+import xml.parsers.expat
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+CONTENT_TYPES_NAMESPACE = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+RELATIONSHIPS_NAMESPACE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+WORDPROCESSING_NAMESPACES = frozenset(["http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+                                       "http://purl.oclc.org/ooxml/wordprocessingml/main"])
+IMAGE_RELATIONSHIP_TYPES = frozenset(["http://schemas.openxmlformats.org/officeDocument/2006/relationships/image",
+                                      "http://purl.oclc.org/ooxml/officeDocument/relationships/image"])
+MAIN_CONTENT_TYPES = frozenset([
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml",
+    "application/vnd.ms-word.document.macroEnabled.main+xml",
+    "application/vnd.ms-word.template.macroEnabledTemplate.main+xml"])
+# Parts holding paragraphs to translate, besides the main document.
+TEXT_CONTENT_TYPES = frozenset([
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.endnotes+xml"])
+ENCODING_PATTERN = re.compile(rb"""^\s*<\?xml[^>]*encoding\s*=\s*["']([^"']+)["']""")
+# Characters which are not allowed in XML 1.0 documents.
+INVALID_XML_PATTERN = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+CHUNK_SIZE = 1 << 20
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+LOCAL_HEADER_SIZE = 30
+DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class DocxPackage:
+    """A docx file read straight from its zip package, without building the python-docx object model.
+
+    The XML parts holding text (main document, headers, footers, footnotes and endnotes) are stream parsed to
+    collect the text of their paragraphs along with the byte offset of the end of each paragraph, where a run
+    can be inserted when the package is written back out.  The other members are copied as they are compressed.
+    """
+
+    def __init__(self, docx_file):
+        """Open a docx file.
+
+        Args:
+            docx_file: Binary file reading the docx file.  It is read again when the package is written.
+
+        Raises:
+            zipfile.BadZipFile, KeyError or ElementTree.ParseError if the file is not a docx file.
+        """
+        self.zip = zipfile.ZipFile(docx_file)
+        self.main_part = None
+        self.text_parts = []
+        self.prefixes = {}
+        content_types = ElementTree.fromstring(self.zip.read("[Content_Types].xml"))
+        for override in content_types.iter(CONTENT_TYPES_NAMESPACE + "Override"):
+            name = override.get("PartName", "").lstrip("/")
+            content_type = override.get("ContentType")
+            if content_type in MAIN_CONTENT_TYPES:
+                self.main_part = name
+                self.text_parts.insert(0, name)
+            elif content_type in TEXT_CONTENT_TYPES:
+                self.text_parts.append(name)
+        if self.main_part is None:
+            raise KeyError("No main document part")
+        self.text_parts = [name for name in self.text_parts if name in self.zip.NameToInfo]
+
+    def images(self):
+        """Return the part names ("/word/media/image1.png") of the images of the main document."""
+        directory, name = posixpath.split(self.main_part)
+        relationships_name = posixpath.join(directory, "_rels", name + ".rels")
+        if relationships_name not in self.zip.NameToInfo:
+            return []
+        images = []
+        relationships = ElementTree.fromstring(self.zip.read(relationships_name))
+        for relationship in relationships.iter(RELATIONSHIPS_NAMESPACE + "Relationship"):
+            if relationship.get("Type") not in IMAGE_RELATIONSHIP_TYPES or \
+                    relationship.get("TargetMode") == "External":
+                continue
+            target = relationship.get("Target", "")
+            part_name = posixpath.normpath(target if target.startswith("/") else
+                                           posixpath.join("/" + directory, target))
+            if part_name[1:] in self.zip.NameToInfo and part_name not in images:
+                images.append(part_name)
+        return images
+
+    def read(self, part_name: str) -> bytes:
+        return self.zip.read(part_name.lstrip("/"))
+
+    def paragraphs(self, part_name: str):
+        """Stream parse an XML part and return the text of its paragraphs.
+
+        The text of a paragraph is the text of its runs, with tabs and line breaks, but without the paragraphs
+        of the text boxes it anchors, which are paragraphs of their own.  Deleted text and field codes are left
+        out.
+
+        Returns:
+            A list of (text, offset) tuples in document order, offset being the byte offset of the end tag of
+            the paragraph.  Empty paragraphs are left out, and so are all the paragraphs of parts which are not
+            UTF-8 encoded, as runs could not be inserted in them.
+        """
+        paragraphs = []
+        # Text pieces of the paragraphs being parsed, the innermost last.
+        open_paragraphs = []
+        tags = {}
+        in_text = False
+
+        def start_element(tag, attributes):
+            nonlocal in_text
+            if len(tags) == 0:
+                prefix = None
+                for key, value in attributes.items():
+                    if value in WORDPROCESSING_NAMESPACES and (key == "xmlns" or key.startswith("xmlns:")):
+                        prefix = key[6:]
+                self.prefixes[part_name] = prefix
+                qualified = prefix + ":" if prefix else ""
+                tags.update({qualified + name: name for name in ("p", "t", "tab", "br", "cr", "noBreakHyphen")})
+            name = tags.get(tag)
+            if name == "p":
+                open_paragraphs.append([])
+            elif len(open_paragraphs) == 0:
+                return
+            elif name == "t":
+                in_text = True
+            elif name == "tab":
+                open_paragraphs[-1].append("\t")
+            elif name == "br" or name == "cr":
+                open_paragraphs[-1].append("\n")
+            elif name == "noBreakHyphen":
+                open_paragraphs[-1].append("-")
+
+        def end_element(tag):
+            nonlocal in_text
+            name = tags.get(tag)
+            if name == "t":
+                in_text = False
+            elif name == "p" and len(open_paragraphs) > 0:
+                text = "".join(open_paragraphs.pop())
+                if len(text) > 0:
+                    paragraphs.append((text, parser.CurrentByteIndex))
+
+        def character_data(data):
+            if in_text and len(open_paragraphs) > 0:
+                open_paragraphs[-1].append(data)
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        with self.zip.open(part_name) as part_file:
+            chunk = part_file.read(CHUNK_SIZE)
+            if not is_utf8(chunk):
+                return []
+            while len(chunk) > 0:
+                parser.Parse(chunk, False)
+                chunk = part_file.read(CHUNK_SIZE)
+            parser.Parse(b"", True)
+        if self.prefixes.get(part_name) is None:
+            return []
+        return paragraphs
+
+    def run(self, part_name: str, text: str) -> bytes:
+        """Return the XML of a run holding text, with its line breaks, for a part whose paragraphs were parsed."""
+        prefix = self.prefixes[part_name]
+        qualified = prefix + ":" if prefix else ""
+        text = INVALID_XML_PATTERN.sub("", text)
+        pieces = ["<" + qualified + 't xml:space="preserve">' + escape(line) + "</" + qualified + "t>"
+                  for line in text.split("\n")]
+        return ("<" + qualified + "r>" + ("<" + qualified + "br/>").join(pieces) + "</" + qualified +
+                "r>").encode("utf-8")
+
+    def write(self, output_file, insertions: dict):
+        """Write the package with runs inserted in its XML parts.
+
+        Args:
+            output_file: Seekable binary file to write the docx file to.
+            insertions (dict): Part name to {offset: run XML} dictionaries.  Members without insertions are
+                copied compressed as they are, without decompressing them.
+        """
+        with zipfile.ZipFile(output_file, "w") as target:
+            for info in self.zip.infolist():
+                runs = insertions.get(info.filename)
+                if not runs:
+                    copy_member(self.zip, target, info)
+                    continue
+                added_size = sum(len(run) for run in runs.values())
+                with self.zip.open(info) as part_file, \
+                        target.open(member_info(info, zipfile.ZIP_DEFLATED, added_size), "w") as output_part:
+                    position = 0
+                    for offset in sorted(runs):
+                        copy_bytes(part_file, output_part, offset - position)
+                        output_part.write(runs[offset])
+                        position = offset
+                    copy_bytes(part_file, output_part, None)
+
+    def close(self):
+        self.zip.close()
+
+
+def is_utf8(start: bytes) -> bool:
+    """Tell from its first bytes whether an XML document is UTF-8 encoded."""
+    if start.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return False
+    match = ENCODING_PATTERN.match(start.removeprefix(b"\xef\xbb\xbf"))
+    return match is None or match.group(1).lower() in (b"utf-8", b"utf8")
+
+
+def copy_bytes(source, target, size):
+    """Copy size bytes, or everything left if size is None, from a binary file to another."""
+    while size is None or size > 0:
+        chunk = source.read(CHUNK_SIZE if size is None else min(size, CHUNK_SIZE))
+        if len(chunk) == 0:
+            return
+        target.write(chunk)
+        if size is not None:
+            size -= len(chunk)
+
+
+def member_info(info: zipfile.ZipInfo, compress_type: int, added_size: int = 0) -> zipfile.ZipInfo:
+    """Return the ZipInfo of a member written like another one, added_size bytes longer.
+
+    zipfile decides from the size whether the member needs Zip64 extra fields, which can not be added once it is
+    written.
+    """
+    output_info = zipfile.ZipInfo(info.filename, info.date_time)
+    output_info.compress_type = compress_type
+    output_info.external_attr = info.external_attr
+    output_info.file_size = info.file_size + added_size
+    return output_info
+
+
+def copy_member(source: zipfile.ZipFile, target: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """Copy a zip member to another zip file as it is compressed, a block at a time.
+
+    zipfile has no public way to copy compressed data, so the member is written like ZipFile.mkdir writes
+    directories: its local header, then the compressed bytes read after the local header of the source.
+    """
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(LOCAL_HEADER_SIZE)
+    if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("Bad local file header of " + info.filename)
+    name_length, extra_length = struct.unpack("<2H", header[26:30])
+    source.fp.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+    output_info = member_info(info, info.compress_type)
+    output_info.CRC = info.CRC
+    output_info.compress_size = info.compress_size
+    # The sizes and CRC are in the local header, no data descriptor follows the data.
+    output_info.flag_bits = info.flag_bits & ~DATA_DESCRIPTOR_FLAG
+    with target._lock:
+        target.fp.seek(target.start_dir)
+        output_info.header_offset = target.fp.tell()
+        target._writecheck(output_info)
+        target._didModify = True
+        target.filelist.append(output_info)
+        target.NameToInfo[output_info.filename] = output_info
+        target.fp.write(output_info.FileHeader())
+        copy_bytes(source.fp, target.fp, info.compress_size)
+        target.start_dir = target.fp.tell()
@@ -0,0 +1,406 @@
+from email.message import EmailMessage
+from pathlib import Path
+from urllib import request
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+parser = argparse.ArgumentParser(
+                    prog='eml-benchmark',
+                    description='Generates a synthetic EML corpus and measures the throughput of eml-translator '
+                                'against a local LibreTranslate stub',
+                    epilog='')
+subparsers = parser.add_subparsers(dest='command', required=True)
+generate_parser = subparsers.add_parser('generate', help="Generate a synthetic corpus, one folder per content type.")
+generate_parser.add_argument('path')
+generate_parser.add_argument(
+    '-n',
+    '--emails',
+    help="Optional.  Number of emails per content type.",
+    required=False,
+    default=50
+)
+generate_parser.add_argument(
+    '--seed',
+    help="Optional.  Random seed, so that the same corpus can be generated on every machine.",
+    required=False,
+    default=1
+)
+run_parser = subparsers.add_parser('run', help="Translate a generated corpus and report its throughput.")
+run_parser.add_argument('path')
+run_parser.add_argument(
+    '-t',
+    '--translator-args',
+    help="Optional.  Arguments passed to eml-translator.py, ex: \"-w 4 -n 4\".",
+    required=False,
+    default=""
+)
+run_parser.add_argument(
+    '--latency',
+    help="Optional.  Seconds of latency added by the stub server to every request.",
+    required=False,
+    default=0.0
+)
+run_parser.add_argument(
+    '--failure-rate',
+    help="Optional.  Probability that a translate request to the stub server fails.",
+    required=False,
+    default=0.0
+)
+run_parser.add_argument(
+    '--chars-per-second',
+    help="Optional.  Translation throughput of the stub server.  0 for no limit.",
+    required=False,
+    default=0
+)
+run_parser.add_argument(
+    '--types',
+    help="Optional.  Comma separated content types to run.  Defaults to every folder of the corpus.",
+    required=False
+)
+run_parser.add_argument(
+    '--save',
+    help="Optional.  Save the results as a baseline JSON file.",
+    required=False
+)
+run_parser.add_argument(
+    '--machine',
+    help="Optional.  Description of the machine, saved with the results, ex: \"4 vCPU cloud VM, SSD\".",
+    required=False,
+    default=""
+)
+run_parser.add_argument(
+    '--baseline',
+    help="Optional.  Baseline JSON file to compare the results with.",
+    required=False
+)
+args = parser.parse_args()
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PARAGRAPHS = {
+    "fr": ["Bonjour à tous, veuillez trouver ci-joint le rapport trimestriel de l'équipe.",
+           "Nous avons constaté une hausse des ventes de 12 % par rapport à l'année dernière.",
+           "Merci de me faire part de vos remarques avant vendredi prochain.",
+           "La réunion est déplacée à jeudi, même heure, dans la salle habituelle."],
+    "de": ["Sehr geehrte Damen und Herren, anbei erhalten Sie die gewünschten Unterlagen.",
+           "Die Lieferung verzögert sich leider um zwei Wochen, wir bitten um Verständnis.",
+           "Für Rückfragen stehe ich Ihnen jederzeit gerne zur Verfügung."],
+    "es": ["Estimado cliente, le enviamos la factura correspondiente al mes de marzo.",
+           "El plazo de pago es de treinta días a partir de la fecha de emisión.",
+           "Quedamos a su disposición para cualquier consulta adicional."],
+    "ru": ["Добрый день, направляю вам договор для согласования.",
+           "Пожалуйста, подтвердите получение этого письма."],
+    "zh": ["您好，附件是本月的销售报告，请查收。", "如有任何问题，请随时与我们联系。"],
+    "en": ["Please find attached the report we discussed during Monday’s call.",
+           "Let me know if anything is missing — thanks again for your help."],
+}
+SIGNATURE = "\n-- \nJean Dupont\nService commercial\nSent from my iPhone\n"
+DISCLAIMER = ("Ce message et ses pièces jointes sont confidentiels et destinés exclusivement à leurs "
+              "destinataires.")
+
+
+def paragraphs(rng, language, count):
+    return [rng.choice(PARAGRAPHS[language]) for _ in range(count)]
+
+
+def wrapped(text, width=72):
+    lines = []
+    line = ""
+    for word in text.split():
+        if len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = word if line == "" else line + " " + word
+    lines.append(line)
+    return "\n".join(lines)
+
+
+def plain_body(rng, language, count):
+    body = "\n\n".join(wrapped(paragraph) for paragraph in paragraphs(rng, language, count))
+    quoted = "\n".join("> " + line for line in wrapped(" ".join(paragraphs(rng, language, 2))).splitlines())
+    return body + "\n\n" + quoted + "\n" + SIGNATURE + "\n" + DISCLAIMER + "\n"
+
+
+def html_body(rng, language, count):
+    items = "".join("<tr><td><b>" + paragraph.split(" ")[0] + "</b> " + " ".join(paragraph.split(" ")[1:]) +
+                    "</td><td>&nbsp;</td></tr>" for paragraph in paragraphs(rng, language, count))
+    return ("<html><head><style>td { color: #333; }</style><script>var tracking = 'é';</script></head><body>"
+            "<div style=\"display:none\">Aperçu du message</div><h1>" + rng.choice(PARAGRAPHS[language]) +
+            "</h1><p>" + "</p><p>".join("<span>" + paragraph + "</span> <i>" + paragraph.split(" ")[-1] + "</i>"
+                                        for paragraph in paragraphs(rng, language, count)) +
+            "</p><table>" + items + "</table><p><small>" + DISCLAIMER + "</small></p></body></html>")
+
+
+def pdf_document(pages):
+    """Build a minimal PDF, with one Helvetica text line per page line."""
+    font_id = 3 + len(pages) * 2
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               ("<< /Type /Pages /Kids [" + " ".join(str(3 + index * 2) + " 0 R" for index in range(len(pages))) +
+                "] /Count " + str(len(pages)) + " >>").encode("latin-1")]
+    for index, lines in enumerate(pages):
+        objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents " + str(4 + index * 2) +
+                        " 0 R /Resources << /Font << /F1 " + str(font_id) + " 0 R >> >> >>").encode("latin-1"))
+        content = b"BT /F1 10 Tf 14 TL 50 750 Td "
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            content += b"(" + escaped.encode("latin-1", errors="replace") + b") Tj T* "
+        content += b"ET"
+        objects.append(b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for index, data in enumerate(objects):
+        offsets.append(output.tell())
+        output.write(str(index + 1).encode() + b" 0 obj\n" + data + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 " + str(len(objects) + 1).encode() + b"\n0000000000 65535 f \n")
+    for offset in offsets:
+        output.write(("%010d 00000 n \n" % offset).encode())
+    output.write(b"trailer\n<< /Size " + str(len(objects) + 1).encode() + b" /Root 1 0 R >>\nstartxref\n" +
+                 str(xref).encode() + b"\n%%EOF\n")
+    return output.getvalue()
+
+
+def docx_document(paragraph_texts, table_rows, header_text):
+    """Build a minimal docx package with paragraphs, a table and a page header."""
+    def paragraph(text):
+        escaped = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        return "<w:p><w:r><w:rPr><w:b/></w:rPr><w:t xml:space=\"preserve\">" + escaped + "</w:t></w:r></w:p>"
+
+    namespaces = ("xmlns:w=\"http://schemas.openxmlformats.org/wordprocessingml/2006/main\" "
+                  "xmlns:r=\"http://schemas.openxmlformats.org/officeDocument/2006/relationships\"")
+    table = "<w:tbl>" + "".join("<w:tr>" + "".join("<w:tc>" + paragraph(cell) + "</w:tc>" for cell in row) +
+                                "</w:tr>" for row in table_rows) + "</w:tbl>"
+    document = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><w:document " + namespaces +
+                "><w:body>" + "".join(paragraph(text) for text in paragraph_texts) + table +
+                "<w:sectPr><w:headerReference w:type=\"default\" r:id=\"rId1\"/></w:sectPr></w:body></w:document>")
+    header = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><w:hdr " + namespaces + ">" +
+              paragraph(header_text) + "</w:hdr>")
+    content_types = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><Types xmlns=\"http://schemas."
+                     "openxmlformats.org/package/2006/content-types\"><Default Extension=\"rels\" ContentType=\""
+                     "application/vnd.openxmlformats-package.relationships+xml\"/><Default Extension=\"xml\" "
+                     "ContentType=\"application/xml\"/><Override PartName=\"/word/document.xml\" ContentType=\""
+                     "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml\"/>"
+                     "<Override PartName=\"/word/header1.xml\" ContentType=\"application/vnd.openxmlformats-"
+                     "officedocument.wordprocessingml.header+xml\"/></Types>")
+    package_rels = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><Relationships xmlns=\"http://"
+                    "schemas.openxmlformats.org/package/2006/relationships\"><Relationship Id=\"rId1\" Type=\"http:"
+                    "//schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument\" Target=\""
+                    "word/document.xml\"/></Relationships>")
+    document_rels = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><Relationships xmlns=\"http://"
+                     "schemas.openxmlformats.org/package/2006/relationships\"><Relationship Id=\"rId1\" Type=\"http:"
+                     "//schemas.openxmlformats.org/officeDocument/2006/relationships/header\" Target=\"header1.xml\""
+                     "/></Relationships>")
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+        for name, data in (("[Content_Types].xml", content_types), ("_rels/.rels", package_rels),
+                           ("word/document.xml", document), ("word/_rels/document.xml.rels", document_rels),
+                           ("word/header1.xml", header)):
+            # A fixed date, so that the same corpus is generated at any time.
+            package.writestr(zipfile.ZipInfo(name, date_time=(2024, 5, 6, 10, 0, 0)), data,
+                             compress_type=zipfile.ZIP_DEFLATED)
+    return output.getvalue()
+
+
+def new_message(rng, index, language):
+    message = EmailMessage()
+    message["From"] = "sender" + str(index) + "@example.com"
+    message["To"] = "archive@example.com"
+    message["Subject"] = rng.choice(PARAGRAPHS[language])[:40]
+    message["Date"] = "Mon, 06 May 2024 10:" + "%02d" % (index % 60) + ":00 +0200"
+    return message
+
+
+def generate_plain(rng, index):
+    message = new_message(rng, index, "fr")
+    message.set_content(plain_body(rng, "fr", rng.randint(2, 12)))
+    return message
+
+
+def generate_html(rng, index):
+    message = new_message(rng, index, "fr")
+    message.set_content(plain_body(rng, "fr", 3))
+    message.add_alternative(html_body(rng, "fr", rng.randint(3, 30)), subtype="html")
+    return message
+
+
+def generate_pdf(rng, index):
+    message = new_message(rng, index, "fr")
+    message.set_content(plain_body(rng, "fr", 2))
+    pages = [[wrapped(paragraph, 90) for paragraph in paragraphs(rng, "fr", 6)] for _ in range(rng.randint(1, 20))]
+    message.add_attachment(pdf_document(pages), maintype="application", subtype="pdf",
+                           filename="rapport-" + str(index % 5) + ".pdf")
+    return message
+
+
+def generate_docx(rng, index):
+    message = new_message(rng, index, "de")
+    message.set_content(plain_body(rng, "de", 2))
+    rows = [paragraphs(rng, "de", 3) for _ in range(rng.randint(1, 15))]
+    message.add_attachment(docx_document(paragraphs(rng, "de", rng.randint(2, 40)), rows, "Vertraulich"),
+                           maintype="application",
+                           subtype="vnd.openxmlformats-officedocument.wordprocessingml.document",
+                           filename="vertrag-" + str(index) + ".docx")
+    return message
+
+
+def generate_rfc822(rng, index):
+    message = new_message(rng, index, "es")
+    message.set_content(plain_body(rng, "es", 2))
+    forwarded = new_message(rng, index + 1000, "es")
+    forwarded.set_content(plain_body(rng, "es", 4))
+    forwarded.add_alternative(html_body(rng, "es", 4), subtype="html")
+    message.add_attachment(forwarded)
+    return message
+
+
+def generate_oversized(rng, index):
+    message = new_message(rng, index, "fr")
+    message.set_content(plain_body(rng, "fr", 200))
+    message.add_attachment(rng.randbytes(4 * 1024 * 1024), maintype="application", subtype="octet-stream",
+                           filename="archive-" + str(index) + ".bin")
+    return message
+
+
+def generate_multilingual(rng, index):
+    language = rng.choice(list(PARAGRAPHS))
+    message = new_message(rng, index, language)
+    message.set_content(plain_body(rng, language, rng.randint(2, 8)))
+    message.add_alternative(html_body(rng, language, rng.randint(2, 8)), subtype="html")
+    return message
+
+
+GENERATORS = {"plain": generate_plain, "html": generate_html, "pdf": generate_pdf, "docx": generate_docx,
+              "rfc822": generate_rfc822, "oversized": generate_oversized, "multilingual": generate_multilingual}
+
+
+def generate(path, email_count, seed):
+    for content_type, generator in GENERATORS.items():
+        rng = random.Random(str(seed) + content_type)
+        # MIME boundaries are drawn from the global generator.
+        random.seed(str(seed) + content_type)
+        folder = os.path.join(path, content_type)
+        os.makedirs(folder, exist_ok=True)
+        for index in range(email_count):
+            with open(os.path.join(folder, "email-" + "%05d" % index + ".eml"), "wb") as eml_file:
+                eml_file.write(bytes(generator(rng, index)))
+        print("Generated " + str(email_count) + " " + content_type + " emails in " + folder, flush=True)
+
+
+def start_stub():
+    stub = subprocess.Popen([sys.executable, os.path.join(ROOT, "libretranslate-stub.py"), "-p", "0",
+                             "--latency", str(args.latency), "--failure-rate", str(args.failure_rate),
+                             "--chars-per-second", str(args.chars_per_second)],
+                            stdout=subprocess.PIPE, text=True)
+    url = stub.stdout.readline().strip().split(" ")[-1]
+    return stub, url
+
+
+def stub_stats(url):
+    with request.urlopen(url + "stats") as response:
+        return json.loads(response.read().decode())
+
+
+def run_type(url, corpus_folder, content_type):
+    """Translate a copy of a corpus folder and measure it."""
+    with tempfile.TemporaryDirectory(prefix="eml-benchmark-") as work_folder:
+        folder = os.path.join(work_folder, content_type)
+        shutil.copytree(corpus_folder, folder)
+        emails = [path for path in Path(folder).glob("*.eml")]
+        email_bytes = sum(path.stat().st_size for path in emails)
+        stats_before = stub_stats(url)
+        start = time.time()
+        translator = subprocess.Popen([sys.executable, os.path.join(ROOT, "eml-translator.py"), "-s", url] +
+                                      args.translator_args.split() + [folder],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=False)
+        # Read while the translator runs, so that it never blocks on a full pipe.
+        stderr_chunks = []
+        reader = threading.Thread(target=lambda: stderr_chunks.append(translator.stderr.read()), daemon=True)
+        reader.start()
+        # wait4 gives the resource usage of this translator run alone.
+        pid, status, usage = os.wait4(translator.pid, 0)
+        seconds = time.time() - start
+        reader.join()
+        stderr = b"".join(stderr_chunks).decode(errors="replace")
+        translator.returncode = os.waitstatus_to_exitcode(status)
+        stats_after = stub_stats(url)
+    if translator.returncode != 0:
+        print(stderr, file=sys.stderr)
+        raise SystemExit("eml-translator failed on " + content_type)
+    segments = stats_after["segments"] - stats_before["segments"]
+    return {"emails": len(emails), "bytes": email_bytes, "seconds": round(seconds, 3),
+            "emails_per_second": round(len(emails) / seconds, 2),
+            "segments_per_second": round(segments / seconds, 2),
+            "bytes_per_second": round(email_bytes / seconds),
+            "segments": segments,
+            "characters": stats_after["characters"] - stats_before["characters"],
+            "round_trips": stats_after["requests"] - stats_before["requests"],
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1)}
+
+
+def print_results(results, baseline):
+    print("{:<14}{:>8}{:>10}{:>12}{:>14}{:>12}{:>10}{:>10}".format(
+        "type", "emails", "seconds", "emails/s", "segments/s", "MB/s", "trips", "RSS MB"))
+    for content_type, result in results.items():
+        print("{:<14}{:>8}{:>10.2f}{:>12.2f}{:>14.1f}{:>12.2f}{:>10}{:>10.1f}".format(
+            content_type, result["emails"], result["seconds"], result["emails_per_second"],
+            result["segments_per_second"], result["bytes_per_second"] / 1e6, result["round_trips"],
+            result["peak_rss_mb"]))
+        if baseline is not None and content_type in baseline["results"]:
+            reference = baseline["results"][content_type]
+            print("{:<14}{:>18}{:>+12.0%}{:>+14.0%}{:>12}{:>+10.0%}{:>+10.0%}".format(
+                "  vs baseline", "",
+                result["emails_per_second"] / reference["emails_per_second"] - 1,
+                result["segments_per_second"] / reference["segments_per_second"] - 1
+                if reference["segments_per_second"] > 0 else 0.0, "",
+                result["round_trips"] / reference["round_trips"] - 1 if reference["round_trips"] > 0 else 0.0,
+                result["peak_rss_mb"] / reference["peak_rss_mb"] - 1))
+
+
+def run(path):
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    content_types = sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    if args.types is not None:
+        content_types = args.types.split(",")
+    stub, url = start_stub()
+    try:
+        results = {}
+        for content_type in content_types:
+            print("Running " + content_type + "...", flush=True)
+            results[content_type] = run_type(url, os.path.join(path, content_type), content_type)
+    finally:
+        stub.terminate()
+        stub.wait()
+    print_results(results, baseline)
+    if args.save is not None:
+        with open(args.save, "w", encoding="utf-8") as baseline_file:
+            json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "translator_args": args.translator_args,
+                       "machine": {"description": args.machine, "platform": platform.platform(),
+                                   "python": platform.python_version(), "cpus": os.cpu_count()},
+                       "stub": {"latency": float(args.latency), "failure_rate": float(args.failure_rate),
+                                "chars_per_second": int(args.chars_per_second)},
+                       "results": results}, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print("Saved results to " + args.save, flush=True)
+
+
+if args.command == "generate":
+    generate(args.path, int(args.emails), args.seed)
+else:
+    run(args.path)
@@ -0,0 +1,112 @@
+import argparse
+import os
+import sys
+import time
+
+from output_store import REQUIREMENTS, SUPPORTED, PackedOutputStore
+
+parser = argparse.ArgumentParser(
+                    prog='eml-output-export',
+                    description='Writes the outputs of a packed output store of eml-translator back next to the '
+                                'emails, as if it had been run without --output-store',
+                    epilog='')
+parser.add_argument('store', help="Directory of the packed output store.")
+parser.add_argument('path', help="Directory the translated emails were found in, or a copy of it.")
+parser.add_argument(
+    '--email',
+    help="Optional.  Only export the outputs of this email, by its path relative to the directory of the emails.  "
+         "Can be given several times.",
+    required=False,
+    action='append'
+)
+parser.add_argument(
+    '--shard',
+    help="Optional.  Only export the emails of this shard of the store.  Can be given several times.",
+    required=False,
+    type=int,
+    action='append'
+)
+parser.add_argument(
+    '--markers',
+    help="Optional.  Write the marker file of each exported email, so that eml-translator run without "
+         "--output-store skips it.",
+    required=False,
+    default=True,
+    action=argparse.BooleanOptionalAction)
+parser.add_argument(
+    '--list',
+    help="Optional.  List the outputs of the emails with their sizes instead of writing them.",
+    required=False,
+    default=False,
+    action=argparse.BooleanOptionalAction)
+args = parser.parse_args()
+
+if not SUPPORTED:
+    print("eml-output-export.py needs " + REQUIREMENTS + ".", flush=True)
+    sys.exit(1)
+if not os.path.isfile(os.path.join(args.store, "store.json")):
+    print(args.store + " is not a packed output store.", flush=True)
+    sys.exit(1)
+store = PackedOutputStore(args.store, args.path, 1)
+
+
+def selected_emails():
+    """Yield the (path, committed) pairs of the emails to export, paths relative to the directory of the emails."""
+    if args.email is not None:
+        for pathStr in args.email:
+            key = os.path.relpath(os.path.join(args.path, pathStr), args.path)
+            committed = store.committed(os.path.join(args.path, key))
+            if committed is None:
+                print(pathStr + " is not in the store.", flush=True)
+                continue
+            yield key, committed
+        return
+    for shard in (range(store.shard_count) if args.shard is None else args.shard):
+        if not os.path.isfile(store.shard_path(shard)):
+            continue
+        yield from store.emails(shard)
+
+
+def export_email(key, committed):
+    """Write the outputs of an email like eml-translator does, each to a temporary file renamed into place.
+
+    Returns:
+        (int, int): The number of outputs and of bytes written.
+    """
+    count = 0
+    size = 0
+    for name, output_size, output_id in store.outputs(key):
+        file_path = os.path.join(args.path, name)
+        count += 1
+        size += output_size
+        if args.list:
+            print("    " + name + ": " + str(output_size) + " bytes")
+            continue
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        temp_path = file_path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as output_file:
+            store.read(key, output_id, output_file)
+        os.replace(temp_path, file_path)
+    if args.markers and not args.list:
+        marker_path = os.path.join(args.path, key) + "-translated-mark.mrk"
+        with open(marker_path, "wb"):
+            pass
+        os.utime(marker_path, (committed, committed))
+    return count, size
+
+
+start_time = time.time()
+email_count = 0
+output_count = 0
+byte_count = 0
+for key, committed in selected_emails():
+    if args.list:
+        print(key + ": committed " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(committed)))
+    count, size = export_email(key, committed)
+    email_count += 1
+    output_count += count
+    byte_count += size
+store.close()
+print(("Listed " if args.list else "Exported ") + str(output_count) + " outputs (" + str(byte_count) +
+      " bytes) of " + str(email_count) + " emails in " + "{:.1f}".format(time.time() - start_time) + " seconds.",
+      flush=True)
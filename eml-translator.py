@@ -1,100 +1,43 @@
-from pathlib import Path
 import time
+# Measured before anything else is imported, for the startup budget.
+startup_time = time.perf_counter()
+from pathlib import Path
 import argparse
-import eml_parser
-from bs4 import BeautifulSoup as bs, Stylesheet, Comment
 import base64
-import docx
-from PyPDF2 import PdfReader
 import io
 import os
-import magic
-
-from openai import OpenAI
 import json
 import sys
-from typing import Any, Dict
-from urllib import request, parse, error
-
-
-class LibreTranslateAPI:
-    DEFAULT_URL = "https://translate.terraprint.co/"
-
-    def __init__(self, url: str | None = None, api_key: str | None = None):
-        """Create a LibreTranslate API connection.
-
-        Args:
-            url (str): The url of the LibreTranslate endpoint.
-            api_key (str): The API key.
-        """
-        self.url = LibreTranslateAPI.DEFAULT_URL if url is None else url
-        self.api_key = api_key
-
-        # Add trailing slash
-        assert len(self.url) > 0
-        if self.url[-1] != "/":
-            self.url += "/"
-
-    def translate(self, q: str, source: str = "en", target: str = "es", timeout: int | None = None) -> Any:
-        """Translate string
-
-        Args:
-            q (str): The text to translate
-            source (str): The source language code (ISO 639)
-            target (str): The target language code (ISO 639)
-            timeout (int): Request timeout in seconds
-
-        Returns:
-            str: The translated text
-        """
-        url = self.url + "translate"
-        params: Dict[str, str] = {"q": q, "source": source, "target": target}
-        if self.api_key is not None:
-            params["api_key"] = self.api_key
-        url_params = parse.urlencode(params)
-        req = request.Request(url, data=json.dumps(params).encode('utf-8'), method="POST", headers={"Content-Type": "application/json"})
-        response = request.urlopen(req, timeout=timeout)
-        response_str = response.read().decode()
-        return json.loads(response_str)
-
-    def detect(self, q: str, timeout: int | None = None) -> Any:
-        """Detect the language of a single text.
-
-        Args:
-            q (str): Text to detect
-            timeout (int): Request timeout in seconds
-
-        Returns:
-            The detected languages ex: [{"confidence": 0.6, "language": "en"}]
-        """
-        url = self.url + "detect"
-        params: Dict[str, str] = {"q": q}
-        if self.api_key is not None:
-            params["api_key"] = self.api_key
-        url_params = parse.urlencode(params)
-        req = request.Request(url, data=url_params.encode())
-        response = request.urlopen(req, timeout=timeout)
-        response_str = response.read().decode()
-        return json.loads(response_str)
-
-    def languages(self, timeout: int | None = None) -> Any:
-        """Retrieve list of supported languages.
-
-        Args:
-            timeout (int): Request timeout in seconds
-
-        Returns:
-            A list of available languages ex: [{"code":"en", "name":"English"}]
-        """
-        url = self.url + "languages"
-        params: Dict[str, str] = dict()
-        if self.api_key is not None:
-            params["api_key"] = self.api_key
-        url_params = parse.urlencode(params)
-        req = request.Request(url, data=url_params.encode(), method="GET")
-        response = request.urlopen(req, timeout=timeout)
-        response_str = response.read().decode()
-        return json.loads(response_str)
+import hashlib
+import queue
+import signal
+import multiprocessing
+import threading
+import shutil
+import random
+import re
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict
+from urllib import parse, error
+
+# The content-type handlers import their heavy dependencies (eml_parser, bs4, PyPDF2, python-magic, openai) on
+# first use, so that runs which do not need them do not pay for loading them.
+from attachment_store import AttachmentCapture, AttachmentStore
+from completion_journal import CompletionJournal
+from language_identification import LanguageGuesser
+from mime_streaming import MimeStreamParser, SpooledPart
+from output_store import DEFAULT_SHARDS, REQUIREMENTS, SUPPORTED, PackedOutputStore
+from output_writer import OutputWriter
+from run_metrics import Metrics
+from segment_classification import is_noop_text
+from server_pool import REJECTED_STATUSES, ServerPool, ServerUnavailable, parse_server
+from spam_triage import SpamTriage
+from text_segmentation import join_pieces, split_paragraph, text_blocks, wrap_like
+from translation_memory import TranslationMemory
+from work_queue import WorkQueue
+from work_scheduling import WorkProgress, schedule_emails
 
 
 parser = argparse.ArgumentParser(
@@ -110,13 +53,56 @@ parser.add_argument(
 parser.add_argument(
 '-s',
     '--server',
-    help="https URL to the translation server",
-    required=True
+    help="https URL to the translation server.  Repeat it to share the batches between several servers, each "
+         "optionally followed by a comma and its weight, its capacity relative to the others (1 by default): "
+         "-s https://big:5000,4 -s https://small:5000,1.",
+    required=True,
+    action='append'
+)
+parser.add_argument(
+    '--server-timeout',
+    help="Optional.  Seconds after which a translation request is abandoned and retried, on another server when "
+         "there are several.  0 for no limit.",
+    required=False,
+    default=300
 )
 parser.add_argument(
     '-a',
     '--openaiurl',
-    help="Optional.  Experimental.  When specified, this tool will mark spam emails as spam.",
+    help="Optional.  Experimental.  URL of an OpenAI compatible server (such as LM Studio).  When specified, "
+         "this tool will mark spam emails as spam: the verdict and a summary of each email are saved in its "
+         "-triage.json file.",
+    required=False
+)
+parser.add_argument(
+    '--ai-model',
+    help="Optional.  Model used for spam triage.",
+    required=False,
+    default="QuantFactory/Meta-Llama-3-8B-Instruct-GGUF"
+)
+parser.add_argument(
+    '--ai-concurrency',
+    help="Optional.  Maximum number of spam triage requests in flight.",
+    required=False,
+    default=2
+)
+parser.add_argument(
+    '--ai-batch-emails',
+    help="Optional.  Maximum number of emails triaged in one request.  1 for models which do not follow "
+         "instructions about several emails well.",
+    required=False,
+    default=4
+)
+parser.add_argument(
+    '--ai-tokens',
+    help="Optional.  Approximate number of tokens of each email sent for spam triage.  Longer emails are "
+         "truncated.",
+    required=False,
+    default=512
+)
+parser.add_argument(
+    '--ai-cache',
+    help="Optional.  Path of an SQLite database caching spam triage verdicts by email content.",
     required=False
 )
 parser.add_argument(
@@ -133,6 +119,27 @@ parser.add_argument(
     required=False,
     default=0
 )
+parser.add_argument(
+    '--languages-ttl',
+    help="Optional.  Seconds during which the list of languages supported by the server is read from a cache "
+         "file instead of being requested from the server.  0 to always request it.",
+    required=False,
+    default=86400
+)
+parser.add_argument(
+    '--metadata-cache',
+    help="Optional.  Directory of the cache of server metadata.",
+    required=False,
+    default=os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                         "eml-translator")
+)
+parser.add_argument(
+    '--startup-budget',
+    help="Optional.  Seconds the translator may spend starting, from loading its modules until it looks for "
+         "emails, before it warns about it.",
+    required=False,
+    default=0.5
+)
 parser.add_argument(
     '-p',
     '--profile',
@@ -140,8 +147,312 @@ parser.add_argument(
     required=False,
     default=False,
     action=argparse.BooleanOptionalAction)
+parser.add_argument(
+    '-c',
+    '--cache',
+    help="Optional.  Path to a translation memory database.  Segments already translated are not sent to the "
+         "server again.  Can be shared by all replicas.",
+    required=False
+)
+parser.add_argument(
+    '--cache-size',
+    help="Optional.  Maximum number of segments kept in the translation memory.  Least recently used segments are "
+         "evicted first.",
+    required=False,
+    default=1000000
+)
+parser.add_argument(
+    '-n',
+    '--inflight',
+    help="Optional.  Number of translation batches sent to the server concurrently.  Batches are translated while "
+         "the following emails are parsed.",
+    required=False,
+    default=1
+)
+parser.add_argument(
+    '-w',
+    '--workers',
+    help="Optional.  Number of worker processes translating emails in parallel.",
+    required=False,
+    default=1
+)
+parser.add_argument(
+    '-q',
+    '--queue',
+    help="Optional.  Path to a shared work queue database.  Replicas using the same queue claim emails from it, "
+         "largest first, instead of splitting the archive with --replicas/--index.  Replicas can join or leave "
+         "at any time.",
+    required=False
+)
+parser.add_argument(
+    '--lease',
+    help="Optional.  Seconds after which emails claimed by a replica that stopped responding are claimed again.",
+    required=False,
+    default=300
+)
+parser.add_argument(
+    '--claim-bytes',
+    help="Optional.  Number of bytes of emails claimed at once from the work queue.",
+    required=False,
+    default=4 * 1024 * 1024
+)
+parser.add_argument(
+    '-j',
+    '--journal',
+    help="Optional.  Path to a completion journal.  Emails recorded as completed with an unchanged size and "
+         "modification time are skipped without looking for their output files.",
+    required=False
+)
+parser.add_argument(
+    '--watch',
+    help="Optional.  After translating the emails of the directory, keep running and translate the emails which "
+         "are added or modified, until stopped with SIGTERM or Ctrl-C.",
+    required=False,
+    default=False,
+    action=argparse.BooleanOptionalAction)
+parser.add_argument(
+    '--watch-mode',
+    help="Optional.  How changes are noticed with --watch: inotify, poll to scan the directory periodically (for "
+         "network file systems), or auto to poll only when inotify is not available.",
+    required=False,
+    choices=["auto", "inotify", "poll"],
+    default="auto"
+)
+parser.add_argument(
+    '--watch-interval',
+    help="Optional.  Seconds between scans of the directory when polling.",
+    required=False,
+    default=5
+)
+parser.add_argument(
+    '--settle',
+    help="Optional.  Seconds an email must stay unchanged before it is translated with --watch, so that emails "
+         "being copied are not read half written.",
+    required=False,
+    default=2
+)
+parser.add_argument(
+    '--import-markers',
+    help="Optional.  Record emails which already have a marker file as completed in the journal.",
+    required=False,
+    default=False,
+    action=argparse.BooleanOptionalAction)
+parser.add_argument(
+    '--pack-emails',
+    help="Optional.  Number of emails whose segments are packed together into translation batches.  0 sends "
+         "separate batches for each part of an email.",
+    required=False,
+    default=1
+)
+parser.add_argument(
+    '--attachment-store',
+    help="Optional.  Directory of a content-addressed store of translated attachments.  PDF and docx attachments "
+         "found in several emails are only translated once.",
+    required=False
+)
+parser.add_argument(
+    '--store-link',
+    help="Optional.  How attachments are materialized from the attachment store: hardlink, reflink or copy.",
+    required=False,
+    default="hardlink",
+    choices=["hardlink", "reflink", "copy"]
+)
+parser.add_argument(
+    '--pdf-workers',
+    help="Optional.  Number of processes extracting the pages of a PDF in parallel.",
+    required=False,
+    default=1
+)
+parser.add_argument(
+    '--pdf-max-pages',
+    help="Optional.  Only the first pages of a PDF are translated.  0 for no limit.",
+    required=False,
+    default=0
+)
+parser.add_argument(
+    '--pdf-timeout',
+    help="Optional.  Seconds after which the extraction of a PDF stops.  The pages extracted so far are still "
+         "translated.  0 for no limit.",
+    required=False,
+    default=0
+)
+parser.add_argument(
+    '--schedule',
+    help="Optional.  Order of the emails: \"cost\" translates the emails estimated the longest to translate first, "
+         "from their size and the MIME headers of their first bytes, so that workers finish together; \"archive\" "
+         "keeps the order of the archive.",
+    required=False,
+    choices=["cost", "archive"],
+    default="cost"
+)
+parser.add_argument(
+    '--defer-above',
+    help="Optional.  Emails estimated to take more than this many seconds are translated after all the others, "
+         "so that they do not hold the rest of the archive back.  0 defers none.",
+    required=False,
+    default=0
+)
+parser.add_argument(
+    '--part-timeout',
+    help="Optional.  Seconds after which the text extraction of an attachment stops, like --pdf-timeout, except "
+         "for deferred emails, which are expected to be slow.  0 for no limit.",
+    required=False,
+    default=0
+)
+parser.add_argument(
+    '--batch-size',
+    help="Optional.  Initial number of characters per translation batch.  The batch size then adapts to the "
+         "latency and errors of the server.",
+    required=False,
+    default=8192
+)
+parser.add_argument(
+    '--max-batch-size',
+    help="Optional.  Maximum number of characters per translation batch.",
+    required=False,
+    default=65536
+)
+parser.add_argument(
+    '--max-segment',
+    help="Optional.  Maximum number of characters per segment.  Longer paragraphs are split at sentence "
+         "boundaries and their pieces translated separately.",
+    required=False,
+    default=2048
+)
+parser.add_argument(
+    '--batch-latency',
+    help="Optional.  Target number of seconds per translation batch.",
+    required=False,
+    default=15
+)
+parser.add_argument(
+    '--retries',
+    help="Optional.  Number of times a failing translation request is retried, with an exponential backoff, "
+         "before the emails with segments in it are left for the next run.  The run stops when no server answers "
+         "anymore.  0 retries forever.",
+    required=False,
+    default=20
+)
+parser.add_argument(
+    '--batch-log',
+    help="Optional.  Path of a JSON lines file recording the outcome of each translation batch, including the "
+         "segments which could not be translated.",
+    required=False
+)
+parser.add_argument(
+    '--langid-threshold',
+    help="Optional.  Confidence (0 to 1) above which the language of segments is identified locally before "
+         "batching.  English segments are then not sent to the server, and others are sent with an explicit "
+         "source language.  Only used when the language is auto detected.  Disabled by default (0), 0.3 is a "
+         "good start.",
+    required=False,
+    default=0
+)
+parser.add_argument(
+    '--stream-threshold',
+    help="Optional.  Emails larger than this number of bytes are decoded part by part instead of being read "
+         "whole, ex: 0 to decode every email this way.",
+    required=False,
+    default=32 * 1024 * 1024
+)
+parser.add_argument(
+    '--spool-size',
+    help="Optional.  Parts of emails decoded part by part which are larger than this number of bytes are "
+         "written to temporary files instead of being held in memory.",
+    required=False,
+    default=8 * 1024 * 1024
+)
+parser.add_argument(
+    '--spool-dir',
+    help="Optional.  Directory of the temporary files of spooled parts.  Defaults to the system temporary "
+         "directory.",
+    required=False
+)
+parser.add_argument(
+    '--html-parser',
+    help="Optional.  Parser of HTML parts.  auto uses lxml when it is installed, and html.parser otherwise.",
+    required=False,
+    choices=["auto", "lxml", "html.parser"],
+    default="auto"
+)
+parser.add_argument(
+    '--write-queue',
+    help="Optional.  Number of translated emails which can wait for a background thread to write their outputs "
+         "before translation waits for it.  0 writes outputs on the main thread.",
+    required=False,
+    default=16
+)
+parser.add_argument(
+    '--fsync',
+    help="Optional.  none: let the operating system flush outputs.  email: flush the outputs of an email before "
+         "writing its marker, so that a marker always means complete outputs after a crash.  file: also flush "
+         "each output as soon as it is written.",
+    required=False,
+    choices=["none", "email", "file"],
+    default="none"
+)
+parser.add_argument(
+    '--output-store',
+    help="Optional.  Directory of a packed output store.  The outputs of each email are committed at once to "
+         "SQLite files in it, instead of being written next to the email with a marker file.  "
+         "eml-output-export.py writes them back next to the emails.",
+    required=False
+)
+parser.add_argument(
+    '--output-shards',
+    help="Optional.  Number of SQLite files of a new packed output store.  Worker processes and replicas writing "
+         "to the same file wait for each other.",
+    required=False,
+    default=DEFAULT_SHARDS
+)
+parser.add_argument(
+    '-v',
+    '--verbose',
+    help="Optional.  Log every email, part, batch and saved file, instead of periodic progress.",
+    required=False,
+    action='store_true'
+)
+parser.add_argument(
+    '--metrics-file',
+    help="Optional.  Path of a JSON file where snapshots of the stage timings, batch histograms, cache and noop "
+         "ratios and per content type throughput are written periodically.",
+    required=False
+)
+parser.add_argument(
+    '--metrics-interval',
+    help="Optional.  Seconds between two metrics snapshots.",
+    required=False,
+    default=30
+)
+parser.add_argument(
+    '--metrics-port',
+    help="Optional.  Local port serving the metrics in the Prometheus format, ex: 9464.",
+    required=False
+)
 args = parser.parse_args()
 print("Will translate all files in " + args.path, flush=True)
+metrics = Metrics()
+if args.verbose:
+    # Verbose lines are written when the output buffer fills, or with the next flushed message.
+    sys.stdout.reconfigure(line_buffering=False)
+PROGRESS_INTERVAL = 10
+last_progress = 0.0
+
+
+def log(message):
+    if args.verbose:
+        print(message)
+
+
+def print_progress(message):
+    """Print a progress message, at most every PROGRESS_INTERVAL seconds unless verbose."""
+    global last_progress
+    if args.verbose:
+        log(message)
+    elif time.time() - last_progress >= PROGRESS_INTERVAL:
+        last_progress = time.time()
+        print(message, flush=True)
+
 translation_marker = "\n[AUTO_TRANSLATED] FROM "
 profiling = args.profile
 
@@ -150,12 +461,81 @@ if args.language is not None:
     source_language = args.language.lower()
 target_language = "en"
 
-lt = LibreTranslateAPI(args.server)
-supported_languages = lt.languages()
+if args.spool_dir is not None:
+    # Otherwise every spooled part would fail, and with it the rest of its email.
+    os.makedirs(args.spool_dir, exist_ok=True)
+
+html_parser = args.html_parser
+if html_parser == "auto":
+    # lxml is a C parser, much faster than the pure Python html.parser.
+    html_parser = "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+
+
+def server_languages(api: ServerPool, cache_dir: str, ttl: float) -> list:
+    """Return the languages supported by the translation server, cached on disk for ttl seconds.
 
-ai_client = None
-if args.openaiurl is not None:
-    ai_client = OpenAI(base_url=args.openaiurl, api_key="lm-studio")
+    The cache saves a round trip to the server at the start of every replica.  It is shared by the replicas of
+    a machine, with one file per list of server URLs.  With several servers, the languages of each are requested
+    either way, in the background when they are cached, so that the servers not answering get no batches.
+    """
+    cache_path = os.path.join(cache_dir, "languages-" + hashlib.sha256(api.url.encode("utf-8")).hexdigest()[:16] +
+                              ".json")
+    if ttl > 0:
+        try:
+            if time.time() - os.path.getmtime(cache_path) < ttl:
+                with open(cache_path, "r", encoding="utf-8") as cache_file:
+                    languages = json.load(cache_file)
+                if len(api.endpoints) > 1:
+                    api.probe()
+                return languages
+        except (OSError, ValueError):
+            pass
+    languages = api.languages()
+    if ttl > 0:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(languages, cache_file)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            print("Could not cache the languages of the server: " + str(e), flush=True)
+    return languages
+
+
+try:
+    servers = [parse_server(server) for server in args.server]
+except ValueError as e:
+    parser.error(str(e))
+server_pool = ServerPool(servers, int(args.inflight),
+                         float(args.server_timeout) if float(args.server_timeout) > 0 else None)
+supported_languages = server_languages(server_pool, args.metadata_cache, float(args.languages_ttl))
+language_names = {language["code"]: language["name"] for language in supported_languages}
+
+translation_memory = None
+if args.cache is not None:
+    translation_memory = TranslationMemory(args.cache, int(args.cache_size))
+
+attachment_store = None
+attachment_capture = None
+if args.attachment_store is not None:
+    attachment_store = AttachmentStore(args.attachment_store, args.store_link)
+
+output_store = None
+if args.output_store is not None:
+    if not SUPPORTED:
+        print("--output-store needs " + REQUIREMENTS + ".", flush=True)
+        sys.exit(1)
+    output_store = PackedOutputStore(args.output_store, args.path, int(args.output_shards),
+                                     "NORMAL" if args.fsync == "none" else "FULL")
+
+language_guesser = None
+if source_language == "auto" and float(args.langid_threshold) > 0:
+    language_guesser = LanguageGuesser(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                    "language-profiles.json"),
+                                       float(args.langid_threshold),
+                                       list(language_names))
 
 
 def numeric_hash(input):
@@ -171,118 +551,555 @@ def replica_is_owner(input):
     return hash == int(args.index)
 
 
-def ai_email_summarize(text):
-    if ai_client is None:
+def save_file(file_path, data):
+    if profiling:
+        return
+
+    entry = output_writer.current_entry()
+    if entry is not None:
+        entry.add(file_path, data if isinstance(data, SpooledPart) else
+                  data.encode("utf-8") if isinstance(data, str) else data)
+        log(file_path + " has been added to the output store.")
         return
-    completion = ai_client.chat.completions.create(
-        model="QuantFactory/Meta-Llama-3-8B-Instruct-GGUF",
-        messages=[
-            {"role": "system", "content": "You will summarize everything I say under 256 characters."},
-            {"role": "user", "content": text}
-        ],
-        temperature=0.7,
-    )
+    with metrics.timer("save_file"):
+        # Write to a temporary file first, so that an interrupted run never leaves a half-written output.
+        temp_path = file_path + "." + str(os.getpid()) + ".tmp"
+        if isinstance(data, SpooledPart):
+            shutil.copyfile(data.path, temp_path)
+        else:
+            translated_file = open(temp_path, "wb")
+            if isinstance(data, str):
+                translated_file.write(data.encode("utf-8"))
+            else:
+                translated_file.write(data)
+            translated_file.close()
+        os.replace(temp_path, file_path)
+    log(file_path + " has been saved.")
+
+
+def publish_file(temp_path, file_path):
+    """Move an output written to a temporary file in place, or into the output store.
+
+    Returns:
+        The path the output can be read from until its email is committed.
+    """
+    entry = output_writer.current_entry()
+    if entry is None:
+        os.replace(temp_path, file_path)
+        return file_path
+    entry.add_file(file_path, temp_path, True)
+    return temp_path
+
+
+class SegmentRejected(Exception):
+    """The server failed on the content of a batch, rather than being unavailable."""
+
+
+class BatchFailed(Exception):
+    """A batch kept failing after all the retries, while a translation server still answers."""
+
+
+class TranslationUnavailable(Exception):
+    """No translation server answers anymore."""
+
+
+class BatchController:
+    """Adapts the size of the translation batches to the latency and errors of the server.
+
+    Batches grow while they complete faster than the target latency and shrink when they are slower or fail.
+    Per-batch outcomes are counted, and optionally logged, so that untranslated text can be accounted for.
+    """
+
+    counter_names = ("batches", "requests", "retries", "bisections", "quarantined_segments",
+                     "quarantined_characters", "failed_segments", "failed_characters")
+    MIN_BATCH_SIZE = 512
+
+    def __init__(self, batch_size, max_batch_size, target_latency, retries, log_path):
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.max_retries = retries
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.retries = 0
+        self.bisections = 0
+        self.quarantined_segments = 0
+        self.quarantined_characters = 0
+        self.failed_segments = 0
+        self.failed_characters = 0
+
+    def record_latency(self, characters, latency):
+        with self.lock:
+            self.requests += 1
+            # Only batches close to the current size tell whether it is too small.
+            if latency < self.target_latency / 2 and characters >= self.batch_size / 2:
+                self.batch_size = min(self.max_batch_size, int(self.batch_size * 1.25))
+            elif latency > self.target_latency:
+                self.batch_size = max(BatchController.MIN_BATCH_SIZE, int(self.batch_size / 2))
+
+    def record_failure(self, shrink=True):
+        with self.lock:
+            self.requests += 1
+            self.retries += 1
+            if shrink:
+                self.batch_size = max(BatchController.MIN_BATCH_SIZE, int(self.batch_size / 2))
+
+    def record_rejection(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_outcome(self, texts, attempts, bisections, quarantined, failed, latency):
+        with self.lock:
+            self.batches += 1
+            if len(quarantined) > 0:
+                # Smaller batches lose less time bisecting around the segments the server fails on.
+                self.batch_size = max(BatchController.MIN_BATCH_SIZE, int(self.batch_size / 2))
+            self.bisections += bisections
+            self.quarantined_segments += len(quarantined)
+            self.quarantined_characters += sum(len(texts[index]) for index in quarantined)
+            self.failed_segments += len(failed)
+            self.failed_characters += sum(len(texts[index]) for index in failed)
+            if self.log_path is None:
+                return
+            status = "ok"
+            if len(failed) > 0:
+                status = "failed"
+            elif len(quarantined) > 0:
+                status = "partial"
+            outcome = {"time": time.time(), "segments": len(texts), "characters": sum(len(text) for text in texts),
+                       "latency": round(latency, 3), "attempts": attempts, "bisections": bisections,
+                       "status": status, "failed": len(failed),
+                       "quarantined": [{"characters": len(texts[index]), "text": texts[index][:200]}
+                                       for index in quarantined]}
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(outcome) + "\n")
+
+    def backoff(self, attempt):
+        # Exponential backoff with full jitter, capped at one minute.
+        return random.uniform(0, min(60.0, 2.0 ** attempt))
+
+    def report(self) -> str:
+        return (str(self.batches) + " translation batches in " + str(self.requests) + " requests (" +
+                str(self.retries) + " retries, " + str(self.bisections) + " bisections).  " +
+                str(self.quarantined_segments) + " segments (" + str(self.quarantined_characters) +
+                " characters) could not be translated, " + str(self.failed_segments) + " segments (" +
+                str(self.failed_characters) + " characters) of failed batches are left for the next run.  "
+                "Final batch size: " + str(self.batch_size) + ".")
+
+
+def request_translation(texts, source):
+    """Send one translation request, retrying with backoff while the server is unavailable.
+
+    Raises:
+        SegmentRejected: When the server fails on the content of the batch.
+        BatchFailed: When the retries are exhausted while a server still answers.
+        TranslationUnavailable: When the retries are exhausted and no server answers.
+    """
+    attempt = 0
+    characters = sum(len(text) for text in texts)
+    while True:
+        start = time.time()
+        try:
+            with metrics.timer("translation"):
+                result = server_pool.translate(texts, source, target_language)
+            batch_controller.record_latency(characters, time.time() - start)
+            return result, attempt + 1
+        except error.HTTPError as e:
+            if e.status in REJECTED_STATUSES:
+                batch_controller.record_rejection()
+                raise SegmentRejected(str(e))
+            failure = e
+        except Exception as e:
+            failure = e
+        # Another server may take the batch right away, without it being made smaller.
+        failover = not isinstance(failure, ServerUnavailable) and len(server_pool.endpoints) > 1 and \
+            server_pool.available()
+        batch_controller.record_failure(shrink=not failover)
+        attempt += 1
+        if 0 < batch_controller.max_retries < attempt:
+            message = "Translation failed after " + str(attempt) + " attempts: " + str(failure)
+            if server_pool.answering():
+                raise BatchFailed(message)
+            raise TranslationUnavailable(message)
+        if failover:
+            log("API call failed, retrying on another server: " + str(failure))
+            continue
+        delay = batch_controller.backoff(attempt)
+        print("API call failed.  Retrying after " + "{:.1f}".format(delay) + " seconds.", failure, flush=True)
+        time.sleep(delay)
 
-    print(completion.choices[0].message.content, flush=True)
 
+def translate_text(texts, source):
+    """Translate a batch of segments.
 
-def save_file(file_path, data):
-    if profiling:
-        return
+    When the server fails on the content of the batch, the batch is bisected until the failing segments are
+    isolated.  Those are quarantined: left untranslated and listed in "untranslated".  The segments of requests
+    which kept failing otherwise are left untranslated too, and listed in "failed" as well.
 
-    translated_file = open(file_path, "wb")
-    if isinstance(data, str):
-        translated_file.write(data.encode("utf-8"))
-    else:
-        translated_file.write(data)
-    translated_file.close()
-    print(file_path + " has been saved.", flush=True)
+    Raises:
+        TranslationUnavailable: When no server answers anymore.
+    """
+    start = time.time()
+    translations = list(texts)
+    detected_languages = [None] * len(texts)
+    quarantined = []
+    failed = []
+    counters = {"attempts": 0, "bisections": 0}
 
+    def translate_range(first, last):
+        try:
+            result, attempts = request_translation(texts[first:last], source)
+            counters["attempts"] += attempts
+        except BatchFailed as e:
+            counters["attempts"] += batch_controller.max_retries + 1
+            print(str(last - first) + " segments are left for the next run.  " + str(e), flush=True)
+            failed.extend(range(first, last))
+            return
+        except SegmentRejected:
+            counters["attempts"] += 1
+            if last - first == 1:
+                quarantined.append(first)
+                return
+            counters["bisections"] += 1
+            middle = (first + last) // 2
+            translate_range(first, middle)
+            translate_range(middle, last)
+            return
+        for idx in range(last - first):
+            translation, detected_language = translation_entry(result, idx)
+            translations[first + idx] = translation
+            detected_languages[first + idx] = detected_language
+
+    translate_range(0, len(texts))
+    batch_controller.record_outcome(texts, counters["attempts"], counters["bisections"], quarantined, failed,
+                                    time.time() - start)
+    if len(quarantined) > 0:
+        print(str(len(quarantined)) + " segments could not be translated and were quarantined.", flush=True)
+    result = {"translatedText": translations, "detectedLanguage": detected_languages,
+              "untranslated": quarantined + failed, "failed": failed}
+    return result
 
-def string_has_text(string):
-    for char in string:
-        if ord(char)>=65 and ord(char)<=90:
-            return True
-        if ord(char)>=97 and ord(char)<=122:
-            return True
-        if ord(char)>0xC0:
-            return True
 
+def translation_entry(result, idx):
+    """Extract the translated text and detected language (if any) of one entry of a server response."""
+    translation = result["translatedText"][idx]
+    if isinstance(translation, dict):
+        return translation["translatedText"], translation["detectedLanguage"]
+    if "detectedLanguage" in result:
+        return translation, result["detectedLanguage"][idx]
+    return translation, None
 
-def is_noop_text(text):
-    return len(text)==0 or not string_has_text(text) or is_english_charpoint(text)
 
+def batch_translation(result, idx, source):
+    """Extract the translated text and source language of one entry of a translate_text result."""
+    translation = result["translatedText"][idx]
+    if source != "auto":
+        return translation, source
+    detected_language = result["detectedLanguage"][idx]
+    if detected_language is None:
+        return translation, "auto"
+    return translation, detected_language["language"]
 
-def translate_text(text):
-    while True:
-        try:
-            result = lt.translate(q=text,
-                                           source=source_language, target=target_language)
-            return result
-        except error.HTTPError as e:
-            if e.status == 500:
-                return {"translatedText": text}
-        except Exception as e:
-            time.sleep(1)
-            print("API call failed.  Retrying after 1 second.", e, flush=True)
-            continue
 
+def is_translated(source_lang):
+    """Whether a segment delivered with source_lang gets its translation added to the outputs.
 
-def is_english_charpoint(string):
-    for char in string:
-        if not (0 < ord(char) <= 127):
-            return False
-    return True
+    English segments are kept as they are, and so are the segments the server could not translate, which are
+    delivered with None as their source language.
+    """
+    return source_lang is not None and source_lang != "en"
 
 
 def get_language_name(language_code):
-    for language in supported_languages:
-        if language['code'] == language_code:
-            return language['name']
+    if language_code in language_names:
+        return language_names[language_code]
     return "Unknown - LibreTranslate returned no corresponding language for " + language_code
 
 
+class EmailBarrier:
+    """Holds back the outputs of an email until every translation batch holding its segments has completed.
+
+    An email with segments in a failed batch is failed: its outputs are discarded, and it is translated again by
+    the next run.
+    """
+
+    def __init__(self, pathStr):
+        self.pathStr = pathStr
+        self.pending_batches = 0
+        self.closed = False
+        self.outputs = []
+        # Outputs streamed to temporary files are removed when the email failed.
+        self.discards = []
+        self.failed = False
+        self.marker_path = None
+        self.on_complete = None
+
+    def defer(self, output, file_path=None):
+        self.outputs.append((output, file_path))
+
+    def close(self):
+        self.closed = True
+        if self.pending_batches == 0:
+            self.finalize()
+
+    def finalize(self):
+        output_writer.submit(self)
+
+
+class BatchDispatcher:
+    """Sends translation batches to the server, keeping up to max_in_flight of them in flight.
+
+    Responses are collected on the main thread, so that batch callbacks never run concurrently with the part
+    handlers that are building the next batches.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.completed = queue.Queue()
+        self.executor = None
+        if max_in_flight > 1:
+            self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="translate")
+
+    def submit(self, batch, texts, source):
+        if self.executor is None:
+            batch.complete(texts, source, translate_text(texts, source))
+            return
+        self.poll()
+        while self.in_flight >= self.max_in_flight:
+            self.process_completion()
+        self.in_flight += 1
+        future = self.executor.submit(translate_text, texts, source)
+        future.add_done_callback(lambda done: self.completed.put((batch, texts, source, done)))
+
+    def process_completion(self):
+        batch, texts, source, future = self.completed.get()
+        self.in_flight -= 1
+        batch.complete(texts, source, future.result())
+
+    def poll(self):
+        while not self.completed.empty():
+            self.process_completion()
+
+    def drain(self):
+        while self.in_flight > 0:
+            self.process_completion()
+
+
+batch_controller = BatchController(int(args.batch_size), int(args.max_batch_size), float(args.batch_latency),
+                                   int(args.retries), args.batch_log)
+batch_dispatcher = BatchDispatcher(int(args.inflight))
+output_writer = OutputWriter(int(args.write_queue), "none" if profiling else args.fsync, metrics, output_store)
+
+
+def create_spam_triage():
+    if args.openaiurl is None:
+        return None
+    from openai import OpenAI
+    return SpamTriage(OpenAI(base_url=args.openaiurl, api_key="lm-studio"), args.ai_model,
+                      int(args.ai_concurrency), int(args.ai_batch_emails), int(args.ai_tokens), args.ai_cache,
+                      metrics, save_file, log)
+
+
+spam_triage = create_spam_triage()
+# Text of the bodies of the current email, for spam triage.
+triage_texts = None
+email_barrier = None
+
+
+def save_output(file_path, data):
+    """Save an output of the current email once all of its translations have completed.
+
+    data can be a callable rendering the output, for documents that translation callbacks are still updating.
+    """
+    capture = attachment_capture
+    if capture is not None and not file_path.startswith(capture.base_path):
+        capture = None
+
+    def output():
+        if hasattr(data, "commit"):
+            # Streamed to a temporary file while translating.
+            location = data.commit(file_path)
+            rendered = b"" if profiling else Path(location)
+        else:
+            with metrics.timer("render"):
+                rendered = data() if callable(data) else data
+            save_file(file_path, rendered)
+        if capture is not None:
+            if isinstance(rendered, SpooledPart):
+                rendered = Path(rendered.path)
+            capture.artifacts[file_path[len(capture.base_path):]] = rendered
+
+    if email_barrier is None:
+        output()
+        return
+    email_barrier.defer(output, file_path)
+    if hasattr(data, "discard"):
+        email_barrier.discards.append(data.discard)
+
+
+def defer_output(output, file_path=None):
+    if email_barrier is None:
+        output()
+    else:
+        email_barrier.defer(output, file_path)
+
+
+def materialize_output(source, file_path):
+    entry = output_writer.current_entry()
+    if entry is None:
+        attachment_store.materialize_file(source, file_path)
+    else:
+        # Read from the attachment store when the email is committed, without a copy in between.
+        entry.add_file(file_path, source, False)
+
+
+def translate_attachment(pathStr, partName, data, translate):
+    """Translate an attachment with translate(), unless the attachment store already has its outputs."""
+    global attachment_capture
+    if attachment_store is None:
+        translate()
+        return
+    base_path = pathStr + "-" + partName
+    digest = attachment_store.digest(data, source_language, target_language)
+    meta = attachment_store.lookup(digest)
+    if meta is not None:
+        log("Materializing " + base_path + " from the attachment store.")
+        attachment_store.hits += 1
+        attachment_store.bytes_saved += meta["size"]
+        attachment_store.segments_saved += meta["segments"]
+        attachment_store.characters_saved += meta["characters"]
+        if not profiling:
+            entry_path = attachment_store.entry_path(digest)
+            for suffix, name in meta["artifacts"].items():
+                defer_output(lambda source=os.path.join(entry_path, name), file_path=base_path + suffix:
+                             materialize_output(source, file_path), base_path + suffix)
+        return
+    attachment_store.misses += 1
+    capture = AttachmentCapture(digest, base_path, len(data))
+    attachment_capture = capture
+    try:
+        translate()
+    finally:
+        attachment_capture = None
+    if not profiling:
+        defer_output(lambda: attachment_store.commit(capture))
+
+
 class TextBatch:
     def __init__(self):
-        print("Starting translate batch.", flush=True)
+        log("Starting translate batch.")
         self.noop_entries = []
         self.real_entries = []
         self.batch_size = 0
-        self.max_batch_size = 8192
+        self.max_batch_size = batch_controller.batch_size
+        self.unique_texts = {}
+        self.barriers = []
+        # Segments of failed requests, which fail their emails.
+        self.failed_texts = set()
 
     def add_text(self, text, context, contextParam, callback):
+        if email_barrier is not None and email_barrier not in self.barriers:
+            self.barriers.append(email_barrier)
+            email_barrier.pending_batches += 1
+        source = source_language
         if is_noop_text(text):
             self.noop_entries.append(
                 dict(text=text, result=text, source_language="", context=context, contextParam=contextParam, callback=callback))
             return True
-        else:
-            if self.batch_size>0 and self.batch_size + len(text) >= self.max_batch_size:
-                return False
-            if len(text) >= self.max_batch_size:
-                print("Reached max", flush=True)
+        elif language_guesser is not None and text not in self.unique_texts:
+            source = language_guesser.guess(text)
+            if source == "en":
+                self.noop_entries.append(
+                    dict(text=text, result=text, source_language="", context=context, contextParam=contextParam, callback=callback))
+                return True
+            if source is None:
+                source = source_language
+        if text in self.unique_texts:
+            # Identical segments are only sent once.
             self.real_entries.append(
-                dict(text=text, result=text, source_language="", context=context, contextParam=contextParam, callback=callback))
-            self.batch_size += len(text)
+                dict(text=text, result=text, source_language="", context=context, contextParam=contextParam,
+                     callback=callback, barrier=email_barrier))
             return True
+        if self.batch_size>0 and self.batch_size + len(text) >= self.max_batch_size:
+            return False
+        if len(text) >= self.max_batch_size:
+            log("Segment of " + str(len(text)) + " characters sent alone, over the batch size of " +
+                str(self.max_batch_size) + ".")
+        if attachment_capture is not None:
+            attachment_capture.segments += 1
+            attachment_capture.characters += len(text)
+        self.real_entries.append(
+            dict(text=text, result=text, source_language="", context=context, contextParam=contextParam,
+                 callback=callback, barrier=email_barrier))
+        self.unique_texts[text] = source
+        self.batch_size += len(text)
+        return True
 
     def finish(self):
-        print("Completing translate batch of size " + str(self.batch_size) + " with " + str(len(self.noop_entries)) +
-              " noop entries and " + str(len(self.real_entries)) + " real entries.", flush=True)
+        log("Completing translate batch of size " + str(self.batch_size) + " with " + str(len(self.noop_entries)) +
+              " noop entries and " + str(len(self.real_entries)) + " real entries (" + str(len(self.unique_texts)) +
+            " unique).")
         if len(self.real_entries) == 0 and len(self.noop_entries) == 0:
             return
-        if len(self.real_entries) > 0:
-            result = translate_text([entry['text'] for entry in self.real_entries])
-            translations = result["translatedText"]
-            print("Batch translation completed.", flush=True)
-
-        idx = 0
-        for entry in self.real_entries:
-            entry['result'] = translations[idx]
-            if source_language == "auto":
-                entry['source_language'] = translations[idx]["detectedLanguage"]["language"]
+        metrics.count("segments", len(self.noop_entries) + len(self.real_entries))
+        metrics.count("noop_segments", len(self.noop_entries))
+        metrics.count("duplicate_segments", len(self.real_entries) - len(self.unique_texts))
+        metrics.observe("batch_characters", self.batch_size)
+        metrics.observe("batch_segments", len(self.unique_texts))
+        # One request per source language, since a request only takes one.
+        sources: Dict[str, list] = {}
+        for text, source in self.unique_texts.items():
+            sources.setdefault(source, []).append(text)
+        self.results = {}
+        requests = []
+        for source, texts in sources.items():
+            pending_texts = texts
+            if translation_memory is not None:
+                cached = translation_memory.lookup(texts, source, target_language)
+                pending_texts = []
+                for text, hit in zip(texts, cached):
+                    if hit is None:
+                        pending_texts.append(text)
+                    else:
+                        self.results[text] = hit
+                log(str(len(texts) - len(pending_texts)) + " entries found in translation memory.")
+            if len(pending_texts) > 0:
+                requests.append((pending_texts, source))
+        self.pending_requests = len(requests)
+        if self.pending_requests == 0:
+            self.deliver()
+        for texts, source in requests:
+            batch_dispatcher.submit(self, texts, source)
+
+    def complete(self, texts, source, result):
+        log("Batch translation completed.")
+        untranslated = set(result["untranslated"])
+        for idx, text in enumerate(texts):
+            if idx in untranslated:
+                self.results[text] = (text, None)
             else:
-                entry['source_language'] = source_language
-            idx = idx + 1
+                self.results[text] = batch_translation(result, idx, source)
+        self.failed_texts.update(texts[idx] for idx in result["failed"])
+        if translation_memory is not None:
+            translation_memory.store([(text,) + self.results[text]
+                                      for idx, text in enumerate(texts) if idx not in untranslated],
+                                     source, target_language)
+        self.pending_requests -= 1
+        if self.pending_requests == 0:
+            self.deliver()
+
+    def deliver(self):
+        """Hand every segment to its callback with its translation and source language.
+
+        Segments the server could not translate are handed over unchanged, with None as their source language.
+        """
+        for entry in self.real_entries:
+            entry['result'], entry['source_language'] = self.results[entry['text']]
+            if entry['text'] in self.failed_texts and entry['barrier'] is not None:
+                entry['barrier'].failed = True
         for entry in self.noop_entries:
             entry['source_language'] = "en"
         for entry in self.noop_entries+self.real_entries:
@@ -293,158 +1110,400 @@ class TextBatch:
             source_lang = entry["source_language"]
             entry["callback"](original, result, source_lang, context, contextParam)
 
+        for barrier in self.barriers:
+            barrier.pending_batches -= 1
+            if barrier.closed and barrier.pending_batches == 0:
+                barrier.finalize()
 
-file_count = 0
 
+def translated_callback(original, result, source_lang, context, contextParam):
+    """Hand a translation to its context, a SplitParagraph or a TextLayout, which waits for the others."""
+    context.translated(contextParam, result, source_lang)
 
-def flatten(list):
-    result = ""
-    for item in list:
-        result += item
-    return result
+
+class SplitParagraph:
+    """Paragraph split in pieces translated separately, handed to its callback once all of them are translated."""
+
+    def __init__(self, text, pieces, context, contextParam, callback):
+        self.text = text
+        self.pieces = pieces
+        self.context = context
+        self.contextParam = contextParam
+        self.callback = callback
+        self.results = [None] * len(pieces)
+        self.pending = len(pieces)
+
+    def translated(self, index, result, source_lang):
+        self.results[index] = (result, source_lang)
+        self.pending -= 1
+        if self.pending > 0:
+            return
+        if any(source is None for _, source in self.results):
+            # A paragraph partly translated is left as it is rather than passed for a translation.
+            self.callback(self.text, self.text, None, self.context, self.contextParam)
+            return
+        # Pieces found to be English keep their text, the paragraph is in the language of the others.
+        sources = [source for _, source in self.results if source != "en"]
+        if len(sources) == 0:
+            self.callback(self.text, self.text, "en", self.context, self.contextParam)
+            return
+        result = join_pieces(self.pieces, [result for result, _ in self.results])
+        self.callback(self.text, result, sources[0], self.context, self.contextParam)
+
+
+class SegmentPacker:
+    """Packs the segments of the parts of up to max_emails emails into full translation batches.
+
+    With max_emails set to 0, each part of an email is sent in its own batches.
+    """
+
+    def __init__(self, max_emails):
+        self.max_emails = max_emails
+        self.batch = None
+        self.packed_emails = 0
+
+    def add_text(self, text, context, contextParam, callback):
+        if self.batch is None:
+            self.batch = TextBatch()
+        if not self.batch.add_text(text, context, contextParam, callback):
+            self.batch.finish()
+            self.batch = TextBatch()
+            self.packed_emails = 0
+            self.batch.add_text(text, context, contextParam, callback)
+
+    def add_paragraph(self, text, context, contextParam, callback):
+        """Add a paragraph, split at sentence boundaries when it is longer than --max-segment characters.
+
+        The callback is called once with the whole paragraph and its translation.
+        """
+        pieces = split_paragraph(text, max_segment)
+        if len(pieces) == 1:
+            self.add_text(text, context, contextParam, callback)
+            return
+        metrics.count("split_paragraphs")
+        paragraph = SplitParagraph(text, pieces, context, contextParam, callback)
+        for index, piece in enumerate(pieces):
+            self.add_text(piece.strip(), paragraph, index, translated_callback)
+
+    def part_done(self):
+        if self.max_emails == 0:
+            self.flush()
+
+    def email_done(self, barrier):
+        if self.batch is not None and barrier in self.batch.barriers:
+            self.packed_emails += 1
+            if self.packed_emails >= self.max_emails:
+                self.flush()
+
+    def flush(self):
+        if self.batch is not None:
+            self.batch.finish()
+        self.batch = None
+        self.packed_emails = 0
+
+
+segment_packer = SegmentPacker(int(args.pack_emails))
+max_segment = max(1, min(int(args.max_segment), int(args.max_batch_size)))
+
+
+def part_stream(data):
+    """Return a binary file reading the content of a part: bytes, a SpooledPart or the path of a spooled part."""
+    if isinstance(data, SpooledPart):
+        return data.open()
+    if isinstance(data, str):
+        return open(data, "rb")
+    return io.BytesIO(data)
 
 
 def docx_translated_callback(original, result, source_lang, context, contextParam):
-    if source_lang != "en":
-        context.text += " --- " + translation_marker + source_lang + ": " + result
+    if is_translated(source_lang):
+        context.annotate(contextParam, " --- " + translation_marker + source_lang + ": " + result)
+
+
+class DocxOutput:
+    """Translated docx file, written from the original zip package with the translations inserted as runs."""
+
+    def __init__(self, package):
+        self.package = package
+        # Part name to {offset: run XML} dictionaries.
+        self.insertions = {}
+
+    def annotate(self, position, text):
+        part_name, offset = position
+        self.insertions.setdefault(part_name, {})[offset] = self.package.run(part_name, text)
+
+    def commit(self, file_path):
+        if not profiling:
+            temp_path = file_path + "." + str(os.getpid()) + ".tmp"
+            with metrics.timer("save_file"):
+                with open(temp_path, "wb") as output_file:
+                    self.package.write(output_file, self.insertions)
+                location = publish_file(temp_path, file_path)
+            log(file_path + " has been saved.")
+        self.package.close()
+        return None if profiling else location
+
+    def discard(self):
+        self.package.close()
 
 
 def translate_docx(filename, partname, html_data):
+    from xml.parsers.expat import ExpatError
     try:
-        print("Opening docx " + filename + "-" + partname, flush=True)
-        doc = docx.Document(io.BytesIO(html_data))
+        log("Opening docx " + filename + "-" + partname)
+        from docx_streaming import DocxPackage
+        package = DocxPackage(part_stream(html_data))
     except Exception:
         print("Failed to open docx " + filename + "-" + partname + " Dumping it.", flush=True)
-        save_file(filename + "-" + partname, html_data)
+        save_output(filename + "-" + partname, html_data)
         return
-    batch = TextBatch()
-    paragraph_num = len(doc.paragraphs)
-    table_num = len(doc.tables)
-    print("Translating " + str(paragraph_num) + ".docx paragraphs and " + str(table_num) + " tables in email " +
-          filename + " attachment: " + partname, flush=True)
-    currentCell = None
-    visitedParagraphs = {}
-    visitedCells = {}
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if id(cell) in visitedCells:
-                    continue
-                visitedCells[id(cell)] = True
-                if cell == currentCell:
-                    continue
-                currentCell = cell
-                for paragraph in cell.paragraphs:
-                    if id(paragraph) in visitedParagraphs:
-                        continue
-                    visitedParagraphs[id(paragraph)] = True
-                    if not batch.add_text(paragraph.text, paragraph, 0, docx_translated_callback):
-                        batch.finish()
-                        batch = TextBatch()
-                        batch.add_text(paragraph.text, paragraph, 0, docx_translated_callback)
-
-    paragraph_pos = 0
-    for paragraph in doc.paragraphs:
-        paragraph_pos += 1
-        if len(paragraph.text) > 0:
-            if not batch.add_text(paragraph.text, paragraph, 0, docx_translated_callback):
-                batch.finish()
-                batch = TextBatch()
-                batch.add_text(paragraph.text, paragraph, 0, docx_translated_callback)
-    batch.finish()
-
-    if doc.inline_shapes.part is not None:
-        for key in doc.inline_shapes.part.related_parts:
-            related_part = doc.inline_shapes.part.related_parts[key]
-            if isinstance(related_part, docx.ImagePart):
-                save_file(pathStr + "-" + partname + "-" + related_part.partname.replace("/", "_"), related_part.blob)
-
-    doc.save(pathStr + "-" + partname)
-
-
-def pdf_translated_callback(original, result, source_lang, context, contextParam):
-    if source_lang != "en":
-        context[contextParam] = original + " --- " + translation_marker + source_lang + ": " + result;
-    else:
-        context[contextParam] = result;
+    output = DocxOutput(package)
+    paragraph_num = 0
+    for part_name in package.text_parts:
+        try:
+            paragraphs = package.paragraphs(part_name)
+        except ExpatError as e:
+            print("Failed to parse " + part_name + " of docx " + filename + "-" + partname + ": " + str(e) +
+                  ". Leaving it untranslated.", flush=True)
+            continue
+        paragraph_num += len(paragraphs)
+        for text, offset in paragraphs:
+            segment_packer.add_paragraph(text, output, (part_name, offset), docx_translated_callback)
+    log("Translating " + str(paragraph_num) + " .docx paragraphs in " + str(len(package.text_parts)) +
+        " parts in email " + filename + " attachment: " + partname)
+    segment_packer.part_done()
+
+    for image in package.images():
+        save_output(filename + "-" + partname + "-" + image.replace("/", "_"),
+                    lambda image=image: package.read(image))
+
+    save_output(filename + "-" + partname, output)
+
+
+class TextLayout:
+    """Plain text translated paragraph by paragraph, as split by text_blocks.
+
+    Once all its paragraphs are translated, the text is stored in output[index] with its original lines, each
+    translated paragraph followed by its translation laid out like it: wrapped at the same width and quoted the
+    same way.
+    """
+
+    def __init__(self, text, output, index):
+        self.lines = text.splitlines(keepends=True)
+        self.blocks = text_blocks(self.lines)
+        self.translations = [None] * len(self.blocks)
+        self.pending = len(self.blocks)
+        self.output = output
+        self.index = index
+
+    def translate(self):
+        if self.pending == 0:
+            self.output[self.index] = "".join(self.lines)
+            return
+        for number, block in enumerate(self.blocks):
+            segment_packer.add_paragraph(block.text, self, number, translated_callback)
+
+    def translated(self, number, result, source_lang):
+        if is_translated(source_lang):
+            self.translations[number] = translation_marker.strip() + " " + source_lang + ": " + result
+        self.pending -= 1
+        if self.pending == 0:
+            self.output[self.index] = self.render()
+
+    def render(self):
+        lines = list(self.lines)
+        for block, translation in zip(self.blocks, self.translations):
+            if translation is None:
+                continue
+            last_line = lines[block.end - 1]
+            body = last_line.rstrip("\r\n")
+            newline = last_line[len(body):] or "\n"
+            lines[block.end - 1] = body + " --- " + newline + newline.join(wrap_like(block, translation)) + newline
+        return "".join(lines)
+
+
+class PdfTextOutput:
+    """Translated text of a PDF, streamed to a temporary file in page order as the translations complete."""
+
+    def __init__(self, file_path, page_count):
+        self.pages = {}
+        self.next_page = 0
+        self.page_count = page_count
+        self.temp_path = file_path + "." + str(os.getpid()) + ".tmp"
+        self.file = None if profiling else open(self.temp_path, "wb")
+
+    def __setitem__(self, index, text):
+        if self.file is None:
+            return
+        self.pages[index] = text
+        while self.next_page in self.pages:
+            self.file.write(self.pages.pop(self.next_page).encode("utf-8"))
+            self.next_page += 1
+
+    def commit(self, file_path):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        location = publish_file(self.temp_path, file_path)
+        log(file_path + " has been saved.")
+        return location
+
+    def discard(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.temp_path)
+
+
+def pdf_page_has_text_layer(page):
+    """Cheaply tell whether a page can hold text: scanned pages only have images and no fonts."""
+    resources = page.get("/Resources")
+    if resources is None:
+        return True
+    resources = resources.get_object()
+    if "/Font" in resources:
+        return True
+    xobjects = resources.get("/XObject")
+    if xobjects is not None:
+        for xobject in xobjects.get_object().values():
+            if xobject.get_object().get("/Subtype") == "/Form":
+                return True
+    return False
+
+
+def extract_pdf_page(page):
+    if not pdf_page_has_text_layer(page):
+        return ""
+    return page.extract_text()
+
+
+def extract_pdf_pages(pdf_data, first, last):
+    """Extract the text of pages first to last - 1 of a PDF, in a PDF worker process.
+
+    pdf_data is the PDF, or the path of the temporary file it is spooled to.
+    """
+    from PyPDF2 import PdfReader
+    reader = PdfReader(part_stream(pdf_data))
+    return [extract_pdf_page(reader.pages[index]) for index in range(first, last)]
+
+
+pdf_pool = None
+# Limit of the extraction of attachments, lifted for deferred emails.
+part_timeout = float(args.part_timeout)
+
+
+def pdf_page_texts(reader, pdf_data, page_count, deadline):
+    """Yield the text of the pages of a PDF in page order, or None for pages not extracted before the deadline."""
+    global pdf_pool
+    pdf_workers = int(args.pdf_workers)
+    if pdf_workers <= 1 or page_count < 8:
+        for index in range(page_count):
+            if deadline is not None and time.time() > deadline:
+                yield None
+            else:
+                yield extract_pdf_page(reader.pages[index])
+        return
+
+    if pdf_pool is None:
+        pdf_pool = multiprocessing.get_context("fork").Pool(pdf_workers)
+    chunk_size = max(4, -(-page_count // (pdf_workers * 4)))
+    if isinstance(pdf_data, SpooledPart):
+        pdf_data = pdf_data.path
+    chunks = [(pdf_data, first, min(first + chunk_size, page_count)) for first in range(0, page_count, chunk_size)]
+    results = pdf_pool.imap(star_extract_pdf_pages, chunks)
+    for pdf_data, first, last in chunks:
+        try:
+            texts = results.next(None if deadline is None else max(0.0, deadline - time.time()))
+        except multiprocessing.TimeoutError:
+            # The only way to stop a page stuck in extract_text is to stop its process.
+            pdf_pool.terminate()
+            pdf_pool = None
+            for _ in range(first, page_count):
+                yield None
+            return
+        for text in texts:
+            yield text
+
+
+def star_extract_pdf_pages(chunk):
+    return extract_pdf_pages(*chunk)
 
 
 def translate_pdf(filename, partname, pdf_data):
-    batch = TextBatch()
-    print("Opening PDF " + filename + "-" + partname, flush=True)
-    reader = PdfReader(io.BytesIO(pdf_data))
-    print("Translating " + str(len(reader.pages)) + " paragraphs in email " + filename + " attachment: " + partname, flush=True)
-    output_text = ["" for _ in range(len(reader.pages))]
-    index = 0
-    for page in reader.pages:
-        text = page.extract_text()
-        if not batch.add_text(
-                text,
-                output_text,
-                index,
-                pdf_translated_callback):
-            batch.finish()
-            batch = TextBatch()
-            batch.add_text(text,
-                output_text,
-                index,
-                pdf_translated_callback)
-        index=index+1
-
-    batch.finish()
-    return flatten(output_text)
+    from PyPDF2 import PdfReader
+    log("Opening PDF " + filename + "-" + partname)
+    reader = PdfReader(part_stream(pdf_data))
+    page_count = len(reader.pages)
+    log("Translating " + str(page_count) + " paragraphs in email " + filename + " attachment: " + partname)
+    max_pages = int(args.pdf_max_pages)
+    if 0 < max_pages < page_count:
+        print("Only translating the first " + str(max_pages) + " pages of " + filename + "-" + partname, flush=True)
+        page_count = max_pages
+    timeouts = [timeout for timeout in (float(args.pdf_timeout), part_timeout) if timeout > 0]
+    deadline = None
+    if len(timeouts) > 0:
+        deadline = time.time() + min(timeouts)
+
+    output_text = PdfTextOutput(filename + "-" + partname + "-translated-content.txt", page_count)
+    try:
+        timed_out = 0
+        index = 0
+        for text in pdf_page_texts(reader, pdf_data, page_count, deadline):
+            if text is None:
+                timed_out += 1
+                output_text[index] = ""
+            elif len(text) == 0:
+                output_text[index] = ""
+            else:
+                TextLayout(text, output_text, index).translate()
+            index=index+1
+        if timed_out > 0:
+            print("Timed out extracting " + str(timed_out) + " pages of " + filename + "-" + partname, flush=True)
+    except Exception:
+        output_text.discard()
+        raise
+
+    segment_packer.part_done()
+    return output_text
 
 
 def html_translated_callback(original, result, source_lang, context, contextParam):
-    if source_lang != "en":
-        context.replace_with(original + " --- " + translation_marker + source_lang + ": " + result)
+    # The original text stays in place with its markup, the translation follows the last node of its block.
+    if is_translated(source_lang):
+        context.insert_after(" --- " + translation_marker + source_lang + ": " + result)
+
+
+def add_triage_text(text):
+    """Keep text of the bodies of the current email for spam triage, up to the length sent to the model."""
+    if triage_texts is not None and sum(len(kept) for kept in triage_texts) <= spam_triage.max_characters:
+        triage_texts.append(text)
 
 
 def translate_html(pathStr, partName, html_data):
-    batch = TextBatch()
-    print("Translating HTML from email " + pathStr + " attachment: " + partName, flush=True)
-    parsed_html = bs(html_data, "html.parser")
-    for x in parsed_html.findAll(string=True):
-        if x.string is not None and not isinstance(x.string, Comment) and not isinstance(x.string, Stylesheet):
-            if not batch.add_text(
-                    x.string,
-                    x.string,
-                    0,
-                    html_translated_callback):
-                batch.finish()
-                batch = TextBatch()
-                batch.add_text(
-                    x.string,
-                    x.string,
-                    0,
-                    html_translated_callback)
-
-    batch.finish()
-    return parsed_html.prettify(encoding='utf-8')
+    log("Translating HTML from email " + pathStr + " attachment: " + partName)
+    from bs4 import BeautifulSoup
+    from html_segmentation import block_segments
+    parsed_html = BeautifulSoup(html_data, html_parser)
+    # Segments are all found before any of them is translated, since translating changes the tree.
+    for text, last_node in block_segments(parsed_html):
+        segment_packer.add_paragraph(text, last_node, 0, html_translated_callback)
+        if partName.startswith("body-"):
+            add_triage_text(text)
+
+    segment_packer.part_done()
+    return lambda: parsed_html.encode("utf-8")
 
 
 def translate_plain_text(pathStr, partName, data):
-    print("Translating plaintext from email " + pathStr + " attachment: " + partName, flush=True)
-    batch = TextBatch()
-    lines = iter(data.splitlines())
-    output_text = ["" for _ in range(len(data.splitlines()))]
-    index = 0
-    for line in lines:
-        if not batch.add_text(
-                line,
-                output_text,
-                index,
-                pdf_translated_callback):
-            batch.finish()
-            batch = TextBatch()
-            batch.add_text(
-                line,
-                output_text,
-                index,
-                pdf_translated_callback)
-        index=index+1
-    batch.finish()
-    return flatten(output_text)
+    log("Translating plaintext from email " + pathStr + " attachment: " + partName)
+    if partName.startswith("body-"):
+        add_triage_text(data)
+    output_text = [""]
+    TextLayout(data, output_text, 0).translate()
+    segment_packer.part_done()
+    return lambda: output_text[0].encode("utf-8")
 
 
 def process_email_part(contentType, pathStr, partName, data):
@@ -452,41 +1511,65 @@ def process_email_part(contentType, pathStr, partName, data):
         toRemove = len(partName) - 100
         partName = partName[:28] + partName[28+toRemove:]
 
-    if isinstance(data, bytes):
+    if isinstance(data, SpooledPart) and data.path is None:
+        data = data.getvalue()
+    if isinstance(data, bytes) or isinstance(data, SpooledPart):
         if (contentType == "text/plain" or
             contentType == "application/octet-stream" or
             contentType == "text/html"):
-            contentType = magic.from_buffer(data, mime=True)
+            with metrics.timer("magic"):
+                import magic
+                if isinstance(data, SpooledPart):
+                    contentType = magic.from_file(data.path, mime=True)
+                else:
+                    contentType = magic.from_buffer(data, mime=True)
 
 
-    print("Processing email part " + partName + " with content-type " + contentType, flush=True)
+    log("Processing email part " + partName + " with content-type " + contentType)
+    start = time.perf_counter()
     match contentType:
         case "text/html":
-            translation = translate_html(pathStr, partName, data)
-            save_file(pathStr + "-" + partName, translation)
+            with metrics.timer("html"):
+                # The whole document is parsed anyway.
+                translation = translate_html(pathStr, partName,
+                                             data.getvalue() if isinstance(data, SpooledPart) else data)
+            save_output(pathStr + "-" + partName, translation)
         case "message/rfc822":
-            process_eml(pathStr + "-" + partName + ".eml", data)
-            save_file(pathStr + "-" + partName + ".eml", data)
+            if isinstance(data, SpooledPart):
+                with data.open() as eml_file:
+                    process_eml_stream(pathStr + "-" + partName + ".eml", eml_file)
+            else:
+                process_eml(pathStr + "-" + partName + ".eml", data)
+            save_output(pathStr + "-" + partName + ".eml", data)
         case "text/plain":
-            if isinstance(data, bytes):
-                save_file(pathStr + "-" + partName, data)
+            if not isinstance(data, str):
+                save_output(pathStr + "-" + partName, data)
             else :
-                translation = translate_plain_text(pathStr, partName, data)
-                save_file(pathStr + "-" + partName, translation.encode("utf-8"))
+                with metrics.timer("plain_text"):
+                    translation = translate_plain_text(pathStr, partName, data)
+                save_output(pathStr + "-" + partName, translation)
 
         case "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            translate_docx(pathStr, partName, data)
+            def translate():
+                with metrics.timer("docx"):
+                    translate_docx(pathStr, partName, data)
+            translate_attachment(pathStr, partName, data, translate)
 
         case "application/pdf":
-            try:
-                translation = translate_pdf(pathStr, partName, data)
-                save_file(pathStr + "-" + partName + "-translated-content.txt", translation.encode("utf-8"))
-            except Exception:
-                print("Skipping translating file " + pathStr + "-" + partName, flush=True)
-            save_file(pathStr + "-" + partName, data)
+            def translate():
+                try:
+                    with metrics.timer("pdf"):
+                        translation = translate_pdf(pathStr, partName, data)
+                    save_output(pathStr + "-" + partName + "-translated-content.txt", translation)
+                except Exception:
+                    print("Skipping translating file " + pathStr + "-" + partName, flush=True)
+                save_output(pathStr + "-" + partName, data)
+            translate_attachment(pathStr, partName, data, translate)
 
         case _:
-            save_file(pathStr + "-" + partName, data)
+            save_output(pathStr + "-" + partName, data)
+    # Includes nested emails, and translations when batches are translated synchronously.
+    metrics.record_part(contentType, len(data), time.perf_counter() - start)
 
 
 def clean_eml_start(eml_bytes, max_lines):
@@ -504,16 +1587,21 @@ def process_eml(pathStr, eml_bytes):
     if len(eml_bytes) < 10:
         print("Skipping " + pathStr + " which is too short to be valid .eml file", flush=True)
         return
-    eml_bytes = clean_eml_start(eml_bytes, 5)
+    with metrics.timer("clean_eml_start"):
+        eml_bytes = clean_eml_start(eml_bytes, 5)
 
+    import eml_parser
     ep = eml_parser.EmlParser(include_attachment_data=True, include_raw_body=True)
     try:
-        parsed_eml = ep.decode_email_bytes(eml_bytes)
+        with metrics.timer("decode"):
+            parsed_eml = ep.decode_email_bytes(eml_bytes)
     except Exception as e:
         print("Skipping " + pathStr + ": " + str(e))
         return
 
-    print("Parsed " + pathStr, flush=True)
+    log("Parsed " + pathStr)
+    if triage_texts is not None and len(triage_texts) == 0:
+        add_triage_text("Subject: " + str(parsed_eml.get("header", {}).get("subject", "")))
 
     if "body" in parsed_eml:
         body = parsed_eml["body"]
@@ -533,37 +1621,516 @@ def process_eml(pathStr, eml_bytes):
             process_email_part(content_type, pathStr, filename, base64.b64decode(attachment["raw"]))
 
 
-pathlist = Path(args.path).glob('**/*.eml')
-for path in pathlist:
-    file_count += 1
-pathlist = Path(args.path).glob('**/*.eml')
-print("Translating " + str(file_count) + " eml files", flush=True)
-current_count = 0
-translation_needed = False
-for path in pathlist:
-    print(str(current_count) + " out of " + str(file_count) + " .eml files iterated", flush=True)
-    current_count += 1
-    pathStr = str(path)
-
-    if not replica_is_owner(pathStr):
-        continue
-
-    if os.path.isfile(pathStr+"-body-1.html") or os.path.isfile(pathStr+"-rtf-body.rtf"):
-        print("Skipping " + pathStr + ": Already translated.", flush=True)
-        # Pivot to an actual marker file to skip emails without rtf or html
-        Path(pathStr+"-translated-mark.mrk").touch()
-        continue
+def process_eml_stream(pathStr, eml_file):
+    """Process an email part by part as it is read, spooling large parts to temporary files."""
+    stream_parser = MimeStreamParser(eml_file, int(args.spool_size), args.spool_dir)
+    parts = stream_parser.parts()
+    index = 0
+    while True:
+        try:
+            with metrics.timer("decode"):
+                part = next(parts, None)
+        except Exception as e:
+            print("Skipping the rest of " + pathStr + ": " + str(e), flush=True)
+            return
+        if part is None:
+            return
+        if triage_texts is not None and len(triage_texts) == 0:
+            add_triage_text("Subject: " + str(stream_parser.headers.get("subject", "")))
+        if part[0] == "body":
+            index += 1
+            if part[1] is not None:
+                process_email_part(part[1], pathStr, "body-" + str(index) + ".html", part[2])
+        else:
+            process_email_part(part[1], pathStr, part[2], part[3])
+
 
-    if os.path.isfile(pathStr+"-translated-mark.mrk"):
-        print("Skipping " + pathStr+": Already translated.", flush=True)
-        continue
+def is_nested_output(pathStr, names=None):
+    """Tell whether an .eml file is a nested email saved as <email>.eml-<part>.eml next to <email>.eml.
+
+    Such files are outputs of their email.  An email merely named like one, without its email next to it, is not.
+
+    Args:
+        pathStr (str): Path of the .eml file
+        names (set): Names of the files of its directory, looked up on disk when None
+    """
+    directory, name = os.path.split(pathStr)
+    start = name.find(".eml-")
+    while start >= 0:
+        parent = name[:start + len(".eml")]
+        if parent in names if names is not None else os.path.isfile(os.path.join(directory, parent)):
+            return True
+        start = name.find(".eml-", start + 1)
+    return False
 
+
+def find_eml_files(root, with_stat):
+    """Walk the tree once, without following symbolic links to directories.
+
+    Nested emails saved next to their email are outputs, not emails to translate.  They are translated with their
+    email, whose outputs they are part of.
+
+    Returns:
+        A list of (path, stat, has_marker) tuples.  stat is None unless with_stat is set.  has_marker is
+        read from the directory listing, so finding it costs no file system call.
+    """
+    found = []
+    directories = [root]
+    while len(directories) > 0:
+        directory = directories.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            print("Skipping directory " + directory + ": " + str(e), flush=True)
+            continue
+        names = set(entry.name for entry in entries)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.name.endswith(".eml") and not is_nested_output(entry.name, names) and entry.is_file():
+                has_marker = (entry.name + "-translated-mark.mrk" in names or
+                              entry.name + "-body-1.html" in names or
+                              entry.name + "-rtf-body.rtf" in names)
+                found.append((entry.path, entry.stat() if with_stat else None, has_marker))
+    return found
+
+
+def translate_eml_file(pathStr, on_complete=None, check_markers=True):
+    """Translate an .eml file unless it has already been translated.
+
+    on_complete(pathStr, status) is called once the outputs of the email have been written, with the status
+    "failed" instead when a translation batch holding its segments failed.
+
+    Returns:
+        str: "skipped" or "translated"
+    """
+    global email_barrier, triage_texts
+    if check_markers and output_store is not None and output_store.committed(pathStr) is not None:
+        log("Skipping " + pathStr + ": Already in the output store.")
+        if on_complete is not None:
+            on_complete(pathStr, "skipped")
+        return "skipped"
+    # The outputs and markers of emails are not files with an output store.
+    check_files = check_markers and output_store is None
+
+    if check_files and (os.path.isfile(pathStr+"-body-1.html") or os.path.isfile(pathStr+"-rtf-body.rtf")):
+        log("Skipping " + pathStr + ": Already translated.")
+        # Pivot to an actual marker file to skip emails without rtf or html
+        Path(pathStr+"-translated-mark.mrk").touch()
+        if on_complete is not None:
+            on_complete(pathStr, "skipped")
+        return "skipped"
+
+    if check_files and os.path.isfile(pathStr+"-translated-mark.mrk"):
+        log("Skipping " + pathStr+": Already translated.")
+        if on_complete is not None:
+            on_complete(pathStr, "skipped")
+        return "skipped"
+
+    email_barrier = EmailBarrier(pathStr)
+    if spam_triage is not None:
+        triage_texts = []
     with open(pathStr, 'rb') as fp:
-        eml_bytes = raw_email = fp.read()
-        print("Processing " + pathStr + " ("+str(len(eml_bytes))+" bytes)", flush=True)
-        process_eml(pathStr, eml_bytes)
+        size = os.fstat(fp.fileno()).st_size
+        if size > int(args.stream_threshold) and size >= 10:
+            log("Processing " + pathStr + " (" + str(size) + " bytes) part by part")
+            process_eml_stream(pathStr, fp)
+        else:
+            with metrics.timer("read"):
+                eml_bytes = raw_email = fp.read()
+            log("Processing " + pathStr + " ("+str(len(eml_bytes))+" bytes)")
+            process_eml(pathStr, eml_bytes)
 
     if not profiling:
-        Path(pathStr + "-translated-mark.mrk").touch()
+        email_barrier.marker_path = pathStr + "-translated-mark.mrk"
+    email_barrier.on_complete = on_complete
+    if spam_triage is not None:
+        spam_triage.submit(pathStr, "\n".join(triage_texts), email_barrier)
+        triage_texts = None
+        spam_triage.poll()
+    segment_packer.email_done(email_barrier)
+    email_barrier.close()
+    email_barrier = None
+    output_writer.poll()
+    return "translated"
+
+
+def worker_initialize():
+    """Prepare a forked worker process.
+
+    Connections and the batch dispatcher are not shared with the parent process.
+    Ctrl-C is handled by the parent, which lets the workers complete the email they are translating.
+    """
+    global batch_dispatcher, output_writer, spam_triage
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if args.watch:
+        # Stopping the daemon lets the workers complete their emails too.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    server_pool.reset_connections()
+    batch_dispatcher = BatchDispatcher(int(args.inflight))
+    output_writer = OutputWriter(int(args.write_queue), output_writer.fsync_policy, metrics, output_writer.store)
+    # The HTTP client of the parent process is not shared either.
+    spam_triage = create_spam_triage()
+    metrics.reset()
+
+
+def counted_objects():
+    """Objects with counter_names, by the name their counters are reported under."""
+    counted = {name: globals()[name] for name in ("translation_memory", "attachment_store", "batch_controller",
+                                                  "language_guesser", "spam_triage")}
+    for index, endpoint in enumerate(server_pool.endpoints):
+        counted["server" + str(index)] = endpoint
+    return counted
+
+
+def run_counters():
+    """Counters of this process, which worker processes send back to the main process."""
+    counters = {}
+    for name, counted in counted_objects().items():
+        if counted is not None:
+            for attribute in counted.counter_names:
+                counters[name + "." + attribute] = getattr(counted, attribute)
+    return counters
+
+
+def add_run_counters(counters):
+    counted_by_name = counted_objects()
+    for key, value in counters.items():
+        name, attribute = key.split(".")
+        counted = counted_by_name[name]
+        setattr(counted, attribute, getattr(counted, attribute) + value)
+
+
+def worker_translate_eml_file(pathStr, check_markers):
+    counters_before = run_counters()
+    statuses = []
+    translate_eml_file(pathStr, lambda pathStr, status: statuses.append(status), check_markers)
+    segment_packer.flush()
+    batch_dispatcher.drain()
+    if spam_triage is not None:
+        spam_triage.drain()
+    output_writer.drain()
+    counters = run_counters()
+    # Emails whose outputs could not be written are translated again by the next run.
+    status = statuses[0] if len(statuses) > 0 else "failed"
+    return pathStr, status, {key: counters[key] - counters_before[key] for key in counters}, metrics.take()
+
+
+def translate_with_workers(pathStrs, worker_count, progress, on_complete=None, check_markers=None):
+    """Translate .eml files in a pool of forked worker processes, gathering progress in this process.
+
+    pathStrs can be any iterable, it is consumed as workers become available.  progress is a WorkProgress.
+    check_markers(pathStr) tells whether the marker files of an email must be checked.
+    """
+    statuses = {}
+    pending = set()
+    path_iterator = iter(pathStrs)
+    interrupted = False
+    executor = ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=worker_initialize)
+    try:
+        while True:
+            # Only queue a few emails per worker, so that Ctrl-C does not have to cancel the whole archive.
+            for pathStr in path_iterator:
+                pending.add(executor.submit(worker_translate_eml_file, pathStr,
+                                            check_markers is None or check_markers(pathStr)))
+                if len(pending) >= worker_count * 4:
+                    break
+            if len(pending) == 0:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pathStr, status, counters, worker_metrics = future.result()
+                if on_complete is not None:
+                    on_complete(pathStr, status)
+                progress.done(pathStr)
+                statuses[status] = statuses.get(status, 0) + 1
+                add_run_counters(counters)
+                metrics.merge(worker_metrics)
+                print_progress(progress.message() + " (" + pathStr + ": " + status + ")")
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Interrupted.  Waiting for the workers to complete the emails they are translating.", flush=True)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    print(", ".join(status + ": " + str(count) for status, count in statuses.items()), flush=True)
+    if interrupted:
+        sys.exit(130)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *log_args):
+        pass
+
+    def do_GET(self):
+        body = metrics.prometheus(run_counters()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_exports():
+    """Serve the metrics and write periodic snapshots, from daemon threads of the main process.
+
+    Returns:
+        An event stopping the snapshots when set.
+    """
+    stopped = threading.Event()
+    if args.metrics_port is not None:
+        server = ThreadingHTTPServer(("127.0.0.1", int(args.metrics_port)), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("Serving metrics on http://127.0.0.1:" + str(server.server_address[1]) + "/metrics", flush=True)
+    if args.metrics_file is not None:
+        def write_snapshots():
+            while not stopped.wait(float(args.metrics_interval)):
+                metrics.write_snapshot(args.metrics_file, run_counters())
+        threading.Thread(target=write_snapshots, daemon=True).start()
+    return stopped
+
+
+startup_seconds = time.perf_counter() - startup_time
+metrics.record_time("startup", startup_seconds)
+log("Started in " + "{:.3f}".format(startup_seconds) + " seconds.")
+if startup_seconds > float(args.startup_budget):
+    print("Startup took " + "{:.3f}".format(startup_seconds) + " seconds, over the budget of " +
+          str(args.startup_budget) + " seconds.  python -X importtime shows the modules slow to load.", flush=True)
+
+watcher = None
+stopping = threading.Event()
+if args.watch:
+    from directory_watch import DirectoryWatcher
+    # Started before looking for the emails already there, so that none arriving in between is missed.
+    try:
+        watcher = DirectoryWatcher(args.path, float(args.settle), float(args.watch_interval), args.watch_mode)
+    except OSError as e:
+        print("Cannot watch " + args.path + ": " + str(e), flush=True)
+        sys.exit(1)
+    print("Watching " + args.path + " with " + watcher.mode, flush=True)
+
+    def request_stop(signum, frame):
+        print("Stopping after the emails being translated.", flush=True)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+journal = None
+if args.journal is not None:
+    journal = CompletionJournal(args.journal)
+found_files = find_eml_files(args.path, journal is not None)
+pathlist = []
+file_stats = {}
+for pathStr, stat, has_marker in found_files:
+    if journal is not None:
+        if journal.is_complete(pathStr, stat):
+            continue
+        if output_store is not None:
+            has_marker = output_store.committed(pathStr) is not None
+        if args.import_markers and has_marker and pathStr not in journal.entries:
+            journal.record(pathStr, stat, "imported")
+            continue
+        file_stats[pathStr] = stat
+    pathlist.append(pathStr)
+if journal is not None:
+    print(str(len(found_files) - len(pathlist)) + " eml files already completed according to the journal",
+          flush=True)
+file_count = len(pathlist)
+print("Translating " + str(file_count) + " eml files", flush=True)
+
+
+def check_markers(pathStr):
+    # Emails already in the journal changed since they were translated, their old outputs are replaced.
+    if journal is not None and pathStr in journal.entries:
+        return False
+    # So are the emails queued again after they changed.
+    return work_queue is None or not modified_since_marker(pathStr)
+
 
-print("Completed.", flush=True)
\ No newline at end of file
+work_queue = None
+if args.queue is not None:
+    work_queue = WorkQueue(args.queue, float(args.lease), int(args.claim_bytes))
+    work_queue.add(pathlist)
+    work_queue.start_heartbeat()
+    owned_pathlist = work_queue.claimed_paths()
+else:
+    owned_pathlist = [pathStr for pathStr in pathlist if replica_is_owner(pathStr)]
+    file_count = len(owned_pathlist)
+
+
+failed_emails = []
+
+
+def on_complete(pathStr, status):
+    if status == "failed":
+        failed_emails.append(pathStr)
+    if work_queue is not None:
+        work_queue.done(pathStr, status)
+    if journal is not None:
+        stat = file_stats.get(pathStr)
+        if stat is None:
+            # Claimed from the work queue, after having been found by another replica.
+            stat = os.stat(pathStr)
+        journal.record(pathStr, stat, status)
+
+
+def modified_since_marker(pathStr):
+    try:
+        if output_store is not None:
+            committed = output_store.committed(pathStr)
+            return committed is not None and os.path.getmtime(pathStr) > committed
+        return os.path.getmtime(pathStr) > os.path.getmtime(pathStr + "-translated-mark.mrk")
+    except OSError:
+        return False
+
+
+def watch_emails():
+    """Translate the emails added to or modified in the watched directory as they settle, until stopping is set.
+
+    Emails are translated in this process, with its warm connections, caches and imported handlers.  Each round
+    of settled emails is translated and written before waiting for the next ones.
+    """
+    arrivals = {}
+    queued = []
+    latency_count = 0
+    latency_total = 0.0
+    latency_max = 0.0
+
+    def watched_on_complete(pathStr, status):
+        nonlocal latency_count, latency_total, latency_max
+        on_complete(pathStr, status)
+        arrival = arrivals.pop(pathStr, None)
+        if arrival is not None and status == "translated":
+            latency = time.time() - arrival
+            metrics.observe("watch_latency_seconds", latency)
+            latency_count += 1
+            latency_total += latency
+            latency_max = max(latency_max, latency)
+            log(pathStr + " translated " + "{:.1f}".format(latency) + " seconds after it arrived.")
+
+    while not stopping.is_set():
+        for pathStr, arrival in watcher.wait(1.0):
+            # Nested emails are outputs, rewritten whenever their email is.
+            if is_nested_output(pathStr):
+                continue
+            if work_queue is None and not replica_is_owner(pathStr):
+                continue
+            if pathStr not in arrivals:
+                arrivals[pathStr] = arrival
+                queued.append(pathStr)
+        if work_queue is not None and len(queued) > 0:
+            # Other replicas watching the same directory queue the same emails, each is claimed once.
+            work_queue.add(queued)
+            queued = []
+            claimed = work_queue.claim()
+            while len(claimed) > 0:
+                queued.extend(claimed)
+                claimed = work_queue.claim()
+        if len(queued) == 0:
+            continue
+        metrics.observe("watch_queue_depth", len(queued) + watcher.pending_count())
+        print_progress("Watching " + args.path + ": " + str(len(queued)) + " emails queued, " +
+                       str(watcher.pending_count()) + " settling")
+        while len(queued) > 0 and not stopping.is_set():
+            pathStr = queued.pop(0)
+            try:
+                stat = os.stat(pathStr)
+            except OSError:
+                arrivals.pop(pathStr, None)
+                continue
+            if journal is not None and journal.is_complete(pathStr, stat):
+                arrivals.pop(pathStr, None)
+                continue
+            file_stats[pathStr] = stat
+            translate_eml_file(pathStr, watched_on_complete,
+                               check_markers(pathStr) and not modified_since_marker(pathStr))
+        segment_packer.flush()
+        batch_dispatcher.drain()
+        if spam_triage is not None:
+            spam_triage.drain()
+        output_writer.drain()
+
+    average = 0.0 if latency_count == 0 else latency_total / latency_count
+    print("Watch stopped: " + str(latency_count) + " emails translated " + "{:.1f}".format(average) +
+          " seconds after arriving on average, " + "{:.1f}".format(latency_max) + " at most.  " +
+          str(len(queued) + watcher.pending_count()) + " emails left for the next run.", flush=True)
+
+
+def translate_emails(pathStrs, progress):
+    if int(args.workers) > 1:
+        translate_with_workers((pathStr for pathStr in pathStrs if not stopping.is_set()),
+                               int(args.workers), progress, on_complete, check_markers)
+        return
+    for pathStr in pathStrs:
+        if stopping.is_set():
+            break
+        translate_eml_file(pathStr, on_complete, check_markers(pathStr))
+        progress.done(pathStr)
+        print_progress(progress.message())
+    segment_packer.flush()
+    batch_dispatcher.drain()
+    if spam_triage is not None:
+        spam_triage.drain()
+    output_writer.drain()
+
+
+deferred_pathlist = []
+if work_queue is None and args.schedule == "cost":
+    schedule_start = time.time()
+    with metrics.timer("schedule"):
+        owned_pathlist, deferred_pathlist, email_costs = schedule_emails(owned_pathlist, float(args.defer_above))
+    log("Estimated the cost of " + str(len(email_costs)) + " emails in " +
+        "{:.1f}".format(time.time() - schedule_start) + " seconds.")
+    if len(deferred_pathlist) > 0:
+        print(str(len(deferred_pathlist)) + " emails estimated to take more than " + str(args.defer_above) +
+              " seconds are deferred to the end of the run", flush=True)
+else:
+    # Claimed from the work queue as the run goes, or in the order of the archive: every email counts the same.
+    email_costs = {pathStr: 1.0 for pathStr in (pathlist if work_queue is not None else owned_pathlist)}
+work_progress = WorkProgress(email_costs)
+
+metrics_stopped = start_metrics_exports()
+try:
+    translate_emails(owned_pathlist, work_progress)
+    while work_queue is not None and not stopping.is_set() and work_queue.wait_for_others():
+        # The emails of replicas which stopped responding are claimed again once their lease expires.
+        translate_emails(work_queue.claimed_paths(), work_progress)
+    if len(deferred_pathlist) > 0 and not stopping.is_set():
+        print("Translating the " + str(len(deferred_pathlist)) + " deferred emails", flush=True)
+        part_timeout = 0.0
+        translate_emails(deferred_pathlist, work_progress)
+    if watcher is not None:
+        watch_emails()
+except TranslationUnavailable as e:
+    print("Stopping: " + str(e), flush=True)
+    sys.exit(1)
+finally:
+    # Emails whose translations completed are still written, even when the run stops.
+    output_writer.drain()
+    if output_store is not None:
+        output_store.close()
+    if work_queue is not None:
+        work_queue.stop_heartbeat()
+        work_queue.release()
+    if watcher is not None:
+        watcher.close()
+    metrics_stopped.set()
+    if args.metrics_file is not None:
+        metrics.write_snapshot(args.metrics_file, run_counters())
+
+print(batch_controller.report(), flush=True)
+if len(failed_emails) > 0:
+    print(str(len(failed_emails)) + " emails were left without outputs after their translation failed, the next run "
+          "translates them: " + ", ".join(failed_emails[:10]) + (", ..." if len(failed_emails) > 10 else ""),
+          flush=True)
+print(server_pool.report(), flush=True)
+if translation_memory is not None:
+    print(translation_memory.report(), flush=True)
+if attachment_store is not None:
+    print(attachment_store.report(), flush=True)
+if language_guesser is not None:
+    print(language_guesser.report(), flush=True)
+if spam_triage is not None:
+    print(spam_triage.report(), flush=True)
+print("Completed.", flush=True)
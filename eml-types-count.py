@@ -1,70 +1,193 @@
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import argparse
-import eml_parser
+import json
+import os
+import time
+
+from mime_streaming import MimeScanner
 
 parser = argparse.ArgumentParser(
                     prog='eml-types-count',
                     description='Iterates a repository of eml files and returns all content-types found within',
                     epilog='')
 parser.add_argument('path')
+parser.add_argument(
+    '--scan',
+    help="Optional.  Only parse the MIME headers and boundaries instead of decoding every email, which is much "
+         "faster, and also report the sizes of the parts, their nesting depth and an estimate of the number of "
+         "characters to translate.  Content types are counted without their parameters.",
+    required=False,
+    default=False,
+    action=argparse.BooleanOptionalAction)
+parser.add_argument(
+    '-w',
+    '--workers',
+    help="Optional.  Number of worker processes.  Defaults to the number of CPUs.",
+    required=False,
+    default=os.cpu_count() or 1
+)
+parser.add_argument(
+    '--chars-per-second',
+    help="Optional.  Throughput of the translation server, to estimate the duration of the translation.",
+    required=False
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    help="Optional.  Path of the text file the report is written to, besides being printed.",
+    required=False,
+    default="results.txt"
+)
+parser.add_argument(
+    '--json',
+    help="Optional.  Path of a JSON file to write the counts to.",
+    required=False
+)
 args = parser.parse_args()
 print("Collecting content types for all files in " + args.path)
 
-translation_marker = "\n[AUTO_TRANSLATED] FROM "
-file_count = 0
-
-pathlist = Path(args.path).glob('**/*.eml')
-for path in pathlist:
-    file_count += 1
-pathlist = Path(args.path).glob('**/*.eml')
-print("Translating " + str(file_count) + " eml files")
-current_count = 0
-translation_needed = False
-contentTypes = {}
-failed_eml = []
-for path in pathlist:
-    print(str(current_count) + " out of " + str(file_count) + " .eml files translated")
-    current_count += 1
-    pathStr = str(path)
-    print("Processing " + pathStr)
-
-    ep = eml_parser.EmlParser()
-    parsed_eml = None
-    try:
-        parsed_eml = ep.decode_email(path)
-    except Exception as e:
-        print("Failed to parse eml: " + pathStr)
-        failed_eml.append(pathStr)
-        continue
-
-    if "body" in parsed_eml:
-        body = parsed_eml["body"]
-        for part in body:
-            if "content_type" in part:
-                content_type = part["content_type"]
-                if content_type not in contentTypes:
-                    contentTypes[content_type] = 1
-                else:
-                    contentTypes[content_type] += 1
-
-    if "attachment" in parsed_eml:
-        for attachment in parsed_eml["attachment"]:
-            content_hdr = attachment["content_header"]
-            content_type = content_hdr["content-type"][0]
-            if content_type not in contentTypes:
-                contentTypes[content_type] = 1
-            else:
-                contentTypes[content_type] += 1
-
-
-file1 = open("results.txt", "w")
-
-for content_type in contentTypes.keys():
-    print(content_type + ": " + str(contentTypes[content_type]))
-    file1.write(content_type + ": " + str(contentTypes[content_type]))
-
-for eml in failed_eml:
-    print("Failed: " + eml)
-    file1.write("Failed: " + eml)
-
-file1.close()
+# Emails handled by a worker in one task.
+CHUNK_SIZE = 64
+PROGRESS_INTERVAL = 10
+
+
+def find_eml_files(root):
+    found = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(".eml"):
+                found.append(os.path.join(directory, name))
+    return found
+
+
+def empty_counts():
+    return {"emails": 0, "failed": [], "types": {}, "depths": {}}
+
+
+def size_bucket(size):
+    """Power of two bucket of a size."""
+    return 1 if size <= 1 else 1 << (size - 1).bit_length()
+
+
+def count_part(counts, content_type, size=None, characters=0):
+    entry = counts["types"].setdefault(content_type, {"count": 0, "bytes": 0, "characters": 0, "sizes": {}})
+    entry["count"] += 1
+    if size is not None:
+        entry["bytes"] += size
+        entry["characters"] += characters
+        bucket = size_bucket(size)
+        entry["sizes"][bucket] = entry["sizes"].get(bucket, 0) + 1
+
+
+def decode_files(pathStrs):
+    """Count the content types of emails decoded with eml_parser, in a worker process."""
+    import eml_parser
+    counts = empty_counts()
+    for pathStr in pathStrs:
+        counts["emails"] += 1
+        ep = eml_parser.EmlParser()
+        try:
+            parsed_eml = ep.decode_email(pathStr)
+        except Exception:
+            counts["failed"].append(pathStr)
+            continue
+
+        if "body" in parsed_eml:
+            for part in parsed_eml["body"]:
+                if "content_type" in part:
+                    count_part(counts, part["content_type"])
+
+        if "attachment" in parsed_eml:
+            for attachment in parsed_eml["attachment"]:
+                count_part(counts, attachment["content_header"]["content-type"][0])
+    return counts
+
+
+def scan_files(pathStrs):
+    """Measure the parts of emails from their MIME structure, in a worker process."""
+    counts = empty_counts()
+    for pathStr in pathStrs:
+        counts["emails"] += 1
+        try:
+            with open(pathStr, "rb") as eml_file:
+                scanner = MimeScanner(eml_file)
+                for content_type, size, characters in scanner.parts():
+                    count_part(counts, content_type, size, characters)
+        except Exception:
+            counts["failed"].append(pathStr)
+            continue
+        counts["depths"][scanner.max_depth] = counts["depths"].get(scanner.max_depth, 0) + 1
+    return counts
+
+
+def merge_counts(counts, other):
+    counts["emails"] += other["emails"]
+    counts["failed"].extend(other["failed"])
+    for content_type, other_entry in other["types"].items():
+        entry = counts["types"].setdefault(content_type, {"count": 0, "bytes": 0, "characters": 0, "sizes": {}})
+        for key in ("count", "bytes", "characters"):
+            entry[key] += other_entry[key]
+        for bucket, number in other_entry["sizes"].items():
+            entry["sizes"][bucket] = entry["sizes"].get(bucket, 0) + number
+    for depth, number in other["depths"].items():
+        counts["depths"][depth] = counts["depths"].get(depth, 0) + number
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return str(round(size)) + " " + unit if unit == "B" else "{:.1f} {}".format(size, unit)
+        size /= 1024
+
+
+def report_lines(counts):
+    lines = []
+    for content_type, entry in sorted(counts["types"].items(), key=lambda item: -item[1]["count"]):
+        lines.append(content_type + ": " + str(entry["count"]))
+        if not args.scan:
+            continue
+        lines.append("    " + format_size(entry["bytes"]) + " in total, " +
+                     format_size(entry["bytes"] / entry["count"]) + " on average")
+        lines.append("    sizes: " + ", ".join("<= " + format_size(bucket) + ": " + str(number)
+                                               for bucket, number in sorted(entry["sizes"].items())))
+        if entry["characters"] > 0:
+            lines.append("    about " + str(entry["characters"]) + " characters to translate")
+    if args.scan:
+        lines.append("Nesting depth: " + ", ".join(str(depth) + ": " + str(number)
+                                                   for depth, number in sorted(counts["depths"].items())))
+        characters = sum(entry["characters"] for entry in counts["types"].values())
+        line = "About " + str(characters) + " characters to translate in text bodies"
+        if args.chars_per_second is not None:
+            line += ", " + "{:.1f}".format(characters / float(args.chars_per_second) / 3600) + " hours at " + \
+                    str(args.chars_per_second) + " characters per second"
+        lines.append(line + ".  PDF and docx attachments come on top.")
+    for eml in counts["failed"]:
+        lines.append("Failed: " + eml)
+    return lines
+
+
+pathlist = find_eml_files(args.path)
+file_count = len(pathlist)
+print("Scanning " + str(file_count) + " eml files")
+counts = empty_counts()
+chunks = [pathlist[start:start + CHUNK_SIZE] for start in range(0, file_count, CHUNK_SIZE)]
+count_files = scan_files if args.scan else decode_files
+start_time = time.time()
+last_progress = start_time
+with ProcessPoolExecutor(max_workers=max(1, int(args.workers))) as executor:
+    for chunk_counts in executor.map(count_files, chunks):
+        merge_counts(counts, chunk_counts)
+        if time.time() - last_progress >= PROGRESS_INTERVAL:
+            last_progress = time.time()
+            print(str(counts["emails"]) + " out of " + str(file_count) + " .eml files scanned", flush=True)
+print(str(counts["emails"]) + " .eml files scanned in " + "{:.1f}".format(time.time() - start_time) + " seconds")
+
+lines = report_lines(counts)
+for line in lines:
+    print(line)
+with open(args.output, "w", encoding="utf-8") as output_file:
+    output_file.write("".join(line + "\n" for line in lines))
+
+if args.json is not None:
+    with open(args.json, "w", encoding="utf-8") as json_file:
+        json.dump(counts, json_file, indent=2)
@@ -0,0 +1,82 @@
+import re
+
+from bs4.element import NavigableString, PreformattedString, Tag
+
+# Elements whose content flows with the surrounding text.  Any other element starts a new segment.
+INLINE_TAGS = frozenset(["a", "abbr", "acronym", "b", "bdi", "bdo", "big", "cite", "code", "data", "del", "dfn",
+                         "em", "font", "i", "img", "ins", "kbd", "label", "mark", "q", "s", "samp", "small", "span",
+                         "strike", "strong", "sub", "sup", "time", "tt", "u", "var", "wbr"])
+# Elements whose content is never displayed as text.
+SKIPPED_TAGS = frozenset(["script", "style", "template", "meta", "link", "svg", "math", "object",
+                          "iframe", "noembed", "noframes"])
+HIDDEN_STYLE_PATTERN = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def is_hidden(element):
+    """Tell whether an element is not displayed: scripts, styles, hidden attribute or display:none style."""
+    if element.name in SKIPPED_TAGS or element.has_attr("hidden"):
+        return True
+    style = element.get("style")
+    return style is not None and HIDDEN_STYLE_PATTERN.search(style) is not None
+
+
+def is_inline(element):
+    return element.name in INLINE_TAGS and element.find(lambda tag: tag.name not in INLINE_TAGS) is None
+
+
+def inline_text(node, parts):
+    """Append the displayed strings of a text node or inline element to parts."""
+    if isinstance(node, NavigableString):
+        if not isinstance(node, PreformattedString):
+            parts.append(str(node))
+        return
+    if is_hidden(node):
+        return
+    for child in node.children:
+        inline_text(child, parts)
+
+
+def block_segments(root):
+    """Split a parsed HTML document into block level segments.
+
+    Consecutive text nodes and inline elements of a block form one segment, so that a sentence with a word in
+    bold is translated as a whole.  Line breaks and block elements end segments.  Hidden elements, scripts and
+    styles are skipped.
+
+    Returns:
+        A list of (text, last_node) tuples in document order, last_node being the last node of the segment.
+        Whitespace is collapsed in the text, except in preformatted elements.  Blank segments are left out.
+    """
+    segments = []
+    # One frame per block being split: [children iterator, inside_pre, parts of the segment, last node].
+    stack = [[iter(root.children), root.name == "pre", [], None]]
+    while len(stack) > 0:
+        frame = stack[-1]
+        child = next(frame[0], None)
+        if child is None:
+            end_segment(segments, frame)
+            stack.pop()
+            continue
+        if isinstance(child, Tag) and (child.name == "br" or not is_inline(child)):
+            end_segment(segments, frame)
+            if child.name != "br" and not is_hidden(child):
+                stack.append([iter(child.children), frame[1] or child.name == "pre", [], None])
+            continue
+        if isinstance(child, PreformattedString) or (isinstance(child, Tag) and is_hidden(child)):
+            continue
+        inline_text(child, frame[2])
+        frame[3] = child
+    return segments
+
+
+def end_segment(segments, frame):
+    if frame[3] is None:
+        return
+    text = "".join(frame[2])
+    if not frame[1]:
+        text = WHITESPACE_PATTERN.sub(" ", text).strip()
+    if len(text.strip()) > 0:
+        segments.append((text, frame[3]))
+    frame[2] = []
+    frame[3] = None
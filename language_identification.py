@@ -0,0 +1,154 @@
+import json
+import re
+from typing import Dict
+
+
+class LanguageGuesser:
+    """Offline language identification from the scripts, function words, letters and character n-grams of a segment.
+
+    The profiles are bundled in language-profiles.json.  A language is only returned when its confidence reaches
+    the threshold, otherwise the server is left to detect it.  Segments are only identified as English, and so not
+    sent to the server, when they have no letter outside ASCII and no function word of another language.
+    """
+
+    counter_names = ("english_segments", "english_characters", "explicit_segments", "unknown_segments")
+    WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+    MIN_MATCHED_WORDS = 2
+
+    def __init__(self, profiles_path: str, threshold: float, supported_codes: list):
+        """Load language profiles.
+
+        Args:
+            profiles_path (str): Path of the language profiles
+            threshold (float): Minimum confidence, from 0 to 1
+            supported_codes (list): Language codes supported by the server
+        """
+        with open(profiles_path, "r", encoding="utf-8") as profiles_file:
+            profiles = json.load(profiles_file)
+        self.threshold = threshold
+        self.codes = {}
+        for code in supported_codes:
+            self.codes.setdefault(code, code)
+            # Servers may use regional codes, such as zh-Hans.
+            self.codes.setdefault(code.split("-")[0], code)
+        self.codes["en"] = "en"
+        self.words: Dict[str, list] = {}
+        for language, words in profiles["words"].items():
+            for word in set(words):
+                self.words.setdefault(word, []).append(language)
+        self.letters: Dict[str, list] = {}
+        for language, letters in profiles["letters"].items():
+            for letter in letters:
+                self.letters.setdefault(letter, []).append(language)
+        self.ngrams: Dict[str, list] = {}
+        for language, ngrams in profiles["ngrams"].items():
+            for ngram in ngrams:
+                self.ngrams.setdefault(ngram, []).append(language)
+        for language, words in profiles["homographs"].items():
+            # Words of other languages which are also words of this one, such as "die" or "van" in English.
+            for word in words:
+                if language not in self.words.setdefault(word, []):
+                    self.words[word].append(language)
+        self.foreign_words = {word for word, languages in self.words.items() if "en" not in languages}
+        self.scripts = [(script["language"], re.compile(script["pattern"]), script.get("variants", {}))
+                        for script in profiles["scripts"]]
+        self.english_segments = 0
+        self.english_characters = 0
+        self.explicit_segments = 0
+        self.unknown_segments = 0
+
+    def guess_script(self, text: str, letter_count: int) -> tuple:
+        counts = {}
+        for language, pattern, variants in self.scripts:
+            count = len(pattern.findall(text))
+            if count > 0:
+                counts[language] = (count, variants)
+        if len(counts) == 0:
+            return None, 0.0
+        language = max(counts, key=lambda name: counts[name][0])
+        count, variants = counts[language]
+        if language == "zh" and "ja" in counts:
+            # Japanese mixes kana with Chinese characters.
+            language = "ja"
+            count += counts["ja"][0]
+        for variant, markers in variants.items():
+            if any(marker in text for marker in markers):
+                language = variant
+                break
+        return language, count / letter_count
+
+    def guess_words(self, words: list) -> tuple:
+        """Score the languages of words.
+
+        A function word, or a letter specific to some languages, counts one point shared by its languages.  The
+        other words count one point shared by the languages of their character n-grams.
+        """
+        scores: Dict[str, float] = {}
+
+        def add(languages, weight):
+            for language in languages:
+                scores[language] = scores.get(language, 0.0) + weight / len(languages)
+
+        matched = 0
+        for word in words:
+            languages = self.words.get(word, [])
+            evidence = len(languages) > 0
+            add(languages, 1.0)
+            for letter in set(word):
+                if letter in self.letters:
+                    evidence = True
+                    add(self.letters[letter], 1.0)
+            if len(languages) == 0:
+                padded = "_" + word + "_"
+                ngram_scores: Dict[str, float] = {}
+                for ngram, ngram_languages in self.ngrams.items():
+                    count = padded.count(ngram)
+                    if count > 0:
+                        for language in ngram_languages:
+                            ngram_scores[language] = ngram_scores.get(language, 0.0) + count / len(ngram_languages)
+                total = sum(ngram_scores.values())
+                if total > 0:
+                    evidence = True
+                    for language, score in ngram_scores.items():
+                        scores[language] = scores.get(language, 0.0) + score / total
+            if evidence:
+                matched += 1
+        if matched < LanguageGuesser.MIN_MATCHED_WORDS:
+            return None, 0.0
+        ranked = sorted(scores.items(), key=lambda score: score[1], reverse=True)
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], 1.0 - second / ranked[0][1]
+
+    def is_english(self, text: str, words: list) -> bool:
+        """Whether a segment identified as English can safely be left untranslated."""
+        if any(ord(character) > 127 and character.isalpha() for character in text):
+            return False
+        return not any(word in self.foreign_words for word in words)
+
+    def guess(self, text: str) -> str | None:
+        """Return the language code of a segment, or None when not confident enough."""
+        normalized = text.lower().replace("’", "'")
+        words = LanguageGuesser.WORD_PATTERN.findall(normalized)
+        letter_count = sum(1 for character in text if character.isalpha())
+        if letter_count == 0:
+            return None
+        language, confidence = self.guess_script(text, letter_count)
+        if confidence < 0.5:
+            language, confidence = self.guess_words(words)
+        if language == "en" and not self.is_english(text, words):
+            language = None
+        if language is None or confidence < self.threshold or language not in self.codes:
+            self.unknown_segments += 1
+            return None
+        if language == "en":
+            self.english_segments += 1
+            self.english_characters += len(text)
+        else:
+            self.explicit_segments += 1
+        return self.codes[language]
+
+    def report(self) -> str:
+        return ("Local language identification: " + str(self.english_segments) + " English segments (" +
+                str(self.english_characters) + " characters) not sent to the server, " +
+                str(self.explicit_segments) + " segments sent with their source language, " +
+                str(self.unknown_segments) + " left to the server.")
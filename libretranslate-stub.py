@@ -0,0 +1,212 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from urllib import parse
+
+parser = argparse.ArgumentParser(
+                    prog='libretranslate-stub',
+                    description='Local stand-in for a LibreTranslate server and for the chat completion '
+                                'endpoint used for spam triage, used to benchmark and test the translator '
+                                'without a real translation server',
+                    epilog='')
+parser.add_argument(
+    '-p',
+    '--port',
+    help="Optional.  Port to listen on.",
+    required=False,
+    default=5000
+)
+parser.add_argument(
+    '--latency',
+    help="Optional.  Seconds added to every request.",
+    required=False,
+    default=0.0
+)
+parser.add_argument(
+    '--failure-rate',
+    help="Optional.  Probability (0 to 1) that a translate request fails with an HTTP 503.",
+    required=False,
+    default=0.0
+)
+parser.add_argument(
+    '--reject',
+    help="Optional.  Translate requests with a segment containing this text fail with an HTTP 500, like a server "
+         "failing on the content of a segment.",
+    required=False
+)
+parser.add_argument(
+    '--unavailable',
+    help="Optional.  Translate requests with a segment containing this text fail with an HTTP 503, like a server "
+         "overloaded whatever the content of the batch.",
+    required=False
+)
+parser.add_argument(
+    '--seed',
+    help="Optional.  Seed of the random failures of --failure-rate, for reproducible runs.",
+    required=False
+)
+parser.add_argument(
+    '--chars-per-second',
+    help="Optional.  Translation throughput of the stub, shared by all requests.  0 for no limit.",
+    required=False,
+    default=0
+)
+parser.add_argument(
+    '--language',
+    help="Optional.  Language reported by /detect and for auto detected translations.",
+    required=False,
+    default="fr"
+)
+args = parser.parse_args()
+if args.seed is not None:
+    random.seed(int(args.seed))
+
+LANGUAGES = [{"code": "en", "name": "English"}, {"code": "fr", "name": "French"}, {"code": "de", "name": "German"},
+             {"code": "es", "name": "Spanish"}, {"code": "it", "name": "Italian"},
+             {"code": "pt", "name": "Portuguese"}, {"code": "ru", "name": "Russian"},
+             {"code": "zh", "name": "Chinese"}, {"code": "ja", "name": "Japanese"}]
+
+stats_lock = threading.Lock()
+stats = {"requests": 0, "translate_requests": 0, "detect_requests": 0, "languages_requests": 0,
+         "chat_requests": 0, "chat_emails": 0, "segments": 0, "characters": 0, "failures": 0}
+# Serializes translations when a throughput limit is set, like a server with a single translation worker.
+throughput_lock = threading.Lock()
+
+
+def count(**counters):
+    with stats_lock:
+        for name, value in counters.items():
+            stats[name] += value
+
+
+def translate_segment(text, source):
+    return "[" + source + "->en] " + text
+
+
+# Emails are packed in spam triage requests as "Email 1:" lines followed by their text.
+EMAIL_PATTERN = re.compile(r"^Email \d+:$", re.MULTILINE)
+SPAM_WORDS = ("lottery", "viagra", "winner", "unsubscribe", "bitcoin")
+
+
+def triage_email(text):
+    summary = " ".join(text.split())[:80]
+    return {"spam": any(word in text.lower() for word in SPAM_WORDS), "summary": summary}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *log_args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_params(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {key: values[0] for key, values in parse.parse_qs(body.decode("utf-8")).items()}
+
+    def do_GET(self):
+        self.read_params()
+        path = parse.urlsplit(self.path).path
+        if path.endswith("/languages"):
+            count(requests=1, languages_requests=1)
+            self.send_json(200, LANGUAGES)
+        elif path.endswith("/stats"):
+            with stats_lock:
+                self.send_json(200, dict(stats))
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        params = self.read_params()
+        path = parse.urlsplit(self.path).path
+        time.sleep(float(args.latency))
+        if path.endswith("/detect"):
+            count(requests=1, detect_requests=1)
+            self.send_json(200, [{"confidence": 90.0, "language": args.language}])
+        elif path.endswith("/translate"):
+            self.translate(params)
+        elif path.endswith("/chat/completions"):
+            self.chat(params)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def translate(self, params):
+        count(requests=1, translate_requests=1)
+        if random.random() < float(args.failure_rate):
+            count(failures=1)
+            self.send_json(503, {"error": "Simulated failure"})
+            return
+        q = params.get("q", "")
+        source = params.get("source", "auto")
+        texts = q if isinstance(q, list) else [q]
+        if args.reject is not None and any(args.reject in text for text in texts):
+            count(failures=1)
+            self.send_json(500, {"error": "Simulated rejection"})
+            return
+        if args.unavailable is not None and any(args.unavailable in text for text in texts):
+            count(failures=1)
+            self.send_json(503, {"error": "Simulated overload"})
+            return
+        characters = sum(len(text) for text in texts)
+        if int(args.chars_per_second) > 0:
+            with throughput_lock:
+                time.sleep(characters / int(args.chars_per_second))
+        count(segments=len(texts), characters=characters)
+        detected_language = args.language if source == "auto" else source
+        translations = [translate_segment(text, detected_language) for text in texts]
+        detected = {"confidence": 90.0, "language": detected_language}
+        if isinstance(q, list):
+            response = {"translatedText": translations}
+            if source == "auto":
+                response["detectedLanguage"] = [detected for _ in texts]
+        else:
+            response = {"translatedText": translations[0]}
+            if source == "auto":
+                response["detectedLanguage"] = detected
+        self.send_json(200, response)
+
+
+    def chat(self, params):
+        """Answer spam triage requests like an OpenAI compatible chat completion server."""
+        count(requests=1, chat_requests=1)
+        if random.random() < float(args.failure_rate):
+            count(failures=1)
+            self.send_json(503, {"error": "Simulated failure"})
+            return
+        messages = params.get("messages", [])
+        content = messages[-1].get("content", "") if len(messages) > 0 else ""
+        emails = EMAIL_PATTERN.split(content)[1:]
+        count(chat_emails=len(emails))
+        answer = [dict(email=index + 1, **triage_email(text)) for index, text in enumerate(emails)]
+        self.send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": params.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(answer)}}],
+            "usage": {"prompt_tokens": len(content) // 4, "completion_tokens": 0,
+                      "total_tokens": len(content) // 4}
+        })
+
+
+server = ThreadingHTTPServer(("127.0.0.1", int(args.port)), StubHandler)
+print("LibreTranslate stub listening on http://127.0.0.1:" + str(server.server_address[1]) + "/", flush=True)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
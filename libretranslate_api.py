@@ -0,0 +1,133 @@
+import http.client
+import io
+import json
+import queue
+import ssl
+from typing import Any, Dict
+from urllib import error, parse
+
+
+class LibreTranslateAPI:
+    DEFAULT_URL = "https://translate.terraprint.co/"
+
+    def __init__(self, url: str | None = None, api_key: str | None = None, pool_size: int = 1):
+        """Create a LibreTranslate API connection.
+
+        Args:
+            url (str): The url of the LibreTranslate endpoint.
+            api_key (str): The API key.
+            pool_size (int): Number of idle keep-alive connections kept open to the endpoint.
+        """
+        self.url = LibreTranslateAPI.DEFAULT_URL if url is None else url
+        self.api_key = api_key
+
+        # Add trailing slash
+        assert len(self.url) > 0
+        if self.url[-1] != "/":
+            self.url += "/"
+
+        parsed_url = parse.urlsplit(self.url)
+        self.scheme = parsed_url.scheme
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port
+        self.path = parsed_url.path
+        self.connections = queue.LifoQueue(maxsize=max(1, pool_size))
+
+    def _connect(self, timeout: int | None) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout,
+                                               context=ssl.create_default_context())
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _request(self, method: str, endpoint: str, body: bytes | None, headers: Dict[str, str],
+                 timeout: int | None) -> Any:
+        """Send a request over a pooled keep-alive connection and decode the JSON response.
+
+        Raises:
+            error.HTTPError: When the server answers with an error status.
+        """
+        while True:
+            try:
+                connection = self.connections.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self._connect(timeout)
+                reused = False
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, self.path + endpoint, body=body, headers=headers)
+                response = connection.getresponse()
+                response_bytes = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    # The server closed an idle keep-alive connection, try again on a fresh one.
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self.connections.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        if response.status >= 400:
+            raise error.HTTPError(self.url + endpoint, response.status, response.reason, response.headers,
+                                  io.BytesIO(response_bytes))
+        return json.loads(response_bytes.decode())
+
+    def translate(self, q: str, source: str = "en", target: str = "es", timeout: int | None = None) -> Any:
+        """Translate string
+
+        Args:
+            q (str): The text to translate
+            source (str): The source language code (ISO 639)
+            target (str): The target language code (ISO 639)
+            timeout (int): Request timeout in seconds
+
+        Returns:
+            str: The translated text
+        """
+        params: Dict[str, str] = {"q": q, "source": source, "target": target}
+        if self.api_key is not None:
+            params["api_key"] = self.api_key
+        return self._request("POST", "translate", json.dumps(params).encode('utf-8'),
+                             {"Content-Type": "application/json"}, timeout)
+
+    def detect(self, q: str, timeout: int | None = None) -> Any:
+        """Detect the language of a single text.
+
+        Args:
+            q (str): Text to detect
+            timeout (int): Request timeout in seconds
+
+        Returns:
+            The detected languages ex: [{"confidence": 0.6, "language": "en"}]
+        """
+        params: Dict[str, str] = {"q": q}
+        if self.api_key is not None:
+            params["api_key"] = self.api_key
+        url_params = parse.urlencode(params)
+        return self._request("POST", "detect", url_params.encode(),
+                             {"Content-Type": "application/x-www-form-urlencoded"}, timeout)
+
+    def languages(self, timeout: int | None = None) -> Any:
+        """Retrieve list of supported languages.
+
+        Args:
+            timeout (int): Request timeout in seconds
+
+        Returns:
+            A list of available languages ex: [{"code":"en", "name":"English"}]
+        """
+        endpoint = "languages"
+        if self.api_key is not None:
+            endpoint += "?" + parse.urlencode({"api_key": self.api_key})
+        return self._request("GET", endpoint, None, {}, timeout)
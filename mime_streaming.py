@@ -0,0 +1,535 @@
+import binascii
+import email.errors
+import email.header
+import email.parser
+import email.policy
+import io
+import re
+import tempfile
+
+# Longest piece of a line read at once, so that binary parts without line breaks do not have to fit in memory.
+LINE_LIMIT = 65536
+NOT_BASE64_PATTERN = re.compile(rb"[^A-Za-z0-9+/=]")
+
+# The rules telling bodies from attachments and the decoding functions below come from eml_parser 4.2
+# (eml_parser.constants and eml_parser.decode, AGPLv3+, by Georges Toth and GOVCERT.LU), so that the streaming
+# parser does not depend on the internals of the installed eml_parser release.
+# Attachments which are also bodies: scripts, web pages, SVG, invitations.
+TEXT_ATTACHMENT_EXTENSIONS = tuple("." + extension for extension in
+                                   "bat cmd eml hta htm html ics js jse mht mhtml php ps1 psm1 py rtf sh shtml svg "
+                                   "txt url vbe vbs wsf wsh xhtml".split())
+TEXT_ATTACHMENT_CONTENT_TYPES = frozenset("application/hta application/javascript application/rtf "
+                                          "application/x-javascript application/x-sh application/xhtml+xml "
+                                          "image/svg+xml".split())
+# Attachments larger than this are not bodies, even with a text extension or content type.
+MAX_TEXT_ATTACHMENT_SIZE = 10 * 1024 * 1024
+# Charset detection is slow: larger bodies are decoded with their declared charset only.
+MAX_CHARSET_DETECTION_SIZE = 256 * 1024
+
+
+class SpooledPart:
+    """Decoded content of an email part, in memory up to max_size bytes and in a named temporary file above.
+
+    The temporary file is removed when the part is closed or garbage collected.
+    """
+
+    def __init__(self, max_size: int, directory: str | None = None):
+        self.max_size = max_size
+        self.directory = directory
+        self.buffer = io.BytesIO()
+        self.file = None
+        self.size = 0
+
+    @property
+    def path(self) -> str | None:
+        """Path of the temporary file, or None while the content is in memory."""
+        return None if self.file is None else self.file.name
+
+    def write(self, data: bytes):
+        if self.file is None and self.size + len(data) > self.max_size:
+            self.file = tempfile.NamedTemporaryFile(prefix="eml-part-", dir=self.directory)
+            self.file.write(self.buffer.getvalue())
+            self.buffer = None
+        if self.file is None:
+            self.buffer.write(data)
+        else:
+            self.file.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def getvalue(self) -> bytes:
+        if self.file is None:
+            return self.buffer.getvalue()
+        with open(self.path, "rb") as part_file:
+            return part_file.read()
+
+    def open(self):
+        """Return a binary file reading the content from its start."""
+        if self.file is None:
+            return io.BytesIO(self.buffer.getvalue())
+        return open(self.path, "rb")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.buffer = None
+
+    def __len__(self):
+        return self.size
+
+
+class RawWriter:
+    """Copies the lines of a part to a SpooledPart or PartDecoder, without the line break which belongs to the
+    next boundary."""
+
+    def __init__(self, part):
+        self.part = part
+        self.line_break = b""
+
+    def write(self, line: bytes):
+        self.part.write(self.line_break)
+        content, self.line_break = split_line_break(line)
+        self.part.write(content)
+
+    def end_of_file(self):
+        """Keep the last line break, which belongs to the part when no boundary follows it."""
+        self.part.write(self.line_break)
+        self.line_break = b""
+
+    def finish(self):
+        self.part.finish()
+
+
+class PartDecoder:
+    """Decodes the content transfer encoding of a part, one line at a time."""
+
+    def __init__(self, encoding: str, part: SpooledPart):
+        self.encoding = encoding
+        self.part = part
+        self.pending = b""
+
+    def write(self, data: bytes):
+        if self.encoding == "base64":
+            self.pending += NOT_BASE64_PATTERN.sub(b"", data)
+            length = len(self.pending) // 4 * 4
+            if length > 0:
+                self.part.write(binascii.a2b_base64(self.pending[:length]))
+                self.pending = self.pending[length:]
+        elif self.encoding == "quoted-printable":
+            data = self.pending + data
+            # Keep an escape sequence cut at the end of a line piece for the next piece.
+            escape = data.rfind(b"=", max(0, len(data) - 2))
+            if escape >= 0 and not data.endswith((b"\n", b"\r")):
+                self.pending = data[escape:]
+                data = data[:escape]
+            else:
+                self.pending = b""
+            self.part.write(binascii.a2b_qp(data))
+        else:
+            self.part.write(data)
+
+    def finish(self):
+        if len(self.pending) > 0:
+            try:
+                if self.encoding == "base64":
+                    self.part.write(binascii.a2b_base64(self.pending + b"=" * (-len(self.pending) % 4)))
+                else:
+                    self.part.write(binascii.a2b_qp(self.pending))
+            except binascii.Error:
+                pass
+        self.part.finish()
+
+
+def split_line_break(line: bytes):
+    if line.endswith(b"\r\n"):
+        return line[:-2], b"\r\n"
+    if line.endswith(b"\n"):
+        return line[:-1], b"\n"
+    return line, b""
+
+
+def decode_field(field: str) -> str:
+    """Decode the encoded words of a header field, like eml_parser.decode.decode_field."""
+    try:
+        decoded = email.header.decode_header(field)
+    except email.errors.HeaderParseError:
+        return field
+    string = ""
+    for text, charset in decoded:
+        if charset:
+            string += decode_string(text, charset)
+        elif isinstance(text, bytes):
+            string += text.decode("utf-8", "replace")
+        else:
+            string += text
+    return string
+
+
+def decode_body(data: bytes, charset: str | None) -> str:
+    """Decode a text body, like eml_parser.decode.decode_body.
+
+    The declared charset is used when it decodes the body without losing bytes, otherwise the charset is detected.
+    Undecodable bytes are replaced with spaces.
+    """
+    if charset:
+        try:
+            text = _redetect_if_damaged(data, data.decode(charset, "replace"))
+        except (LookupError, ValueError):
+            text = decode_string(data)
+    else:
+        text = decode_string(data)
+    return text.replace("\ufffd", " ")
+
+
+def _redetect_if_damaged(data: bytes, text: str) -> str:
+    """Return the detected decoding of data instead of text when the declared charset lost bytes of it."""
+    damage = text.count("\ufffd")
+    if damage == 0 or len(data) > MAX_CHARSET_DETECTION_SIZE:
+        return text
+    detected = decode_string(data)
+    return detected if detected.count("\ufffd") < damage else text
+
+
+def decode_string(string: bytes, encoding: str | None = None) -> str:
+    """Decode bytes with an encoding hint, else the detected charset, else UTF-8, else latin-1."""
+    if string == b"":
+        return ""
+    if encoding is not None:
+        try:
+            return string.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            pass
+    # Only imported once an email is parsed, as the translator imports this module for SpooledPart on every run.
+    import charset_normalizer
+    best_match = charset_normalizer.from_bytes(string).best()
+    if best_match is not None:
+        return str(best_match)
+    try:
+        return string.decode("utf-8")
+    except UnicodeDecodeError:
+        return string.decode("latin-1")
+
+
+class MimeStreamParser:
+    """Walks the MIME parts of an email read from a binary file, without reading the whole email in memory.
+
+    Parts are decoded incrementally into SpooledParts, and told apart between bodies and attachments like
+    eml_parser does: the text parts of nested messages are bodies too, and nested messages are attachments along
+    with their own attachments.
+    """
+
+    def __init__(self, eml_file, max_size: int, directory: str | None = None):
+        """Prepare to parse an email.
+
+        Args:
+            eml_file: Binary file positioned at the start of the email.
+            max_size (int): Size above which decoded parts are spooled to temporary files.
+            directory (str): Directory of the temporary files.  Defaults to the system temporary directory.
+        """
+        self.eml_file = eml_file
+        self.max_size = max_size
+        self.directory = directory
+        self.pushed_back = None
+        self.line_start = True
+        self.attachment_count = 0
+        # Headers of the email, once parsed.
+        self.headers = None
+        self.header_parser = email.parser.BytesHeaderParser(policy=email.policy.default)
+
+    def read_line(self):
+        """Return the next line, or piece of a long line, and whether it starts a line."""
+        if self.pushed_back is not None:
+            line, line_start = self.pushed_back
+            self.pushed_back = None
+            return line, line_start
+        line_start = self.line_start
+        line = self.eml_file.readline(LINE_LIMIT)
+        self.line_start = line.endswith(b"\n")
+        return line, line_start
+
+    def skip_leading_lines(self, max_lines: int):
+        """Skip up to max_lines lines before the headers: quoted lines and lines which are not headers."""
+        for _ in range(max_lines):
+            line, line_start = self.read_line()
+            if not ((len(line) > 1 and line[0] == ord(">")) or b":" not in line.split(b"\n", 1)[0]) or line == b"":
+                self.pushed_back = (line, line_start)
+                return
+            while not line.endswith(b"\n") and line != b"":
+                line, line_start = self.read_line()
+
+    @staticmethod
+    def match_boundary(line: bytes, boundaries: list):
+        """Return the index of the boundary a line delimits and whether it closes it, or (None, False)."""
+        if not line.startswith(b"--"):
+            return None, False
+        stripped = line.rstrip()
+        for index in range(len(boundaries) - 1, -1, -1):
+            delimiter = b"--" + boundaries[index]
+            if stripped == delimiter:
+                return index, False
+            if stripped == delimiter + b"--":
+                return index, True
+        return None, False
+
+    def parts(self):
+        """Yield ("body", content_type, text) and ("attachment", content_type, filename, SpooledPart) tuples.
+
+        content_type of bodies is None when the part has no Content-Type header.
+        """
+        self.skip_leading_lines(5)
+        yield from self.entity([], [])
+
+    def read_until_boundary(self, boundaries, writers):
+        """Pass lines to writers until a boundary line, which is pushed back, or the end of the file.
+
+        Returns:
+            The index of the boundary reached in boundaries and whether it closes it, or None at the end of the
+            file.
+        """
+        while True:
+            line, line_start = self.read_line()
+            if line == b"":
+                return None, False
+            if line_start:
+                index, closing = self.match_boundary(line, boundaries)
+                if index is not None:
+                    self.pushed_back = (line, line_start)
+                    return index, closing
+            for writer in writers:
+                writer.write(line)
+
+    def entity(self, boundaries, writers):
+        headers = []
+        while True:
+            line, line_start = self.read_line()
+            if line == b"":
+                break
+            if line_start and self.match_boundary(line, boundaries)[0] is not None:
+                self.pushed_back = (line, line_start)
+                break
+            for writer in writers:
+                writer.write(line)
+            if line_start and line.strip() == b"":
+                break
+            headers.append(line)
+        message = self.header_parser.parsebytes(b"".join(headers))
+        if self.headers is None:
+            self.headers = message
+        boundary = message.get_boundary() if message.get_content_maintype() == "multipart" else None
+        if boundary is not None:
+            yield from self.multipart(boundaries + [boundary.encode("utf-8", "surrogateescape")], writers)
+        elif message.get_content_type() == "message/rfc822":
+            yield from self.nested_message(message, boundaries, writers)
+        else:
+            yield from self.leaf(message, boundaries, writers)
+
+    def multipart(self, boundaries, writers):
+        own = len(boundaries) - 1
+        # The preamble, up to the first boundary.
+        index, closing = self.read_until_boundary(boundaries, writers)
+        while index == own and not closing:
+            line, line_start = self.read_line()
+            for writer in writers:
+                writer.write(line)
+            yield from self.entity(boundaries, writers)
+            index, closing = self.read_until_boundary(boundaries, writers)
+        if index == own and closing:
+            line, line_start = self.read_line()
+            for writer in writers:
+                writer.write(line)
+            # The epilogue, up to the boundary of the enclosing multipart.
+            self.read_until_boundary(boundaries[:-1], writers)
+
+    def nested_message(self, message, boundaries, writers):
+        number = self.next_attachment_number()
+        part = SpooledPart(self.max_size, self.directory)
+        raw_writer = RawWriter(part)
+        yield from self.entity(boundaries, writers + [raw_writer])
+        self.read_until_boundary(boundaries, writers + [raw_writer])
+        raw_writer.finish()
+        yield ("attachment", self.content_type_header(message), self.filename(message, number), part)
+
+    def leaf(self, message, boundaries, writers):
+        part = SpooledPart(self.max_size, self.directory)
+        decoder = PartDecoder(message.get("content-transfer-encoding", "").strip().lower(), part)
+        raw_writer = RawWriter(decoder)
+        if self.read_until_boundary(boundaries, writers + [raw_writer])[0] is None:
+            raw_writer.end_of_file()
+        decoder.finish()
+
+        filename = message.get_filename("")
+        disposition = message.get_content_disposition()
+        is_attachment = disposition == "attachment"
+        is_text = ((message.get_content_maintype() == "text" and not is_attachment) or
+                   message.get_content_type() in TEXT_ATTACHMENT_CONTENT_TYPES or
+                   filename.lower().endswith(TEXT_ATTACHMENT_EXTENSIONS))
+        if is_text and is_attachment and len(part) > MAX_TEXT_ATTACHMENT_SIZE:
+            is_text = False
+        if is_text:
+            content_type = None
+            content_types = message.get_all("content-type")
+            if content_types is not None:
+                content_type = str(content_types[-1]).split(";", 1)[0].strip()
+            yield ("body", content_type, decode_body(part.getvalue(), message.get_content_charset()))
+        if ("content-disposition" in message and disposition != "inline") or \
+                message.get_content_maintype() != "text":
+            number = self.next_attachment_number()
+            yield ("attachment", self.content_type_header(message), self.filename(message, number), part)
+
+    def next_attachment_number(self):
+        number = self.attachment_count
+        self.attachment_count += 1
+        return number
+
+    @staticmethod
+    def filename(message, number):
+        filename = message.get_filename("")
+        if filename == "":
+            return "part-" + "%03d" % number
+        return decode_field(filename)
+
+    @staticmethod
+    def content_type_header(message):
+        content_type = message.get("content-type")
+        if content_type is None:
+            return message.get_content_type()
+        return str(content_type)
+
+
+class PartCounter:
+    """Counts the bytes of a part and keeps up to sample_size of them."""
+
+    def __init__(self, sample_size: int = 0):
+        self.size = 0
+        self.sample_size = sample_size
+        self.sample = []
+        self.sampled = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.sampled < self.sample_size:
+            self.sample.append(data[:self.sample_size - self.sampled])
+            self.sampled += len(self.sample[-1])
+
+    def finish(self):
+        pass
+
+
+class MimeScanner(MimeStreamParser):
+    """Walks the MIME structure of an email to measure its parts, without decoding attachments.
+
+    Only the headers and boundaries are parsed.  Non text parts are measured by their encoded size, base64
+    being counted as three quarters of it.  Text parts are decoded up to TEXT_SAMPLE_SIZE bytes to estimate the
+    number of characters to translate.
+    """
+
+    TEXT_SAMPLE_SIZE = 1024 * 1024
+    BLOCK_SIZE = 1024 * 1024
+    TAG_PATTERN = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>", re.IGNORECASE | re.DOTALL)
+    WHITESPACE_PATTERN = re.compile(r"\s+")
+
+    def __init__(self, eml_file):
+        super().__init__(eml_file, 0)
+        # The legacy policy parses headers several times faster, and the scanner only reads their parameters.
+        self.header_parser = email.parser.BytesHeaderParser(policy=email.policy.compat32)
+        self.depth = 0
+        self.max_depth = 0
+
+    def parts(self):
+        """Yield a (content_type, size, characters) tuple per part.
+
+        size is the decoded size, estimated for non text parts.  characters is the estimated number of
+        characters to translate in text/plain and text/html parts, and 0 in other parts.  Nested messages are
+        yielded after their own parts, with their encoded size.
+        """
+        yield from super().parts()
+
+    def enter(self):
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def multipart(self, boundaries, writers):
+        self.enter()
+        yield from super().multipart(boundaries, writers)
+        self.depth -= 1
+
+    def nested_message(self, message, boundaries, writers):
+        counter = PartCounter()
+        raw_writer = RawWriter(counter)
+        self.enter()
+        yield from self.entity(boundaries, writers + [raw_writer])
+        self.read_until_boundary(boundaries, writers + [raw_writer])
+        self.depth -= 1
+        yield (message.get_content_type(), counter.size, 0)
+
+    def leaf(self, message, boundaries, writers):
+        content_type = message.get_content_type()
+        encoding = str(message.get("content-transfer-encoding", "")).strip().lower()
+        counter = PartCounter(MimeScanner.TEXT_SAMPLE_SIZE if content_type in ("text/plain", "text/html") else 0)
+        writer = RawWriter(counter)
+        if counter.sample_size > 0:
+            writer = RawWriter(PartDecoder(encoding, counter))
+            self.read_until_boundary(boundaries, writers + [writer])
+        else:
+            self.skip_until_boundary(boundaries, writers + [writer])
+        writer.finish()
+        size = counter.size
+        if counter.sample_size == 0 and encoding == "base64":
+            size = size * 3 // 4
+        characters = 0
+        if counter.sample_size > 0 and counter.sampled > 0:
+            try:
+                text = b"".join(counter.sample).decode(message.get_content_charset() or "utf-8", "replace")
+            except LookupError:
+                text = b"".join(counter.sample).decode("latin-1")
+            if content_type == "text/html":
+                text = MimeScanner.TAG_PATTERN.sub(" ", text)
+            characters = len(MimeScanner.WHITESPACE_PATTERN.sub(" ", text).strip())
+            # Extrapolated from the sample for longer parts.
+            characters = characters * size // counter.sampled
+        yield (content_type, size, characters)
+
+    def skip_until_boundary(self, boundaries, writers):
+        """Like read_until_boundary, but reading blocks of lines at once, for parts which are only measured."""
+        if self.pushed_back is not None or not self.line_start:
+            return self.read_until_boundary(boundaries, writers)
+        line_start = True
+        while True:
+            offset = self.eml_file.tell()
+            block = self.eml_file.read(MimeScanner.BLOCK_SIZE)
+            if block == b"":
+                return None, False
+            end = len(block)
+            if end == MimeScanner.BLOCK_SIZE:
+                # Lines cut at the end of the block are read again with the next one.
+                end = block.rfind(b"\n") + 1
+                if end == 0:
+                    for writer in writers:
+                        writer.write(block)
+                    line_start = False
+                    continue
+            # Boundaries are lines starting with "--".
+            if line_start and block.startswith(b"--"):
+                candidate = 0
+            else:
+                candidate = block.find(b"\n--", 0, end) + 1 or -1
+            while candidate >= 0:
+                line_end = block.find(b"\n", candidate, end) + 1 or end
+                line = block[candidate:line_end]
+                index, closing = self.match_boundary(line, boundaries)
+                if index is not None:
+                    if candidate > 0:
+                        for writer in writers:
+                            writer.write(block[:candidate])
+                    self.eml_file.seek(offset + line_end)
+                    self.line_start = line.endswith(b"\n")
+                    self.pushed_back = (line, True)
+                    return index, closing
+                candidate = block.find(b"\n--", line_end - 1, end) + 1 or -1
+            for writer in writers:
+                writer.write(block[:end])
+            self.eml_file.seek(offset + end)
+            line_start = block[end - 1:end] == b"\n"
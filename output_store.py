@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Bytes copied at once between files and blobs, so that large outputs are never held in memory.
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_SHARDS = 16
+# Blobs are streamed with Connection.blobopen (Python 3.11) and email ids read back with RETURNING (SQLite 3.35).
+SUPPORTED = hasattr(sqlite3.Connection, "blobopen") and sqlite3.sqlite_version_info >= (3, 35, 0)
+REQUIREMENTS = "Python 3.11 and SQLite 3.35 or later"
+
+
+class OutputEntry:
+    """Outputs of one email, collected while they are written and committed to the store at once.
+
+    Outputs are bytes, parts with open() and size such as SpooledPart, or files on disk.  Files which are temporary
+    copies of the output (owned) are removed once the email is committed or discarded.
+    """
+
+    def __init__(self, store, pathStr: str):
+        self.store = store
+        self.pathStr = pathStr
+        # Output path to bytes, parts or (file path, owned) tuples.
+        self.outputs = {}
+
+    def add(self, file_path: str, data):
+        self.release(file_path)
+        self.outputs[file_path] = data
+
+    def add_file(self, file_path: str, source: str, owned: bool):
+        self.release(file_path)
+        self.outputs[file_path] = (source, owned)
+
+    def source(self, file_path: str) -> str | None:
+        """Return the file the content of an output is in until it is committed, None for outputs in memory."""
+        data = self.outputs.get(file_path)
+        return data[0] if isinstance(data, tuple) else None
+
+    def release(self, file_path: str):
+        data = self.outputs.pop(file_path, None)
+        if isinstance(data, tuple) and data[1]:
+            try:
+                os.remove(data[0])
+            except OSError:
+                pass
+
+    def commit(self):
+        self.store.commit(self)
+        self.discard()
+
+    def discard(self):
+        for file_path in list(self.outputs):
+            self.release(file_path)
+
+
+class PackedOutputStore:
+    """Outputs of emails packed into SQLite shards instead of files next to the emails.
+
+    An email and its outputs are kept in the shard chosen by a hash of the path of the email relative to root.  The
+    emails table indexes them by that path, and takes the place of the marker files: an email is only in it once all
+    of its outputs are, since they are committed in one transaction.  The outputs are stored under their path
+    relative to root too, which is where the export puts them back.
+
+    The number of shards is recorded in store.json when the store is created, later runs use it.
+    """
+
+    def __init__(self, path: str, root: str, shard_count: int, synchronous: str = "NORMAL"):
+        """Open or create a packed output store.
+
+        Args:
+            path (str): Directory of the store
+            root (str): Directory of the emails, which paths in the store are relative to
+            shard_count (int): Number of SQLite files the emails are spread across, for a new store
+            synchronous (str): SQLite synchronous pragma, FULL to flush every commit to storage
+        """
+        self.path = path
+        self.root = root
+        self.synchronous = synchronous
+        os.makedirs(path, exist_ok=True)
+        settings_path = os.path.join(path, "store.json")
+        if os.path.isfile(settings_path):
+            with open(settings_path, "r", encoding="utf-8") as settings_file:
+                self.shard_count = json.load(settings_file)["shards"]
+        else:
+            self.shard_count = max(1, shard_count)
+            temp_path = settings_path + "." + str(os.getpid()) + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as settings_file:
+                json.dump({"shards": self.shard_count}, settings_file)
+            os.replace(temp_path, settings_path)
+        self.local = threading.local()
+        # (pid, connection) of every connection opened, for close().
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, "outputs-" + "%03d" % shard + ".sqlite")
+
+    def key(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.root)
+
+    def shard(self, key: str) -> int:
+        return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big") % self.shard_count
+
+    def connection(self, shard: int) -> sqlite3.Connection:
+        """Return the connection to a shard of the current thread, opening it on first use.
+
+        Connections are never shared with other threads or forked worker processes, only closed by close().
+        """
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.connections = {}
+        db = self.local.connections.get(shard)
+        if db is None:
+            db = sqlite3.connect(self.shard_path(shard), timeout=60, isolation_level=None, check_same_thread=False)
+            with self.lock:
+                self.opened.append((os.getpid(), db))
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=" + self.synchronous)
+            db.execute("CREATE TABLE IF NOT EXISTS emails ("
+                       "id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, committed REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS outputs ("
+                       "id INTEGER PRIMARY KEY, email INTEGER NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, "
+                       "data BLOB NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS outputs_email ON outputs (email)")
+            self.local.connections[shard] = db
+        return db
+
+    def close(self):
+        """Checkpoint the shards and close the connections of this process, once no thread uses them anymore.
+
+        The -wal and -shm files of a shard are removed when no other process has it open.
+        """
+        with self.lock:
+            connections = [db for pid, db in self.opened if pid == os.getpid()]
+            self.opened = []
+        for db in connections:
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            db.close()
+        self.local = threading.local()
+
+    def begin(self, pathStr: str) -> OutputEntry:
+        return OutputEntry(self, pathStr)
+
+    def committed(self, pathStr: str) -> float | None:
+        """Return the time the outputs of an email were committed, or None if they never were."""
+        key = self.key(pathStr)
+        row = self.connection(self.shard(key)).execute("SELECT committed FROM emails WHERE path = ?",
+                                                       (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def commit(self, entry: OutputEntry):
+        """Replace the outputs of an email with those of an entry, atomically."""
+        key = self.key(entry.pathStr)
+        db = self.connection(self.shard(key))
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM outputs WHERE email = (SELECT id FROM emails WHERE path = ?)", (key,))
+            email_id = db.execute("INSERT INTO emails (path, committed) VALUES (?, ?) ON CONFLICT (path) "
+                                  "DO UPDATE SET committed = excluded.committed RETURNING id",
+                                  (key, time.time())).fetchone()[0]
+            for file_path, data in entry.outputs.items():
+                name = self.key(file_path)
+                if isinstance(data, bytes):
+                    db.execute("INSERT INTO outputs (email, name, size, data) VALUES (?, ?, ?, ?)",
+                               (email_id, name, len(data), data))
+                    continue
+                # Streamed into a blob of the final size.
+                size = os.path.getsize(data[0]) if isinstance(data, tuple) else data.size
+                output_id = db.execute("INSERT INTO outputs (email, name, size, data) VALUES (?, ?, ?, zeroblob(?))",
+                                       (email_id, name, size, size)).lastrowid
+                source_file = open(data[0], "rb") if isinstance(data, tuple) else data.open()
+                with source_file, db.blobopen("outputs", "data", output_id) as blob:
+                    for chunk in iter(lambda: source_file.read(CHUNK_SIZE), b""):
+                        blob.write(chunk)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def emails(self, shard: int):
+        """Yield the (path, committed) pairs of the emails of a shard, paths relative to root."""
+        yield from self.connection(shard).execute("SELECT path, committed FROM emails ORDER BY path")
+
+    def outputs(self, pathStr: str) -> list:
+        """Return the (name, size, output id) tuples of an email, names relative to root.
+
+        Args:
+            pathStr (str): Path of the email, relative to root when it is not absolute
+        """
+        key = self.key(os.path.join(self.root, pathStr))
+        return self.connection(self.shard(key)).execute(
+            "SELECT outputs.name, outputs.size, outputs.id FROM outputs JOIN emails ON outputs.email = emails.id "
+            "WHERE emails.path = ? ORDER BY outputs.id", (key,)).fetchall()
+
+    def read(self, pathStr: str, output_id: int, output_file):
+        """Copy an output of an email, found with outputs(), to a binary file."""
+        key = self.key(os.path.join(self.root, pathStr))
+        with self.connection(self.shard(key)).blobopen("outputs", "data", output_id, readonly=True) as blob:
+            for chunk in iter(lambda: blob.read(CHUNK_SIZE), b""):
+                output_file.write(chunk)
@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+from pathlib import Path
+
+
+def fsync_path(path):
+    """Flush a file or directory to storage."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class OutputWriter:
+    """Writes the outputs of completed emails from a background thread, then their marker.
+
+    Up to max_pending emails can wait to be written.  Finalizing more blocks until the writer catches up, which
+    bounds the rendered documents held in memory when storage is slower than translation.  on_complete callbacks
+    are run by poll() on the main thread, once the marker of their email has been written.
+
+    fsync_policy is "none", "email" to flush the outputs of an email and their directories before writing its
+    marker, or "file" to also flush each output as soon as it is written.
+
+    With a packed output store, the outputs of an email are collected in an entry of the store instead, which is
+    committed in place of writing the marker.  The store flushes its commits itself.
+    """
+
+    def __init__(self, max_pending, fsync_policy, metrics, store=None):
+        self.fsync_policy = fsync_policy
+        self.metrics = metrics
+        self.store = store
+        # Entry of the store the outputs written by a thread go to.
+        self.local = threading.local()
+        self.pending = None
+        if max_pending > 0:
+            self.pending = queue.Queue(maxsize=max_pending)
+        self.completed = queue.Queue()
+        self.thread = None
+
+    def submit(self, barrier):
+        if self.pending is None:
+            self.write(barrier)
+            self.poll()
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="output-writer", daemon=True)
+            self.thread.start()
+        self.pending.put(barrier)
+
+    def run(self):
+        while True:
+            barrier = self.pending.get()
+            try:
+                self.write(barrier)
+            finally:
+                self.pending.task_done()
+
+    def current_entry(self):
+        return getattr(self.local, "entry", None)
+
+    def write(self, barrier):
+        if barrier.failed:
+            # Without outputs or marker, the email is translated again by the next run.
+            for discard in barrier.discards:
+                discard()
+            barrier.outputs = []
+            self.completed.put(barrier)
+            return
+        if self.store is not None:
+            self.write_entry(barrier)
+            return
+        try:
+            for output, file_path in barrier.outputs:
+                output()
+                if self.fsync_policy == "file" and file_path is not None:
+                    fsync_path(file_path)
+            if barrier.marker_path is not None:
+                if self.fsync_policy != "none":
+                    self.sync_outputs(barrier)
+                Path(barrier.marker_path).touch()
+                if self.fsync_policy != "none":
+                    fsync_path(barrier.marker_path)
+                    fsync_path(os.path.dirname(os.path.abspath(barrier.marker_path)))
+        except Exception as e:
+            # Without its marker, the email is translated again by the next run.
+            print("Failed to write the outputs of " + barrier.pathStr + ": " + str(e), flush=True)
+            return
+        finally:
+            barrier.outputs = []
+        self.completed.put(barrier)
+
+    def write_entry(self, barrier):
+        entry = self.store.begin(barrier.pathStr)
+        self.local.entry = entry
+        try:
+            for output, file_path in barrier.outputs:
+                output()
+            if barrier.marker_path is not None:
+                with self.metrics.timer("store_commit"):
+                    entry.commit()
+        except Exception as e:
+            # Nothing of the email is in the store, it is translated again by the next run.
+            print("Failed to store the outputs of " + barrier.pathStr + ": " + str(e), flush=True)
+            return
+        finally:
+            self.local.entry = None
+            entry.discard()
+            barrier.outputs = []
+        self.completed.put(barrier)
+
+    def sync_outputs(self, barrier):
+        directories = set()
+        for output, file_path in barrier.outputs:
+            if file_path is None:
+                continue
+            if self.fsync_policy == "email":
+                fsync_path(file_path)
+            directories.add(os.path.dirname(os.path.abspath(file_path)))
+        for directory in directories:
+            fsync_path(directory)
+
+    def poll(self):
+        while not self.completed.empty():
+            barrier = self.completed.get()
+            if barrier.on_complete is not None:
+                barrier.on_complete(barrier.pathStr, "failed" if barrier.failed else "translated")
+
+    def drain(self):
+        if self.pending is not None:
+            self.pending.join()
+        self.poll()
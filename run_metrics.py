@@ -0,0 +1,173 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """Stage timers, histograms and counters of a run, exported as JSON snapshots or in the Prometheus format.
+
+    Stage timers are exclusive: the time spent in a stage nested in another one, like a translation request sent
+    while extracting a PDF, is only counted in the nested stage.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.local = threading.local()
+        self.start_time = time.time()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.histograms = {}
+            self.counters = {}
+            self.content_types = {}
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        now = time.perf_counter()
+        if len(stack) > 0:
+            # Pause the enclosing stage.
+            stack[-1][1] += now - stack[-1][2]
+        frame = [stage, 0.0, now]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            if len(stack) > 0:
+                stack[-1][2] = now
+            self.record_time(stage, frame[1] + now - frame[2])
+
+    def record_time(self, stage, seconds):
+        with self.lock:
+            timing = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def observe(self, name, value):
+        """Count a value in a histogram with power of two buckets."""
+        bucket = 1 if value <= 1 else 1 << (int(value) - 1).bit_length()
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {"buckets": {}, "count": 0, "sum": 0})
+            histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_part(self, content_type, size, seconds):
+        with self.lock:
+            throughput = self.content_types.setdefault(content_type, [0, 0, 0.0])
+            throughput[0] += 1
+            throughput[1] += size
+            throughput[2] += seconds
+
+    def take(self) -> dict:
+        """Return the metrics recorded since the last call, for worker processes to send to the main process."""
+        with self.lock:
+            state = {"stages": self.stages, "histograms": self.histograms, "counters": self.counters,
+                     "content_types": self.content_types}
+        self.reset()
+        return state
+
+    def merge(self, state):
+        with self.lock:
+            for stage, (calls, seconds, longest) in state["stages"].items():
+                timing = self.stages.setdefault(stage, [0, 0.0, 0.0])
+                timing[0] += calls
+                timing[1] += seconds
+                timing[2] = max(timing[2], longest)
+            for name, merged in state["histograms"].items():
+                histogram = self.histograms.setdefault(name, {"buckets": {}, "count": 0, "sum": 0})
+                for bucket, count in merged["buckets"].items():
+                    histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + count
+                histogram["count"] += merged["count"]
+                histogram["sum"] += merged["sum"]
+            for name, value in state["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for content_type, (parts, size, seconds) in state["content_types"].items():
+                throughput = self.content_types.setdefault(content_type, [0, 0, 0.0])
+                throughput[0] += parts
+                throughput[1] += size
+                throughput[2] += seconds
+
+    def snapshot(self, run_counters) -> dict:
+        """Return the metrics as a JSON serializable dict.
+
+        Args:
+            run_counters: Counters of the translation memory, attachment store, batches and language identification.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            counters.update(run_counters)
+            hits = counters.get("translation_memory.hits", 0)
+            lookups = hits + counters.get("translation_memory.misses", 0)
+            segments = counters.get("segments", 0)
+            return {
+                "time": time.time(),
+                "uptime": round(time.time() - self.start_time, 3),
+                "stages": {stage: {"calls": calls, "seconds": round(seconds, 6),
+                                   "mean": round(seconds / calls, 6), "max": round(longest, 6)}
+                           for stage, (calls, seconds, longest) in self.stages.items()},
+                "histograms": {name: {"buckets": {str(bucket): count
+                                                  for bucket, count in sorted(histogram["buckets"].items())},
+                                      "count": histogram["count"], "sum": histogram["sum"]}
+                               for name, histogram in self.histograms.items()},
+                "counters": counters,
+                "ratios": {"cache_hits": hits / lookups if lookups > 0 else 0.0,
+                           "noop_segments": counters.get("noop_segments", 0) / segments if segments > 0 else 0.0,
+                           "duplicate_segments":
+                               counters.get("duplicate_segments", 0) / segments if segments > 0 else 0.0},
+                "content_types": {content_type: {"parts": parts, "bytes": size, "seconds": round(seconds, 6),
+                                                 "bytes_per_second": round(size / seconds) if seconds > 0 else 0}
+                                  for content_type, (parts, size, seconds) in self.content_types.items()},
+            }
+
+    def prometheus(self, run_counters) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot(run_counters)
+        lines = ["# TYPE eml_translator_stage_seconds_total counter",
+                 "# TYPE eml_translator_stage_calls_total counter"]
+        for stage, timing in snapshot["stages"].items():
+            lines.append("eml_translator_stage_seconds_total{stage=\"" + stage + "\"} " + str(timing["seconds"]))
+            lines.append("eml_translator_stage_calls_total{stage=\"" + stage + "\"} " + str(timing["calls"]))
+        for name, histogram in snapshot["histograms"].items():
+            lines.append("# TYPE eml_translator_" + name + " histogram")
+            cumulative = 0
+            for bucket, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append("eml_translator_" + name + "_bucket{le=\"" + bucket + "\"} " + str(cumulative))
+            lines.append("eml_translator_" + name + "_bucket{le=\"+Inf\"} " + str(histogram["count"]))
+            lines.append("eml_translator_" + name + "_sum " + str(histogram["sum"]))
+            lines.append("eml_translator_" + name + "_count " + str(histogram["count"]))
+        for name, value in snapshot["counters"].items():
+            metric = "eml_translator_" + name.replace(".", "_") + "_total"
+            lines.append("# TYPE " + metric + " counter")
+            lines.append(metric + " " + str(value))
+        for name, value in snapshot["ratios"].items():
+            lines.append("# TYPE eml_translator_" + name + "_ratio gauge")
+            lines.append("eml_translator_" + name + "_ratio " + str(value))
+        for metric in ("parts", "bytes", "seconds"):
+            lines.append("# TYPE eml_translator_content_type_" + metric + "_total counter")
+            for content_type, throughput in snapshot["content_types"].items():
+                lines.append("eml_translator_content_type_" + metric + "_total{content_type=\"" + content_type +
+                             "\"} " + str(throughput[metric]))
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path, run_counters):
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with self.snapshot_lock:
+            with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+                json.dump(self.snapshot(run_counters), snapshot_file, indent=2)
+            os.replace(temp_path, path)
@@ -0,0 +1,71 @@
+from pathlib import Path
+import argparse
+import random
+import timeit
+
+import segment_classification
+
+parser = argparse.ArgumentParser(
+                    prog='segment-benchmark',
+                    description='Compares the speed of segment_classification with the original per-character '
+                                'classification, which tests/test_segment_classification.py checks it matches',
+                    epilog='')
+parser.add_argument(
+    '-p',
+    '--path',
+    help="Optional.  Text or HTML file whose lines are used as benchmark segments, instead of generated ones.",
+    required=False
+)
+args = parser.parse_args()
+
+
+# Original implementations, benchmarked against.
+def legacy_string_has_text(string):
+    for char in string:
+        if ord(char)>=65 and ord(char)<=90:
+            return True
+        if ord(char)>=97 and ord(char)<=122:
+            return True
+        if ord(char)>0xC0:
+            return True
+
+
+def legacy_is_english_charpoint(string):
+    for char in string:
+        if not (0 < ord(char) <= 127):
+            return False
+    return True
+
+
+def legacy_is_noop_text(text):
+    return len(text)==0 or not legacy_string_has_text(text) or legacy_is_english_charpoint(text)
+
+
+def benchmark_segments():
+    if args.path is not None:
+        return Path(args.path).read_text(encoding="utf-8", errors="replace").splitlines()
+    rng = random.Random(42)
+    english = "Please find attached the invoice for last month, let us know if anything is missing. "
+    english_typographic = "It’s attached — the total is €1 200, thanks. "
+    french = "Veuillez trouver ci-joint la facture du mois dernier, merci de votre retour. "
+    chinese = "请查收附件中的发票。"
+    numbers = "12 345 678 -- 2024/05/01 ; "
+    segments = []
+    for _ in range(20000):
+        sample = rng.choice([english, english_typographic, french, chinese, numbers])
+        segments.append(sample * rng.choice([1, 1, 2, 5, 20]))
+    return segments
+
+
+def benchmark(segments):
+    total_characters = sum(len(segment) for segment in segments)
+    print("Benchmarking " + str(len(segments)) + " segments (" + str(total_characters) + " characters)")
+    for name, classify in (("original is_noop_text", lambda: [legacy_is_noop_text(s) for s in segments]),
+                           ("segment_classification.is_noop_text",
+                            lambda: [segment_classification.is_noop_text(s) for s in segments])):
+        runs = 5
+        best = min(timeit.repeat(classify, number=1, repeat=runs))
+        print("{:<40} {:>10.2f} ms  {:>8.1f} MB/s".format(name, best * 1000, total_characters / best / 1e6))
+
+
+benchmark(benchmark_segments())
@@ -0,0 +1,25 @@
+import re
+
+# Letters as understood by the translator: ASCII letters and every code point above 0xC0.
+TEXT_PATTERN = re.compile("[A-Za-z\u00c1-\U0010ffff]")
+
+
+def string_has_text(string):
+    """Tell whether a string holds an ASCII letter or a code point above 0xC0."""
+    return TEXT_PATTERN.search(string) is not None
+
+
+def is_english_charpoint(string):
+    """Tell whether every character of a string is 7-bit ASCII, NUL excluded."""
+    return string.isascii() and "\x00" not in string
+
+
+def is_noop_text(text):
+    """Tell whether a segment does not need to be translated: empty, without letters, or 7-bit ASCII."""
+    if len(text) == 0:
+        return True
+    if text.isascii():
+        # ASCII text only needs translating when it holds NUL characters and letters.
+        return "\x00" not in text or TEXT_PATTERN.search(text) is None
+    return TEXT_PATTERN.search(text) is None
+
@@ -0,0 +1,269 @@
+import queue
+import threading
+import time
+from typing import Any
+from urllib import error
+
+from libretranslate_api import LibreTranslateAPI
+
+
+# Statuses of a server failing on the content of a batch rather than being unavailable.
+REJECTED_STATUSES = (400, 413, 500)
+
+
+class ServerUnavailable(Exception):
+    """Every server of the pool is failing."""
+
+
+class ServerEndpoint:
+    """A translation server of a ServerPool, with its load, latency, circuit breaker and throughput counters."""
+
+    counter_names = ("requests", "characters", "seconds", "failures", "circuit_opens")
+
+    def __init__(self, url: str, weight: float, pool_size: int):
+        self.api = LibreTranslateAPI(url, pool_size=pool_size)
+        self.weight = weight
+        # Requests sent and not answered yet.
+        self.outstanding = 0
+        # Moving average of the seconds per character of the requests, None until one succeeds.
+        self.seconds_per_character = None
+        self.consecutive_failures = 0
+        # While the circuit is open, the time after which the server is checked again.
+        self.open_until = None
+        self.cooldown = 0.0
+        self.checking = False
+        self.requests = 0
+        self.characters = 0
+        self.seconds = 0.0
+        self.failures = 0
+        self.circuit_opens = 0
+
+    def report(self) -> str:
+        rate = self.characters / self.seconds if self.seconds > 0 else 0
+        return ("Server " + self.api.url + " (weight " + "{:g}".format(self.weight) + "): " + str(self.requests) +
+                " requests, " + str(self.characters) + " characters, " + str(round(rate)) +
+                " characters per second, " + str(self.failures) + " failures, circuit opened " +
+                str(self.circuit_opens) + " times.")
+
+
+class ServerPool:
+    """Translation servers sharing the batches in proportion to their weights.
+
+    Each batch goes to the server with the fewest outstanding requests relative to its weight.  Between servers
+    as loaded, it goes to the one which answered with the lowest latency recently, servers not tried yet coming
+    first, then to each in turn.  After failure_threshold consecutive failures, a server's circuit opens: it gets
+    no batches for a cooldown, after which its /languages endpoint is requested in the background.  When it
+    answers, the server gets batches again, but its next failure opens the circuit again.  The cooldown doubles
+    every time, up to max_cooldown seconds, until the server translates a batch.
+    """
+
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(self, servers: list, pool_size: int, timeout: float | None, failure_threshold: int = 3,
+                 base_cooldown: float = 5.0, max_cooldown: float = 300.0):
+        """Create a pool of translation servers.
+
+        Args:
+            servers (list): (url, weight) tuples.  A server with twice the weight is given twice the load.
+            pool_size (int): Number of idle keep-alive connections kept open to each server.
+            timeout (float): Timeout of the translation requests in seconds, None for no limit.
+            failure_threshold (int): Consecutive failures after which the circuit of a server opens.
+            base_cooldown (float): Seconds a circuit stays open before the server is first checked.
+            max_cooldown (float): Longest time a circuit stays open between checks.
+        """
+        self.endpoints = [ServerEndpoint(url, weight, pool_size) for url, weight in servers]
+        self.url = " ".join(endpoint.api.url for endpoint in self.endpoints)
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        # Index of the server first in turn between servers as loaded and as fast.
+        self.turn = 0
+        self.lock = threading.Lock()
+
+    def reset_connections(self):
+        """Drop the connections and checks of the parent process, in a forked worker process."""
+        for endpoint in self.endpoints:
+            endpoint.api.connections = queue.LifoQueue(maxsize=endpoint.api.connections.maxsize)
+            endpoint.outstanding = 0
+            endpoint.checking = False
+
+    def available(self) -> bool:
+        """Tell whether the circuit of a server is closed."""
+        return any(endpoint.open_until is None for endpoint in self.endpoints)
+
+    def choose(self) -> ServerEndpoint | None:
+        with self.lock:
+            now = time.time()
+            candidates = []
+            for endpoint in self.endpoints:
+                if endpoint.open_until is None:
+                    candidates.append(endpoint)
+                elif now >= endpoint.open_until and not endpoint.checking:
+                    endpoint.checking = True
+                    threading.Thread(target=self.check, args=(endpoint,), daemon=True).start()
+            if len(candidates) == 0:
+                return None
+            count = len(self.endpoints)
+            chosen = min(candidates, key=lambda endpoint: (
+                (endpoint.outstanding + 1) / endpoint.weight,
+                # Servers without latency yet come first, so that they get tried.
+                endpoint.seconds_per_character or 0.0,
+                (self.endpoints.index(endpoint) - self.turn) % count))
+            self.turn = (self.endpoints.index(chosen) + 1) % count
+            chosen.outstanding += 1
+            return chosen
+
+    def succeeded(self, endpoint: ServerEndpoint, characters: int, seconds: float):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            endpoint.characters += characters
+            endpoint.seconds += seconds
+            if characters == 0:
+                return
+            endpoint.consecutive_failures = 0
+            endpoint.cooldown = 0.0
+            latency = seconds / characters
+            if endpoint.seconds_per_character is None:
+                endpoint.seconds_per_character = latency
+            else:
+                endpoint.seconds_per_character += ServerPool.LATENCY_SMOOTHING * (
+                    latency - endpoint.seconds_per_character)
+
+    def failed(self, endpoint: ServerEndpoint, failure: Exception):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.seconds_per_character is not None:
+                # Until it answers again, the server is taken as slower.
+                endpoint.seconds_per_character *= 2
+            if endpoint.open_until is not None or endpoint.consecutive_failures < self.failure_threshold:
+                return
+            self.open_circuit(endpoint)
+        print("Translation server " + endpoint.api.url + " keeps failing (" + str(failure) + ").  Not sending it "
+              "batches for " + "{:.0f}".format(endpoint.cooldown) + " seconds.", flush=True)
+
+    def open_circuit(self, endpoint: ServerEndpoint):
+        endpoint.cooldown = min(self.max_cooldown, max(self.base_cooldown, endpoint.cooldown * 2))
+        endpoint.open_until = time.time() + endpoint.cooldown
+        endpoint.circuit_opens += 1
+
+    def check(self, endpoint: ServerEndpoint):
+        """Request the languages of a server whose circuit is open, closing the circuit when it answers."""
+        try:
+            endpoint.api.languages(timeout=self.timeout)
+            healthy = True
+        except Exception:
+            healthy = False
+        with self.lock:
+            endpoint.checking = False
+            if healthy:
+                # Half open: the next failure opens the circuit again, for twice as long.
+                endpoint.open_until = None
+                endpoint.consecutive_failures = self.failure_threshold - 1
+            else:
+                endpoint.cooldown = min(self.max_cooldown, endpoint.cooldown * 2)
+                endpoint.open_until = time.time() + endpoint.cooldown
+        if healthy:
+            print("Translation server " + endpoint.api.url + " is back.", flush=True)
+
+    def translate(self, texts: list, source: str, target: str) -> Any:
+        """Translate a batch on the server chosen by choose().
+
+        Raises:
+            ServerUnavailable: When the circuits of all the servers are open.
+            error.HTTPError and the exceptions of http.client: When the request fails.
+        """
+        endpoint = self.choose()
+        if endpoint is None:
+            raise ServerUnavailable("All the translation servers are failing")
+        characters = sum(len(text) for text in texts)
+        start = time.time()
+        try:
+            result = endpoint.api.translate(q=texts, source=source, target=target, timeout=self.timeout)
+        except error.HTTPError as e:
+            if e.status in REJECTED_STATUSES:
+                # The content of the batch is at fault, not the server.
+                self.succeeded(endpoint, 0, 0.0)
+            else:
+                self.failed(endpoint, e)
+            raise
+        except Exception as e:
+            self.failed(endpoint, e)
+            raise
+        self.succeeded(endpoint, characters, time.time() - start)
+        return result
+
+    def answering(self) -> bool:
+        """Request the languages of the servers one after the other, telling whether one of them answers."""
+        for endpoint in self.endpoints:
+            try:
+                endpoint.api.languages(timeout=self.timeout)
+                return True
+            except Exception:
+                continue
+        return False
+
+    def languages(self) -> Any:
+        """Request the languages of all the servers at once, returning those of the first server answering.
+
+        The circuits of the servers which do not answer are opened, so that they are not sent the first batches.
+
+        Raises:
+            The exception of the last server when none answers.
+        """
+        answers = [None] * len(self.endpoints)
+
+        def request(index, endpoint):
+            try:
+                answers[index] = (True, endpoint.api.languages(timeout=self.timeout))
+            except Exception as e:
+                answers[index] = (False, e)
+        threads = [threading.Thread(target=request, args=(index, endpoint), daemon=True)
+                   for index, endpoint in enumerate(self.endpoints)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for endpoint, (answered, answer) in zip(self.endpoints, answers):
+            if not answered:
+                print("Translation server " + endpoint.api.url + " is not answering: " + str(answer), flush=True)
+                with self.lock:
+                    self.open_circuit(endpoint)
+        for answered, answer in answers:
+            if answered:
+                return answer
+        raise answers[-1][1]
+
+    def probe(self):
+        """Request the languages of all the servers in the background, opening the circuits of those not answering.
+
+        Used when the languages are known without requesting them.
+        """
+        def run():
+            try:
+                self.languages()
+            except Exception:
+                # Every circuit is open: the batches fail and report it.
+                pass
+        threading.Thread(target=run, name="server-probe", daemon=True).start()
+
+    def report(self) -> str:
+        return "\n".join(endpoint.report() for endpoint in self.endpoints)
+
+
+def parse_server(server: str) -> tuple:
+    """Split a --server value, URL or URL,WEIGHT, into a (url, weight) tuple.
+
+    Raises:
+        ValueError: When the weight is not a positive number.
+    """
+    url, separator, weight = server.rpartition(",")
+    if separator == "":
+        return server, 1.0
+    if float(weight) <= 0:
+        raise ValueError("The weight of " + url + " must be positive")
+    return url, float(weight)
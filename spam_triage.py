@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+
+class SpamTriage:
+    """Spam triage of emails by an OpenAI compatible chat model, run as a stage of its own.
+
+    Up to max_emails emails are packed in one request, each truncated to about max_tokens tokens.  Requests are
+    sent from a pool of up to max_in_flight threads and their responses collected on the main thread, like
+    translation batches: a slow model only holds back the markers of the emails it is triaging, not the
+    translation of the next ones.  Verdicts and summaries are cached by content hash, in memory and optionally
+    in an SQLite database, and saved in a -triage.json file next to each email.
+    """
+
+    counter_names = ("emails", "spam", "requests", "cache_hits", "failures")
+    # Rough size of a token in characters, for any model.
+    CHARACTERS_PER_TOKEN = 4
+    PROMPT = ("You triage emails.  For each email I send, tell whether it is spam and summarize it in under 256 "
+              "characters.  Answer only with a JSON array holding one object per email, in order: "
+              '[{"email": 1, "spam": true, "summary": "..."}]')
+
+    def __init__(self, client, model: str, max_in_flight: int, max_emails: int, max_tokens: int,
+                 cache_path: str | None, metrics, save_file, log):
+        """Prepare the triage stage.
+
+        Args:
+            client (OpenAI): Client of the chat completion server
+            model (str): Model name
+            max_in_flight (int): Maximum number of requests in flight
+            max_emails (int): Maximum number of emails packed in one request
+            max_tokens (int): Approximate number of tokens of each email sent
+            cache_path (str): Path of the SQLite cache database, or None
+            metrics (Metrics): Metrics of the run, timing the requests
+            save_file (callable): Function saving data to a file path, called when the outputs of an email are
+                written
+            log (callable): Function printing verbose messages
+        """
+        self.client = client
+        self.model = model
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_emails = max(1, max_emails)
+        self.max_characters = max_tokens * SpamTriage.CHARACTERS_PER_TOKEN
+        self.cache_path = cache_path
+        self.metrics = metrics
+        self.save_file = save_file
+        self.log = log
+        self.cache = {}
+        self.db = None
+        self.db_pid = None
+        self.pending = []
+        self.in_flight = 0
+        self.completed = queue.Queue()
+        self.executor = None
+        self.emails = 0
+        self.spam = 0
+        self.requests = 0
+        self.cache_hits = 0
+        self.failures = 0
+
+    def connection(self) -> sqlite3.Connection | None:
+        """Return the cache database connection of the current process, opening it on first use."""
+        if self.cache_path is None:
+            return None
+        if self.db is None or self.db_pid != os.getpid():
+            self.db = sqlite3.connect(self.cache_path, timeout=60, isolation_level=None)
+            self.db_pid = os.getpid()
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS triage ("
+                            "key TEXT PRIMARY KEY, spam INTEGER NOT NULL, summary TEXT NOT NULL)")
+        return self.db
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256((self.model + "\0" + SpamTriage.PROMPT + "\0" + text).encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Dict[str, Any] | None:
+        if key in self.cache:
+            return self.cache[key]
+        db = self.connection()
+        if db is None:
+            return None
+        row = db.execute("SELECT spam, summary FROM triage WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        verdict = self.cache[key] = {"spam": bool(row[0]), "summary": row[1]}
+        return verdict
+
+    def store(self, key: str, verdict: Dict[str, Any]):
+        self.cache[key] = verdict
+        db = self.connection()
+        if db is not None:
+            db.execute("INSERT OR REPLACE INTO triage (key, spam, summary) VALUES (?, ?, ?)",
+                       (key, int(verdict["spam"]), verdict["summary"]))
+
+    def submit(self, pathStr: str, text: str, barrier):
+        """Triage the text of an email, holding back the outputs of its barrier until the verdict is saved."""
+        truncated = len(text) > self.max_characters
+        text = text[:self.max_characters]
+        key = self.key(text)
+        self.emails += 1
+        verdict = self.lookup(key)
+        if verdict is not None:
+            self.cache_hits += 1
+            self.save(pathStr, verdict, truncated, barrier)
+            return
+        barrier.pending_batches += 1
+        self.pending.append((pathStr, text, truncated, key, barrier))
+        if len(self.pending) >= self.max_emails:
+            self.flush()
+
+    def flush(self):
+        """Send the emails waiting to fill a request."""
+        if len(self.pending) == 0:
+            return
+        emails = self.pending
+        self.pending = []
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="triage")
+        self.poll()
+        while self.in_flight >= self.max_in_flight:
+            self.process_completion()
+        self.in_flight += 1
+        future = self.executor.submit(self.classify, [email[1] for email in emails])
+        future.add_done_callback(lambda done: self.completed.put((emails, done)))
+
+    def classify(self, texts: list):
+        """Ask the model for the verdicts of several emails, in a triage thread.
+
+        Emails are asked for one by one when the model does not answer for all of them.
+
+        Returns:
+            A list of {"spam": bool, "summary": str} dictionaries, or None for the emails the model did not
+            answer for, and the number of requests sent.
+        """
+        with self.metrics.timer("triage"):
+            content = self.complete(texts)
+        verdicts = self.parse(content, len(texts))
+        if verdicts is not None:
+            return verdicts, 1
+        if len(texts) == 1:
+            self.log("Unexpected spam triage answer: " + content)
+            return [None], 1
+        verdicts = []
+        for text in texts:
+            with self.metrics.timer("triage"):
+                content = self.complete([text])
+            verdict = self.parse(content, 1)
+            verdicts.append(None if verdict is None else verdict[0])
+        return verdicts, 1 + len(texts)
+
+    def complete(self, texts: list) -> str:
+        message = "\n\n".join("Email " + str(index + 1) + ":\n" + text for index, text in enumerate(texts))
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SpamTriage.PROMPT},
+                {"role": "user", "content": message}
+            ],
+            temperature=0,
+        )
+        return completion.choices[0].message.content or ""
+
+    @staticmethod
+    def parse(content: str, count: int) -> list | None:
+        """Read the verdicts of count emails from an answer, or return None if it does not hold them."""
+        start = content.find("[")
+        end = content.rfind("]")
+        if start < 0 or end < start:
+            return None
+        try:
+            answers = json.loads(content[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(answers, list) or len(answers) != count:
+            return None
+        verdicts = []
+        for answer in answers:
+            if not isinstance(answer, dict) or not isinstance(answer.get("spam"), bool):
+                return None
+            verdicts.append({"spam": answer["spam"], "summary": str(answer.get("summary", ""))[:256]})
+        return verdicts
+
+    def process_completion(self):
+        emails, future = self.completed.get()
+        self.in_flight -= 1
+        try:
+            verdicts, requests = future.result()
+        except Exception as e:
+            print("Spam triage of " + str(len(emails)) + " emails failed: " + str(e), flush=True)
+            verdicts, requests = [None] * len(emails), 1
+        self.requests += requests
+        for (pathStr, text, truncated, key, barrier), verdict in zip(emails, verdicts):
+            if verdict is None:
+                self.failures += 1
+            else:
+                self.store(key, verdict)
+            self.save(pathStr, verdict, truncated, barrier)
+            barrier.pending_batches -= 1
+            if barrier.closed and barrier.pending_batches == 0:
+                barrier.finalize()
+
+    def save(self, pathStr: str, verdict: Dict[str, Any] | None, truncated: bool, barrier):
+        if verdict is not None and verdict["spam"]:
+            self.spam += 1
+        result = {"spam": None, "summary": None} if verdict is None else dict(verdict)
+        result.update(model=self.model, truncated=truncated)
+        file_path = pathStr + "-triage.json"
+        barrier.defer(lambda: self.save_file(file_path, json.dumps(result, ensure_ascii=False)), file_path)
+
+    def poll(self):
+        while not self.completed.empty():
+            self.process_completion()
+
+    def drain(self):
+        self.flush()
+        while self.in_flight > 0:
+            self.process_completion()
+
+    def report(self) -> str:
+        return ("Spam triage: " + str(self.emails) + " emails, " + str(self.spam) + " spam, " +
+                str(self.requests) + " requests, " + str(self.cache_hits) + " cache hits, " + str(self.failures) +
+                " without verdict.")
@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+from urllib import request
+
+import pytest
+
+# The helper modules sit next to the scripts, at the root of the repository.
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+class StubServers:
+    """LibreTranslate stubs started on free ports, stopped at the end of the test."""
+
+    def __init__(self):
+        self.processes = []
+
+    def start(self, *options) -> str:
+        """Start a stub with libretranslate-stub.py options and return its URL."""
+        stub = subprocess.Popen([sys.executable, os.path.join(REPO, "libretranslate-stub.py"), "-p", "0", *options],
+                                stdout=subprocess.PIPE, text=True)
+        self.processes.append(stub)
+        # "LibreTranslate stub listening on http://127.0.0.1:PORT/"
+        return stub.stdout.readline().split()[-1]
+
+    @staticmethod
+    def stats(url: str) -> dict:
+        """Return the request counters of a stub."""
+        with request.urlopen(url + "stats", timeout=10) as response:
+            return json.load(response)
+
+    def stop(self):
+        for stub in self.processes:
+            if stub.poll() is None:
+                stub.terminate()
+            stub.wait()
+
+
+@pytest.fixture
+def stub_servers():
+    servers = StubServers()
+    try:
+        yield servers
+    finally:
+        servers.stop()
+
+
+@pytest.fixture
+def run_translator(tmp_path_factory):
+    """Run eml-translator.py with arguments and return the completed process, failing on a non-zero exit.
+
+    The server metadata is cached in a temporary directory of the test, not in the cache of the user.
+    """
+    cache_home = str(tmp_path_factory.mktemp("cache"))
+
+    def run(*arguments, check=True, timeout=120, env=None):
+        run_env = dict(os.environ, XDG_CACHE_HOME=cache_home, **(env or {}))
+        completed = subprocess.run([sys.executable, os.path.join(REPO, "eml-translator.py"), *map(str, arguments)],
+                                   capture_output=True, text=True, timeout=timeout, env=run_env)
+        if check and completed.returncode != 0:
+            pytest.fail("eml-translator.py exited with " + str(completed.returncode) + ":\n" + completed.stdout +
+                        completed.stderr)
+        return completed
+    return run
@@ -0,0 +1,72 @@
+import io
+import os
+import zipfile
+from email.message import EmailMessage
+
+from attachment_store import AttachmentCapture, AttachmentStore
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def docx_bytes(paragraphs):
+    document = "".join("<w:p><w:r><w:t>" + paragraph + "</w:t></w:r></w:p>" for paragraph in paragraphs)
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml",
+                         '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Override PartName="/word/document.xml" ContentType="application/'
+                         'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        package.writestr("word/document.xml",
+                         '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                         '<w:body>' + document + '</w:body></w:document>')
+    return data.getvalue()
+
+
+def test_stored_attachments_are_materialized(tmp_path):
+    store = AttachmentStore(str(tmp_path / "store"), "hardlink")
+    digest = store.digest(b"contenu", "auto", "en")
+    assert digest != store.digest(b"contenu", "auto", "de")
+    assert store.lookup(digest) is None
+
+    capture = AttachmentCapture(digest, str(tmp_path / "mail.eml-contrat.docx"), 7)
+    capture.artifacts[".pdf"] = b"%PDF traduit"
+    capture.artifacts["-text.txt"] = "Texte traduit"
+    capture.segments = 3
+    capture.characters = 42
+    store.commit(capture)
+    meta = store.lookup(digest)
+    assert (meta["size"], meta["segments"], meta["characters"]) == (7, 3, 42)
+
+    entry_path = store.entry_path(digest)
+    for suffix, contents in ((".pdf", b"%PDF traduit"), ("-text.txt", b"Texte traduit")):
+        store.materialize_file(os.path.join(entry_path, meta["artifacts"][suffix]), str(tmp_path / ("out" + suffix)))
+        assert (tmp_path / ("out" + suffix)).read_bytes() == contents
+    # Hard links share the stored file.
+    assert os.stat(tmp_path / "out.pdf").st_nlink == 2
+
+
+def test_repeated_attachment_is_translated_once(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    attachment = docx_bytes(["Le contrat est signé.", "Les conditions générales sont jointes."])
+    for index in range(3):
+        message = EmailMessage()
+        message["Subject"] = "Contrat"
+        message.set_content("Voici le contrat numéro " + str(index) + ".\n")
+        message.add_attachment(attachment, maintype="application", subtype=DOCX_MIME_TYPE.split("/")[1],
+                               filename="contrat.docx")
+        (tmp_path / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+
+    result = run_translator("-s", server, "--attachment-store", tmp_path / "store", "--store-link", "copy",
+                            "--pack-emails", "0", tmp_path)
+
+    # The three bodies and the two paragraphs of the attachment.
+    assert stub_servers.stats(server)["segments"] == 5
+    assert "2 attachments materialized, 1 translated" in result.stdout
+    assert "translating 4 segments" in result.stdout
+    translated = (tmp_path / "mail-0.eml-contrat.docx").read_bytes()
+    with zipfile.ZipFile(io.BytesIO(translated)) as package:
+        assert "[fr-&gt;en] Le contrat est signé." in package.read("word/document.xml").decode("utf-8")
+    for index in (1, 2):
+        assert (tmp_path / ("mail-" + str(index) + ".eml-contrat.docx")).read_bytes() == translated
@@ -0,0 +1,103 @@
+import json
+import os
+from email.message import EmailMessage
+
+from completion_journal import CompletionJournal
+from work_queue import WorkQueue
+
+
+def write_email(path, paragraphs):
+    message = EmailMessage()
+    message["Subject"] = "Rapport"
+    message.set_content("\n\n".join(paragraphs) + "\n")
+    path.write_bytes(bytes(message))
+
+
+def write_emails(directory):
+    directory.mkdir()
+    write_email(directory / "first.eml", ["Premier message, écrit en français."])
+    write_email(directory / "broken.eml", ["Ce message est BROKEN, hélas.", "Son deuxième paragraphe est correct."])
+    write_email(directory / "last.eml", ["Dernier message, écrit en français."])
+
+
+def read_log(path):
+    with open(path, encoding="utf-8") as log_file:
+        return [json.loads(line) for line in log_file]
+
+
+def test_rejected_segments_are_isolated_by_bisection(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start("--reject", "POISON")
+    paragraphs = ["Paragraphe numéro " + str(index) + "." for index in range(8)]
+    paragraphs[5] = "Paragraphe POISON numéro 5."
+    write_email(tmp_path / "mail.eml", paragraphs)
+
+    result = run_translator("-s", server, "--batch-log", tmp_path / "batches.jsonl", tmp_path)
+
+    [outcome] = read_log(tmp_path / "batches.jsonl")
+    assert outcome["status"] == "partial"
+    assert outcome["bisections"] == 3
+    assert [quarantined["text"] for quarantined in outcome["quarantined"]] == ["Paragraphe POISON numéro 5."]
+    assert "1 segments (27 characters) could not be translated" in result.stdout
+    body = (tmp_path / "mail.eml-body-1.html").read_text(encoding="utf-8")
+    assert body.count("[AUTO_TRANSLATED]") == 7
+    assert os.path.isfile(tmp_path / "mail.eml-translated-mark.mrk")
+
+
+def test_emails_of_failed_batches_are_left_for_the_next_run(tmp_path, stub_servers, run_translator):
+    overloaded = stub_servers.start("--unavailable", "BROKEN")
+    write_emails(tmp_path / "mails")
+    journal_path = tmp_path / "journal.jsonl"
+
+    # A batch per email, so that only the email with the overloading segment fails.
+    result = run_translator("-s", overloaded, "--retries", "1", "--pack-emails", "1", "-j", journal_path,
+                            "--batch-log", tmp_path / "batches.jsonl", tmp_path / "mails")
+
+    names = sorted(os.listdir(tmp_path / "mails"))
+    assert [name for name in names if name.startswith("broken.eml-")] == []
+    assert "first.eml-translated-mark.mrk" in names
+    assert "last.eml-translated-mark.mrk" in names
+    assert "1 emails were left without outputs after their translation failed" in result.stdout
+    assert "2 segments (65 characters) of failed batches are left for the next run" in result.stdout
+    assert sorted(outcome["status"] for outcome in read_log(tmp_path / "batches.jsonl")) == ["failed", "ok", "ok"]
+    journal = CompletionJournal(str(journal_path))
+    assert {os.path.basename(path): record["status"] for path, record in journal.entries.items()} == {
+        "first.eml": "translated", "broken.eml": "failed", "last.eml": "translated"}
+
+    server = stub_servers.start()
+    result = run_translator("-s", server, "-j", journal_path, tmp_path / "mails")
+    assert "2 eml files already completed according to the journal" in result.stdout
+    assert stub_servers.stats(server)["segments"] == 2
+    assert "BROKEN" in (tmp_path / "mails" / "broken.eml-body-1.html").read_text(encoding="utf-8")
+
+
+def test_workers_report_failed_emails(tmp_path, stub_servers, run_translator):
+    overloaded = stub_servers.start("--unavailable", "BROKEN")
+    write_emails(tmp_path / "mails")
+
+    result = run_translator("-s", overloaded, "--retries", "1", "--pack-emails", "1", "-w", "2", "-q",
+                            tmp_path / "queue.db", tmp_path / "mails")
+
+    assert "failed: 1" in result.stdout
+    assert "translated: 2" in result.stdout
+    assert not os.path.exists(tmp_path / "mails" / "broken.eml-translated-mark.mrk")
+    # Failed emails are claimed again by the next run.
+    queue = WorkQueue(str(tmp_path / "queue.db"), 60, 1)
+    queue.add([str(tmp_path / "mails" / name) for name in ("first.eml", "broken.eml", "last.eml")])
+    assert queue.claim() == [str(tmp_path / "mails" / "broken.eml")]
+    assert queue.claim() == []
+
+
+def test_run_stops_when_no_server_answers(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    write_email(tmp_path / "first.eml", ["Premier message, écrit en français."])
+    cache = tmp_path / "cache"
+    run_translator("-s", server, "--metadata-cache", cache, tmp_path)
+    stub_servers.stop()
+    write_email(tmp_path / "second.eml", ["Deuxième message, écrit en français."])
+
+    # The languages of the server are still cached.
+    result = run_translator("-s", server, "--metadata-cache", cache, "--retries", "1", tmp_path, check=False)
+
+    assert result.returncode == 1
+    assert "Stopping: Translation failed after 2 attempts" in result.stdout
+    assert not os.path.exists(tmp_path / "second.eml-translated-mark.mrk")
@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import REPO
+
+
+def benchmark(cache_path, *args):
+    # A metadata cache of its own, so that the languages of the stub are requested by the first content type.
+    return subprocess.run([sys.executable, os.path.join(REPO, "eml-benchmark.py"), *map(str, args)], check=True,
+                          capture_output=True, text=True, timeout=300,
+                          env=dict(os.environ, XDG_CACHE_HOME=str(cache_path)))
+
+
+def test_generated_corpus_is_reproducible(tmp_path):
+    for name in ("first", "second"):
+        benchmark(tmp_path / "cache", "generate", "-n", "2", tmp_path / name)
+
+    for content_type in ("plain", "html", "pdf", "docx", "rfc822", "oversized", "multilingual"):
+        for index in range(2):
+            email_name = "email-0000" + str(index) + ".eml"
+            assert ((tmp_path / "first" / content_type / email_name).read_bytes() ==
+                    (tmp_path / "second" / content_type / email_name).read_bytes())
+
+
+def test_run_saves_and_compares_results(tmp_path):
+    benchmark(tmp_path / "cache", "generate", "-n", "3", tmp_path / "corpus")
+
+    result = benchmark(tmp_path / "cache", "run", tmp_path / "corpus", "-t", "-l fr", "--types", "plain,docx",
+                       "--machine", "test", "--save", tmp_path / "results.json",
+                       "--baseline", os.path.join(REPO, "benchmarks", "baseline.json"))
+
+    text = (tmp_path / "results.json").read_text(encoding="utf-8")
+    assert text.endswith("}\n")
+    saved = json.loads(text)
+    assert saved["machine"]["description"] == "test"
+    assert sorted(saved["results"]) == ["docx", "plain"]
+    for measures in saved["results"].values():
+        assert measures["emails"] == 3
+        assert measures["segments"] > 0
+        assert measures["peak_rss_mb"] > 0
+    # A batch per email, after the languages request of the first run.
+    assert [saved["results"][content_type]["round_trips"] for content_type in ("plain", "docx")] == [4, 3]
+    assert result.stdout.count("vs baseline") == 2
@@ -0,0 +1,70 @@
+import json
+import os
+from email.message import EmailMessage
+
+from completion_journal import CompletionJournal
+
+
+def write_email(path, text):
+    message = EmailMessage()
+    message["Subject"] = "Réunion"
+    message.set_content(text)
+    path.write_bytes(bytes(message))
+
+
+def test_last_record_wins_and_truncated_lines_are_ignored(tmp_path):
+    email_path = tmp_path / "mail.eml"
+    email_path.write_bytes(b"Subject: test\n\n")
+    journal = CompletionJournal(str(tmp_path / "journal.jsonl"))
+    journal.record(str(email_path), os.stat(email_path), "failed")
+    journal.record(str(email_path), os.stat(email_path), "translated")
+    with open(tmp_path / "journal.jsonl", "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"path": "' + str(tmp_path / "other.eml") + '", "si')
+
+    reloaded = CompletionJournal(str(tmp_path / "journal.jsonl"))
+    assert list(reloaded.entries) == [str(email_path)]
+    assert reloaded.is_complete(str(email_path), os.stat(email_path))
+
+    email_path.write_bytes(b"Subject: changed\n\n")
+    assert not reloaded.is_complete(str(email_path), os.stat(email_path))
+
+
+def test_resumed_run_only_translates_changed_emails(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    (tmp_path / "mails").mkdir()
+    for index in range(4):
+        write_email(tmp_path / "mails" / ("mail-" + str(index) + ".eml"), "Message numéro " + str(index) + ".\n")
+    journal_path = tmp_path / "journal.jsonl"
+    run_translator("-s", server, "-j", journal_path, tmp_path / "mails")
+
+    result = run_translator("-s", server, "-j", journal_path, tmp_path / "mails")
+    assert "4 eml files already completed according to the journal" in result.stdout
+    requests = stub_servers.stats(server)["translate_requests"]
+
+    write_email(tmp_path / "mails" / "mail-2.eml", "Message numéro 2, modifié.\n")
+    # Outputs of the previous translation are replaced, whatever the markers say.
+    result = run_translator("-s", server, "-j", journal_path, tmp_path / "mails")
+    assert "3 eml files already completed according to the journal" in result.stdout
+    assert stub_servers.stats(server)["translate_requests"] == requests + 1
+    assert "modifié" in (tmp_path / "mails" / "mail-2.eml-body-1.html").read_text(encoding="utf-8")
+    with open(journal_path, encoding="utf-8") as journal_file:
+        records = [json.loads(line) for line in journal_file]
+    assert [record["status"] for record in records] == ["translated"] * 5
+
+
+def test_existing_markers_are_imported(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    for index in range(3):
+        write_email(tmp_path / ("mail-" + str(index) + ".eml"), "Message numéro " + str(index) + ".\n")
+    # Translated before the journal existed, by the marker or by the outputs of older versions.
+    (tmp_path / "mail-0.eml-translated-mark.mrk").touch()
+    (tmp_path / "mail-1.eml-body-1.html").write_text("Traduit.", encoding="utf-8")
+    journal_path = tmp_path / "journal.jsonl"
+
+    run_translator("-s", server, "-j", journal_path, "--import-markers", tmp_path)
+
+    journal = CompletionJournal(str(journal_path))
+    assert {os.path.basename(path): record["status"] for path, record in journal.entries.items()} == {
+        "mail-0.eml": "imported", "mail-1.eml": "imported", "mail-2.eml": "translated"}
+    assert (tmp_path / "mail-1.eml-body-1.html").read_text(encoding="utf-8") == "Traduit."
+    assert stub_servers.stats(server)["translate_requests"] == 1
@@ -0,0 +1,119 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from email.message import EmailMessage
+
+import pytest
+
+from conftest import REPO
+from directory_watch import DirectoryWatcher, Inotify
+
+
+def inotify_available():
+    try:
+        Inotify().close()
+        return True
+    except OSError:
+        return False
+
+
+MODES = ["poll", pytest.param("inotify", marks=pytest.mark.skipif(not inotify_available(),
+                                                                   reason="inotify is not available"))]
+
+
+def wait_for(watcher, count, timeout=10.0):
+    """Return the first count files reported by a watcher."""
+    reported = []
+    deadline = time.time() + timeout
+    while len(reported) < count and time.time() < deadline:
+        reported.extend(path for path, arrival in watcher.wait(deadline - time.time()))
+    return reported
+
+
+@pytest.fixture(params=MODES)
+def new_watcher(request, tmp_path):
+    watchers = []
+
+    def new(settle_seconds=0.2):
+        watcher = DirectoryWatcher(str(tmp_path), settle_seconds, 0.05, request.param)
+        assert watcher.mode == request.param
+        watchers.append(watcher)
+        return watcher
+    yield new
+    for watcher in watchers:
+        watcher.close()
+
+
+def test_new_emails_are_reported_once_settled(tmp_path, new_watcher):
+    (tmp_path / "old.eml").write_bytes(b"Subject: old\n")
+    watcher = new_watcher()
+
+    (tmp_path / "new.eml").write_bytes(b"Subject: new\n")
+    (tmp_path / "notes.txt").write_bytes(b"notes")
+    assert watcher.wait(0.05) == []
+
+    assert wait_for(watcher, 1) == [str(tmp_path / "new.eml")]
+    assert watcher.wait(0.3) == []
+
+
+def test_emails_being_written_are_reported_when_complete(tmp_path, new_watcher):
+    watcher = new_watcher(settle_seconds=0.3)
+
+    def write_slowly():
+        with open(tmp_path / "slow.eml", "wb") as email_file:
+            for _ in range(5):
+                email_file.write(b"x" * 1000)
+                email_file.flush()
+                time.sleep(0.1)
+    writer = threading.Thread(target=write_slowly)
+    writer.start()
+    reported = wait_for(watcher, 1)
+    writer.join()
+
+    assert reported == [str(tmp_path / "slow.eml")]
+    assert os.path.getsize(tmp_path / "slow.eml") == 5000
+
+
+def test_emails_of_new_directories_are_reported(tmp_path, new_watcher):
+    watcher = new_watcher()
+
+    (tmp_path / "2024" / "05").mkdir(parents=True)
+    (tmp_path / "2024" / "05" / "mail.eml").write_bytes(b"Subject: new\n")
+    (tmp_path / "removed.eml").write_bytes(b"Subject: removed\n")
+    (tmp_path / "removed.eml").unlink()
+
+    assert wait_for(watcher, 1) == [str(tmp_path / "2024" / "05" / "mail.eml")]
+    assert watcher.pending_count() == 0
+
+
+def test_watched_emails_are_translated_as_they_arrive(tmp_path, stub_servers):
+    server = stub_servers.start()
+    (tmp_path / "mails").mkdir()
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / "cache"))
+    translator = subprocess.Popen([sys.executable, os.path.join(REPO, "eml-translator.py"), "-s", server, "--watch",
+                                   "--watch-mode", "poll", "--watch-interval", "0.05", "--settle", "0.2",
+                                   str(tmp_path / "mails")], stdout=subprocess.PIPE, text=True, env=env)
+    try:
+        lines = []
+        # Emails arriving before the directory is listed are translated by the first pass, like any other run.
+        while "Translating 0 eml files\n" not in lines and translator.poll() is None:
+            lines.append(translator.stdout.readline())
+        assert "Watching " + str(tmp_path / "mails") + " with poll\n" in lines
+        message = EmailMessage()
+        message["Subject"] = "Réunion"
+        message.set_content("Le compte rendu de la réunion est prêt.\n")
+        (tmp_path / "mails" / "mail.eml").write_bytes(bytes(message))
+        deadline = time.time() + 30
+        while not (tmp_path / "mails" / "mail.eml-translated-mark.mrk").exists() and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        translator.send_signal(signal.SIGTERM)
+        stdout = translator.communicate(timeout=30)[0]
+
+    assert translator.returncode == 0
+    assert "[fr->en] Le compte rendu de la réunion est prêt." in (
+        tmp_path / "mails" / "mail.eml-body-1.html").read_text(encoding="utf-8")
+    assert "Watch stopped: 1 emails translated" in stdout
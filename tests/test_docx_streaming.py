@@ -0,0 +1,91 @@
+import io
+import struct
+import zipfile
+
+from docx_streaming import DocxPackage, member_info
+
+CONTENT_TYPES = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                 b'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 b'<Override PartName="/word/document.xml" ContentType="application/'
+                 b'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+DOCUMENT = (b'<?xml version="1.0" encoding="UTF-8"?>'
+            b'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            b'<w:p><w:r><w:t>Le contrat est sign\xc3\xa9.</w:t></w:r></w:p></w:body></w:document>')
+IMAGE = bytes(range(256)) * 64
+
+
+class UnseekableFile(io.RawIOBase):
+    """Write-only file, so that zipfile writes data descriptors after the members."""
+
+    def __init__(self):
+        self.data = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.data.write(data)
+
+
+def docx_file(seekable=True):
+    data = io.BytesIO() if seekable else UnseekableFile()
+    with zipfile.ZipFile(data, "w") as package:
+        package.writestr("[Content_Types].xml", CONTENT_TYPES, zipfile.ZIP_DEFLATED)
+        package.writestr("word/document.xml", DOCUMENT, zipfile.ZIP_DEFLATED)
+        package.writestr("word/media/image1.png", IMAGE, zipfile.ZIP_STORED)
+        # Compressed faster than zipfile does by default, so that compressing it again would give other bytes.
+        package.writestr("word/media/image2.emf", IMAGE, zipfile.ZIP_DEFLATED, compresslevel=1)
+    return io.BytesIO(data.getvalue() if seekable else data.data.getvalue())
+
+
+def compressed_bytes(zip_bytes, info):
+    """Return the data of a member as it is stored in a zip file."""
+    name_length, extra_length = struct.unpack("<2H", zip_bytes[info.header_offset + 26:info.header_offset + 30])
+    start = info.header_offset + 30 + name_length + extra_length
+    return zip_bytes[start:start + info.compress_size]
+
+
+def translate(source):
+    package = DocxPackage(source)
+    [(text, offset)] = package.paragraphs("word/document.xml")
+    assert text == "Le contrat est signé."
+    output = io.BytesIO()
+    package.write(output, {"word/document.xml": {offset: package.run("word/document.xml", "The contract")}})
+    package.close()
+    return output.getvalue()
+
+
+def test_write_inserts_runs_and_copies_other_members_compressed():
+    for seekable in (True, False):
+        original_bytes = docx_file(seekable).getvalue()
+        written_bytes = translate(docx_file(seekable))
+
+        with zipfile.ZipFile(io.BytesIO(written_bytes)) as written, \
+                zipfile.ZipFile(io.BytesIO(original_bytes)) as original:
+            assert written.testzip() is None
+            assert written.namelist() == original.namelist()
+            for info in original.infolist():
+                if info.filename == "word/document.xml":
+                    continue
+                copied = written.getinfo(info.filename)
+                # Exactly what is preserved of the members which are not translated.
+                assert ((copied.compress_type, copied.CRC, copied.file_size, copied.compress_size, copied.date_time,
+                         copied.external_attr) ==
+                        (info.compress_type, info.CRC, info.file_size, info.compress_size, info.date_time,
+                         info.external_attr))
+                assert compressed_bytes(written_bytes, copied) == compressed_bytes(original_bytes, info)
+                assert copied.flag_bits & 0x08 == 0
+            document = written.read("word/document.xml")
+        assert document == DOCUMENT.replace(b"</w:p>",
+                                            b'<w:r><w:t xml:space="preserve">The contract</w:t></w:r></w:p>')
+
+
+def test_size_of_translated_members_includes_their_runs():
+    info = zipfile.ZipInfo("word/document.xml", (2024, 5, 6, 10, 0, 0))
+    info.file_size = zipfile.ZIP64_LIMIT - 100
+
+    grown = member_info(info, zipfile.ZIP_DEFLATED, 1000)
+
+    # Large enough for zipfile to write Zip64 extra fields.
+    assert grown.file_size == zipfile.ZIP64_LIMIT + 900
+    assert (grown.compress_type, grown.date_time) == (zipfile.ZIP_DEFLATED, info.date_time)
@@ -0,0 +1,74 @@
+from email.message import EmailMessage
+
+import pytest
+from bs4 import BeautifulSoup
+
+from html_segmentation import block_segments
+
+
+def segments(html, parser="html.parser"):
+    return [text for text, last_node in block_segments(BeautifulSoup(html, parser))]
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml"])
+def test_inline_elements_stay_in_their_sentence(parser):
+    html = ("<html><body><p>Le <b>contrat</b> est <a href='#'>signé</a>.</p>"
+            "<div>Premier bloc<div>Bloc imbriqué</div>suite du premier bloc</div></body></html>")
+
+    assert segments(html, parser) == ["Le contrat est signé.", "Premier bloc", "Bloc imbriqué",
+                                      "suite du premier bloc"]
+
+
+def test_line_breaks_and_tables_end_segments():
+    html = "<p>Première ligne<br>Deuxième ligne</p><table><tr><td>Nom</td><td>Prénom</td></tr></table>"
+
+    assert segments(html) == ["Première ligne", "Deuxième ligne", "Nom", "Prénom"]
+
+
+def test_inline_element_holding_a_block_is_a_block():
+    assert segments("<span>Avant<p>Paragraphe</p>après</span>") == ["Avant", "Paragraphe", "après"]
+
+
+def test_hidden_content_is_skipped():
+    html = ("<head><title>Titre</title><style>p { color: red; }</style></head>"
+            "<body><script>var x = 'é';</script><div style='display: none'>Aperçu caché</div>"
+            "<p hidden>Caché</p><p>Visible <span style='visibility:hidden'>caché</span>texte<!-- commentaire --></p>"
+            "</body>")
+
+    assert segments(html) == ["Titre", "Visible texte"]
+
+
+def test_whitespace_is_collapsed_except_in_preformatted_text():
+    html = "<p>  Un   texte\n  sur deux lignes </p><pre>Bloc\n  préformaté</pre><p> \n </p>"
+
+    assert segments(html) == ["Un texte sur deux lignes", "Bloc\n  préformaté"]
+
+
+def test_last_node_of_each_segment():
+    soup = BeautifulSoup("<p>Le <b>contrat</b> est signé<br>Merci</p>", "html.parser")
+
+    [(first, first_node), (second, second_node)] = block_segments(soup)
+
+    assert str(first_node) == " est signé"
+    assert str(second_node) == "Merci"
+    # Translations are inserted after the last node, inside the block.
+    first_node.insert_after(" --- traduit")
+    assert str(soup) == "<p>Le <b>contrat</b> est signé --- traduit<br/>Merci</p>"
+
+
+def test_html_parts_are_translated_by_block(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    message = EmailMessage()
+    message["Subject"] = "Contrat"
+    message.set_content("Le contrat est signé.\n")
+    message.add_alternative("<html><body><p>Le <b>contrat</b> est signé.</p><ul><li>Première étape</li>"
+                            "<li>Deuxième étape</li></ul><script>var é = 1;</script></body></html>", subtype="html")
+    (tmp_path / "mail.eml").write_bytes(bytes(message))
+
+    run_translator("-s", server, tmp_path)
+
+    html = (tmp_path / "mail.eml-body-2.html").read_text(encoding="utf-8")
+    assert ("<p>Le <b>contrat</b> est signé. --- \n[AUTO_TRANSLATED] FROM fr: [fr-&gt;en] Le contrat est signé.</p>"
+            in html)
+    assert "<li>Première étape --- \n[AUTO_TRANSLATED] FROM fr: [fr-&gt;en] Première étape</li>" in html
+    assert "<script>var é = 1;</script>" in html
@@ -0,0 +1,103 @@
+import os
+from email.message import EmailMessage
+
+import pytest
+
+from conftest import REPO
+from language_identification import LanguageGuesser
+
+CODES = ["en", "fr", "de", "es", "it", "pt", "nl", "ru", "zh"]
+
+
+@pytest.fixture
+def guesser():
+    return LanguageGuesser(os.path.join(REPO, "language-profiles.json"), 0.3, CODES)
+
+
+@pytest.mark.parametrize("text", [
+    "Please find attached the report we discussed during Monday’s call.",
+    "I’ll send the updated figures as soon as they are available.",
+    "Let me know if anything is missing — thanks again for your help.",
+    # Words of other languages which are also English words.
+    "I’ll die if the van is late, so please come over.",
+    "I’ll come over to the office so we can check the van order together.",
+])
+def test_english(guesser, text):
+    assert guesser.guess(text) == "en"
+
+
+@pytest.mark.parametrize("language, text", [
+    ("fr", "Bonjour à tous, veuillez trouver ci-joint le rapport trimestriel de l'équipe."),
+    ("fr", "Merci de me faire part de vos remarques avant vendredi prochain."),
+    ("de", "Für Rückfragen stehe ich Ihnen jederzeit gerne zur Verfügung."),
+    ("es", "Quedamos a su disposición para cualquier consulta adicional."),
+    ("it", "La riunione è stata spostata a giovedì alla stessa ora."),
+    ("pt", "Prezado cliente, segue em anexo a fatura referente ao mês de março."),
+    ("nl", "Beste collega, hierbij stuur ik je het rapport van de vergadering."),
+    ("ru", "Добрый день, направляю вам договор для согласования."),
+])
+def test_other_languages(guesser, language, text):
+    assert guesser.guess(text) == language
+
+
+@pytest.mark.parametrize("text", [
+    # Mostly English, but not only.
+    "Le client a signé the contract and the invoice is attached for the review.",
+    "Bonjour, please find the contract attached and let me know.",
+    "Please review the café menu and the résumé.",
+    # Too short to tell.
+    "Merci",
+    "2024-03-01",
+])
+def test_left_to_the_server(guesser, text):
+    assert guesser.guess(text) is None
+
+
+def test_counters(guesser):
+    for text in ("Thanks, that’s great.", "Merci de me faire part de vos remarques.", "Bonjour, thanks for the file."):
+        guesser.guess(text)
+
+    assert (guesser.english_segments, guesser.explicit_segments, guesser.unknown_segments) == (1, 1, 1)
+    assert guesser.english_characters == len("Thanks, that’s great.")
+    assert guesser.report() == ("Local language identification: 1 English segments (21 characters) not sent to the "
+                                "server, 1 segments sent with their source language, 1 left to the server.")
+
+
+def test_threshold(guesser):
+    strict = LanguageGuesser(os.path.join(REPO, "language-profiles.json"), 0.9, CODES)
+    text = "Nous avons constaté une hausse des ventes de 12 % par rapport à l'année dernière."
+    assert guesser.guess(text) == "fr"
+    assert strict.guess(text) is None
+
+
+def test_english_segments_are_not_sent(tmp_path, stub_servers, run_translator):
+    # The stub reports Italian for auto detected segments.  Segments in 7-bit ASCII are never sent.
+    server = stub_servers.start("--language", "it")
+    message = EmailMessage()
+    message["Subject"] = "Contract"
+    message.set_content("Please find attached the contract we discussed during Monday’s call.\n\n"
+                        "Merci de me faire part de vos remarques avant la réunion de vendredi.\n\n"
+                        "Bonjour, please find the contract attached and let me know what’s missing.\n")
+    (tmp_path / "mail.eml").write_bytes(bytes(message))
+
+    result = run_translator("-s", server, "--langid-threshold", "0.3", tmp_path)
+
+    assert stub_servers.stats(server)["segments"] == 2
+    assert "Local language identification: 1 English segments (68 characters) not sent to the server" in result.stdout
+    body = (tmp_path / "mail.eml-body-1.html").read_text(encoding="utf-8")
+    assert "Monday’s call. --- " not in body
+    assert "[fr->en] Merci de me faire part" in body
+    assert "[it->en] Bonjour, please find" in body
+
+
+def test_disabled_by_default(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    message = EmailMessage()
+    message["Subject"] = "Contract"
+    message.set_content("Please find attached the contract we discussed during Monday’s call.\n")
+    (tmp_path / "mail.eml").write_bytes(bytes(message))
+
+    result = run_translator("-s", server, tmp_path)
+
+    assert stub_servers.stats(server)["segments"] == 1
+    assert "Local language identification" not in result.stdout
@@ -0,0 +1,64 @@
+from email.message import EmailMessage
+from urllib import error
+
+import pytest
+
+from libretranslate_api import LibreTranslateAPI
+
+
+def test_connections_are_kept_alive_and_reused(stub_servers):
+    server = stub_servers.start()
+    api = LibreTranslateAPI(server, pool_size=2)
+
+    assert api.translate(["Premier", "Deuxième"], "fr", "en") == {"translatedText": ["[fr->en] Premier",
+                                                                                    "[fr->en] Deuxième"]}
+    connection = api.connections.queue[0]
+    local_address = connection.sock.getsockname()
+    api.translate("Troisième", "fr", "en")
+    api.languages()
+
+    assert list(api.connections.queue) == [connection]
+    assert connection.sock.getsockname() == local_address
+    assert stub_servers.stats(server)["requests"] == 3
+
+
+def test_server_errors_are_raised_and_the_connection_is_kept(stub_servers):
+    server = stub_servers.start("--reject", "POISON")
+    api = LibreTranslateAPI(server)
+
+    with pytest.raises(error.HTTPError) as raised:
+        api.translate("POISON", "fr", "en")
+    assert raised.value.code == 500
+    assert api.translate("Bon", "fr", "en") == {"translatedText": "[fr->en] Bon"}
+    assert api.connections.qsize() == 1
+
+
+def test_connection_closed_by_a_restarted_server_is_replaced(stub_servers):
+    server = stub_servers.start()
+    api = LibreTranslateAPI(server)
+    api.languages()
+    stub_servers.stop()
+    port = server.rstrip("/").rsplit(":", 1)[1]
+    restarted = stub_servers.start("--port", port)
+
+    assert restarted == server
+    assert api.translate("Encore", "fr", "en") == {"translatedText": "[fr->en] Encore"}
+
+
+def test_batches_in_flight_give_the_same_outputs(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start("--latency", "0.02")
+    outputs = {}
+    for inflight in ("1", "4"):
+        directory = tmp_path / inflight
+        directory.mkdir()
+        for index in range(6):
+            message = EmailMessage()
+            message["Subject"] = "Numéro " + str(index)
+            message.set_content("\n\n".join("Paragraphe " + str(paragraph) + " du message " + str(index) +
+                                            ", écrit en français." for paragraph in range(20)) + "\n")
+            (directory / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+        run_translator("-s", server, "-n", inflight, "--batch-size", "400", directory)
+        outputs[inflight] = {path.name: path.read_bytes() for path in directory.iterdir()}
+
+    assert len(outputs["1"]) == 6 * 3
+    assert outputs["4"] == outputs["1"]
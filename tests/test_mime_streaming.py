@@ -0,0 +1,76 @@
+import io
+import os
+import random
+from email.message import EmailMessage
+
+from mime_streaming import MimeStreamParser, decode_body, decode_field
+
+
+def build_email():
+    message = EmailMessage()
+    message["Subject"] = "Rapport annuel"
+    message.set_content("Le rapport annuel est en pièce jointe.\n\nCordialement, l'équipe.\n", charset="iso-8859-1",
+                        cte="quoted-printable")
+    message.add_alternative("<p>Le rapport annuel est en pièce jointe.</p><p>Cordialement, l'équipe.</p>",
+                            subtype="html")
+    forwarded = EmailMessage()
+    forwarded["Subject"] = "Première version"
+    forwarded.set_content("Voici la première version du rapport.\n")
+    forwarded.add_attachment("Notes de la première réunion.\n", filename="notes.txt")
+    message.add_attachment(forwarded)
+    message.add_attachment(random.Random(1).randbytes(200 * 1024), maintype="application", subtype="octet-stream",
+                           filename="données brutes.bin")
+    message.add_attachment("Synthèse du rapport annuel.\n".encode("utf-8"), maintype="text", subtype="plain",
+                           filename="synthese.txt")
+    # Declared as ASCII, though written in UTF-8.
+    message.get_payload()[-1].set_param("charset", "us-ascii")
+    message.set_boundary("outer-boundary")
+    return bytes(message)
+
+
+def test_parts_are_told_apart_like_eml_parser(tmp_path):
+    parser = MimeStreamParser(io.BytesIO(build_email()), 1024, str(tmp_path))
+
+    parts = list(parser.parts())
+
+    assert [part[:3] for part in parts if part[0] == "body"] == [
+        ("body", "text/plain", "Le rapport annuel est en pièce jointe.\n\nCordialement, l'équipe.\n"),
+        ("body", "text/html", "<p>Le rapport annuel est en pièce jointe.</p><p>Cordialement, l'équipe.</p>\n"),
+        ("body", "text/plain", "Voici la première version du rapport.\n"),
+        ("body", "text/plain", "Notes de la première réunion.\n"),
+        ("body", "text/plain", "Synthèse du rapport annuel.\n")]
+    attachments = [part for part in parts if part[0] == "attachment"]
+    assert [filename for _, _, filename, _ in attachments] == ["notes.txt", "part-000", "données brutes.bin",
+                                                               "synthese.txt"]
+    spooled = attachments[2][3]
+    assert spooled.path is not None and os.path.dirname(spooled.path) == str(tmp_path)
+    assert spooled.getvalue() == random.Random(1).randbytes(200 * 1024)
+
+
+def test_decoding():
+    assert decode_field("=?utf-8?q?donn=C3=A9es_brutes.bin?=") == "données brutes.bin"
+    assert decode_field("plain.txt") == "plain.txt"
+    # The declared charset is wrong: the body is decoded with the detected one.
+    assert decode_body("Synthèse du rapport annuel, très détaillée.".encode("utf-8"), "us-ascii") == (
+        "Synthèse du rapport annuel, très détaillée.")
+    assert decode_body("Synthèse".encode("iso-8859-1"), "iso-8859-1") == "Synthèse"
+    assert decode_body("Synthèse".encode("utf-8"), "unknown-charset") == "Synthèse"
+
+
+def test_streamed_and_whole_emails_give_the_same_outputs(tmp_path, stub_servers, run_translator):
+    email_bytes = build_email()
+    outputs = {}
+    for name, options in (("whole", ()), ("streamed", ("--stream-threshold", "0", "--spool-size", "1024",
+                                                       "--spool-dir", tmp_path / "spool"))):
+        server = stub_servers.start()
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "mail.eml").write_bytes(email_bytes)
+        run_translator("-s", server, *options, tmp_path / name)
+        outputs[name] = {path.name: path.read_bytes() for path in (tmp_path / name).iterdir()}
+
+    assert outputs["streamed"] == outputs["whole"]
+    assert "mail.eml-données brutes.bin" in outputs["whole"]
+    # Text attachments are translated as bodies too.
+    assert "[fr->en] Synthèse du rapport annuel." in outputs["whole"]["mail.eml-body-5.html"].decode("utf-8")
+    # The spool directory is created, and spooled parts are removed once the email is translated.
+    assert os.listdir(tmp_path / "spool") == []
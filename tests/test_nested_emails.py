@@ -0,0 +1,75 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from email.message import EmailMessage
+
+from conftest import REPO
+
+
+def write_email(path, text, forwarded_text=None):
+    message = EmailMessage()
+    message["Subject"] = "Réunion"
+    message.set_content(text)
+    if forwarded_text is not None:
+        forwarded = EmailMessage()
+        forwarded["Subject"] = "Ordre du jour"
+        forwarded.set_content(forwarded_text)
+        message.add_attachment(forwarded)
+    path.write_bytes(bytes(message))
+
+
+def nested_outputs(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("mail.eml-") and name.endswith(".eml"))
+
+
+def test_nested_emails_are_not_translated_again(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    write_email(tmp_path / "mail.eml", "Le compte rendu est prêt.\n", "L'ordre du jour est prêt.\n")
+
+    completed = run_translator("-s", server, tmp_path)
+
+    assert "Translating 1 eml files" in completed.stdout
+    [nested] = nested_outputs(tmp_path)
+    assert not os.path.exists(tmp_path / (nested + "-translated-mark.mrk"))
+    # Named like a nested email, but without its email next to it.
+    write_email(tmp_path / "rapport.eml-final.eml", "Le rapport final est prêt.\n")
+
+    completed = run_translator("-s", server, tmp_path)
+
+    # mail.eml, already translated, and rapport.eml-final.eml.
+    assert "Translating 2 eml files" in completed.stdout
+    assert (tmp_path / "rapport.eml-final.eml-translated-mark.mrk").exists()
+    assert nested_outputs(tmp_path) == [nested]
+    assert not os.path.exists(tmp_path / (nested + "-translated-mark.mrk"))
+
+
+def test_watch_skips_nested_emails(tmp_path, stub_servers):
+    server = stub_servers.start()
+    (tmp_path / "mails").mkdir()
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / "cache"))
+    translator = subprocess.Popen([sys.executable, os.path.join(REPO, "eml-translator.py"), "-s", server, "--watch",
+                                   "--watch-mode", "poll", "--watch-interval", "0.05", "--settle", "0.2",
+                                   str(tmp_path / "mails")], stdout=subprocess.PIPE, text=True, env=env)
+    try:
+        lines = []
+        while "Translating 0 eml files\n" not in lines and translator.poll() is None:
+            lines.append(translator.stdout.readline())
+        write_email(tmp_path / "mails" / "mail.eml", "Le compte rendu est prêt.\n", "L'ordre du jour est prêt.\n")
+        write_email(tmp_path / "mails" / "rapport.eml-final.eml", "Le rapport final est prêt.\n")
+        markers = [tmp_path / "mails" / (name + "-translated-mark.mrk")
+                   for name in ("mail.eml", "rapport.eml-final.eml")]
+        deadline = time.time() + 30
+        while not all(marker.exists() for marker in markers) and time.time() < deadline:
+            time.sleep(0.05)
+        # Long enough for the nested email written with its email to settle.
+        time.sleep(0.5)
+    finally:
+        translator.send_signal(signal.SIGTERM)
+        stdout = translator.communicate(timeout=30)[0]
+
+    assert translator.returncode == 0
+    [nested] = nested_outputs(tmp_path / "mails")
+    assert not os.path.exists(tmp_path / "mails" / (nested + "-translated-mark.mrk"))
+    assert "Watch stopped: 2 emails translated" in stdout
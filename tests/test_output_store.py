@@ -0,0 +1,117 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+from email.message import EmailMessage
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import REPO
+from output_store import SUPPORTED, PackedOutputStore
+
+pytestmark = pytest.mark.skipif(not SUPPORTED, reason="The output store needs Python 3.11 and SQLite 3.35")
+
+
+def read_outputs(store, pathStr):
+    outputs = {}
+    for name, size, output_id in store.outputs(pathStr):
+        data = io.BytesIO()
+        store.read(pathStr, output_id, data)
+        assert len(data.getvalue()) == size
+        outputs[name] = data.getvalue()
+    return outputs
+
+
+def test_outputs_are_committed_together(tmp_path):
+    root = tmp_path / "mails"
+    store = PackedOutputStore(str(tmp_path / "store"), str(root), 4)
+    email = str(root / "2024" / "mail.eml")
+    rendered = tmp_path / "document.docx.tmp"
+    rendered.write_bytes(b"PK" * 1000)
+    spooled = tmp_path / "spooled"
+    spooled.write_bytes(b"%PDF" * 1000)
+    assert store.committed(email) is None
+
+    entry = store.begin(email)
+    entry.add(email + "-body-1.html", b"<p>Bonjour</p>")
+    entry.add_file(email + "-document.docx", str(rendered), owned=True)
+    entry.add(email + "-rapport.pdf", SimpleNamespace(size=4000, open=lambda: open(spooled, "rb")))
+    assert entry.source(email + "-document.docx") == str(rendered)
+    entry.commit()
+
+    assert store.committed(email) is not None
+    assert not rendered.exists() and spooled.exists()
+    assert read_outputs(store, os.path.join("2024", "mail.eml")) == {
+        os.path.join("2024", "mail.eml-body-1.html"): b"<p>Bonjour</p>",
+        os.path.join("2024", "mail.eml-document.docx"): b"PK" * 1000,
+        os.path.join("2024", "mail.eml-rapport.pdf"): b"%PDF" * 1000}
+
+    # Translating the email again replaces all of its outputs.
+    entry = store.begin(email)
+    entry.add(email + "-body-1.html", b"<p>Bonjour !</p>")
+    entry.commit()
+    assert read_outputs(store, email) == {os.path.join("2024", "mail.eml-body-1.html"): b"<p>Bonjour !</p>"}
+    store.close()
+    # Closing checkpoints the shards, leaving no -wal or -shm files.
+    assert sorted(os.listdir(tmp_path / "store")) == [
+        "outputs-" + "%03d" % store.shard(os.path.join("2024", "mail.eml")) + ".sqlite", "store.json"]
+
+
+def test_discarded_entries_leave_nothing(tmp_path):
+    store = PackedOutputStore(str(tmp_path / "store"), str(tmp_path), 2)
+    rendered = tmp_path / "document.docx.tmp"
+    rendered.write_bytes(b"PK")
+    entry = store.begin(str(tmp_path / "mail.eml"))
+    entry.add_file(str(tmp_path / "mail.eml-document.docx"), str(rendered), owned=True)
+
+    entry.discard()
+
+    assert not rendered.exists()
+    assert store.committed(str(tmp_path / "mail.eml")) is None
+    assert store.outputs("mail.eml") == []
+
+
+def test_shard_count_is_kept_by_the_store(tmp_path):
+    PackedOutputStore(str(tmp_path / "store"), str(tmp_path), 3).close()
+
+    assert PackedOutputStore(str(tmp_path / "store"), str(tmp_path), 16).shard_count == 3
+
+
+def write_emails(directory):
+    (directory / "2024").mkdir(parents=True)
+    for index in range(3):
+        message = EmailMessage()
+        message["Subject"] = "Numéro " + str(index)
+        message.set_content("Message numéro " + str(index) + ", en français.\n")
+        message.add_alternative("<p>Message numéro " + str(index) + ", en français.</p>", subtype="html")
+        message.add_attachment("Pièce jointe numéro " + str(index) + ".\n", filename="note.txt")
+        (directory / ("2024" if index > 0 else "") / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+
+
+def tree(directory):
+    return {os.path.relpath(os.path.join(parent, name), directory): open(os.path.join(parent, name), "rb").read()
+            for parent, _, names in os.walk(directory) for name in names}
+
+
+def test_exported_outputs_match_a_run_without_store(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    write_emails(tmp_path / "files")
+    shutil.copytree(tmp_path / "files", tmp_path / "packed")
+    run_translator("-s", server, tmp_path / "files")
+
+    run_translator("-s", server, "--output-store", tmp_path / "store", "--output-shards", "2", tmp_path / "packed")
+
+    assert sorted(tree(tmp_path / "packed")) == ["2024/mail-1.eml", "2024/mail-2.eml", "mail-0.eml"]
+    requests = stub_servers.stats(server)["translate_requests"]
+    completed = run_translator("-s", server, "--output-store", tmp_path / "store", tmp_path / "packed")
+    assert stub_servers.stats(server)["translate_requests"] == requests
+    assert "Translating 3 eml files" in completed.stdout
+
+    subprocess.run([sys.executable, os.path.join(REPO, "eml-output-export.py"), str(tmp_path / "store"),
+                    str(tmp_path / "packed")], check=True, capture_output=True, timeout=60)
+
+    exported, files = tree(tmp_path / "packed"), tree(tmp_path / "files")
+    assert exported == files
+    assert "2024/mail-1.eml-translated-mark.mrk" in exported
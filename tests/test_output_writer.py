@@ -0,0 +1,122 @@
+import os
+from email.message import EmailMessage
+from types import SimpleNamespace
+
+import pytest
+
+import output_writer
+from output_writer import OutputWriter
+from run_metrics import Metrics
+
+
+def new_barrier(directory, name, contents, statuses):
+    barrier = SimpleNamespace(pathStr=str(directory / name), outputs=[], discards=[], failed=False,
+                              marker_path=str(directory / (name + "-translated-mark.mrk")),
+                              on_complete=lambda pathStr, status: statuses.append((os.path.basename(pathStr), status)))
+    for suffix, text in contents.items():
+        path = directory / (name + suffix)
+
+        def output(path=path, text=text):
+            # Outputs are always written before the marker.
+            assert not os.path.exists(barrier.marker_path)
+            path.write_text(text, encoding="utf-8")
+        barrier.outputs.append((output, str(path)))
+    return barrier
+
+
+@pytest.mark.parametrize("max_pending", [0, 2])
+def test_outputs_are_written_before_the_marker(tmp_path, max_pending):
+    statuses = []
+    writer = OutputWriter(max_pending, "none", Metrics())
+
+    for index in range(4):
+        writer.submit(new_barrier(tmp_path, "mail-" + str(index) + ".eml", {"-body-1.html": str(index)}, statuses))
+    writer.drain()
+
+    assert statuses == [("mail-" + str(index) + ".eml", "translated") for index in range(4)]
+    for index in range(4):
+        assert (tmp_path / ("mail-" + str(index) + ".eml-body-1.html")).read_text(encoding="utf-8") == str(index)
+        assert os.path.isfile(tmp_path / ("mail-" + str(index) + ".eml-translated-mark.mrk"))
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("none", []),
+    ("email", ["a.html", "b.html", "mails", "mark", "mails"]),
+    ("file", ["a.html", "b.html", "mails", "mark", "mails"]),
+])
+def test_fsync_policies(tmp_path, monkeypatch, policy, expected):
+    synced = []
+    monkeypatch.setattr(output_writer, "fsync_path", lambda path: synced.append(os.path.basename(path)))
+    (tmp_path / "mails").mkdir()
+    barrier = new_barrier(tmp_path / "mails", "mail.eml", {"-a.html": "a", "-b.html": "b"}, [])
+    barrier.marker_path = str(tmp_path / "mails" / "mark")
+
+    OutputWriter(0, policy, Metrics()).submit(barrier)
+
+    assert [name.replace("mail.eml-", "") for name in synced] == expected
+
+
+def test_flushed_as_written(tmp_path, monkeypatch):
+    events = []
+    monkeypatch.setattr(output_writer, "fsync_path", lambda path: events.append("sync " + os.path.basename(path)))
+    barrier = new_barrier(tmp_path, "mail.eml", {}, [])
+    for name in ("a", "b"):
+        barrier.outputs.append((lambda name=name: events.append("write " + name), str(tmp_path / name)))
+
+    OutputWriter(0, "file", Metrics()).submit(barrier)
+
+    assert events[:4] == ["write a", "sync a", "write b", "sync b"]
+
+
+def test_failed_writes_leave_no_marker(tmp_path, capsys):
+    statuses = []
+    barrier = new_barrier(tmp_path, "mail.eml", {"-body-1.html": "1"}, statuses)
+
+    def fail():
+        raise OSError("No space left on device")
+    barrier.outputs.append((fail, None))
+    writer = OutputWriter(2, "none", Metrics())
+    writer.submit(barrier)
+    writer.drain()
+
+    assert statuses == []
+    assert not os.path.exists(barrier.marker_path)
+    assert "Failed to write the outputs of " + str(tmp_path / "mail.eml") + ": No space left on device" in (
+        capsys.readouterr().out)
+
+
+def test_failed_emails_are_discarded(tmp_path):
+    statuses = []
+    barrier = new_barrier(tmp_path, "mail.eml", {"-body-1.html": "1"}, statuses)
+    barrier.failed = True
+    (tmp_path / "mail.eml-document.docx.tmp").write_bytes(b"PK")
+    barrier.discards.append(lambda: os.remove(tmp_path / "mail.eml-document.docx.tmp"))
+    writer = OutputWriter(0, "none", Metrics())
+    writer.submit(barrier)
+
+    assert statuses == [("mail.eml", "failed")]
+    assert os.listdir(tmp_path) == []
+
+
+def test_same_outputs_for_every_policy(tmp_path, stub_servers, run_translator):
+    message = EmailMessage()
+    message["Subject"] = "Numéro"
+    message.set_content("Message en français.\n\nDeuxième paragraphe, en français.\n")
+    message.add_alternative("<p>Message en français.</p><p>Deuxième paragraphe, en français.</p>", subtype="html")
+    message.add_attachment("Pièce jointe en français.\n", filename="note.txt")
+    email_bytes = bytes(message)
+    outputs = {}
+    for options in (("--write-queue", "0"), ("--fsync", "email"), ("--fsync", "file", "--write-queue", "1")):
+        server = stub_servers.start()
+        directory = tmp_path / "-".join(options)
+        directory.mkdir()
+        for index in range(3):
+            (directory / ("mail-" + str(index) + ".eml")).write_bytes(email_bytes)
+        run_translator("-s", server, *options, directory)
+        outputs[options] = {path.name: path.read_bytes() for path in directory.iterdir()}
+
+    first = outputs[("--write-queue", "0")]
+    assert len([name for name in first if name.endswith("-translated-mark.mrk")]) == 3
+    assert [name for name in first if name.endswith(".tmp")] == []
+    for written in outputs.values():
+        assert written == first
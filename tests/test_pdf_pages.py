@@ -0,0 +1,74 @@
+import io
+from email.message import EmailMessage
+
+
+def pdf_bytes(pages):
+    """Build a PDF with one line of text per page.
+
+    Pages for None have no font, like scanned pages, though their content still draws text which PyPDF2 would
+    extract.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + index * 2) for index in range(len(pages))) +
+               b"] /Count %d >>" % len(pages)]
+    font = 3 + len(pages) * 2
+    for index, text in enumerate(pages):
+        resources = b"<< >>" if text is None else b"<< /Font << /F1 %d 0 R >> >>" % font
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R /Resources %s >>" %
+                       (4 + index * 2, resources))
+        # Text in the WinAnsi encoding of the font, in which é is \351.
+        content = b"BT /F1 12 Tf 72 720 Td (" + (text or "Page numérisée").encode("cp1252") + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    pdf = io.BytesIO()
+    pdf.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, pdf_object in enumerate(objects, 1):
+        offsets.append(pdf.tell())
+        pdf.write(b"%d 0 obj\n" % number + pdf_object + b"\nendobj\n")
+    xref = pdf.tell()
+    pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        pdf.write(b"%010d 00000 n \n" % offset)
+    pdf.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return pdf.getvalue()
+
+
+def write_email(directory, pages):
+    directory.mkdir()
+    message = EmailMessage()
+    message["Subject"] = "Rapport"
+    message.set_content("Le rapport est en pièce jointe.\n")
+    message.add_attachment(pdf_bytes(pages), maintype="application", subtype="pdf", filename="rapport.pdf")
+    (directory / "mail.eml").write_bytes(bytes(message))
+
+
+PAGES = ["Page numéro " + str(index) + " du rapport." if index != 7 else None for index in range(24)]
+
+
+def test_parallel_extraction_streams_pages_in_order(tmp_path, stub_servers, run_translator):
+    contents = {}
+    for workers in ("1", "3"):
+        server = stub_servers.start()
+        write_email(tmp_path / workers, PAGES)
+        run_translator("-s", server, "--pdf-workers", workers, tmp_path / workers)
+        contents[workers] = (tmp_path / workers / "mail.eml-rapport.pdf-translated-content.txt").read_text(
+            encoding="utf-8")
+        # The body and every page but the one without a text layer.
+        assert stub_servers.stats(server)["segments"] == 1 + 23
+
+    assert contents["3"] == contents["1"]
+    positions = [contents["1"].index("Page numéro " + str(index) + " du rapport.") for index in range(24) if index != 7]
+    assert positions == sorted(positions)
+
+
+def test_page_limit(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    write_email(tmp_path / "mails", PAGES)
+
+    result = run_translator("-s", server, "--pdf-max-pages", "5", tmp_path / "mails")
+
+    assert "Only translating the first 5 pages of " in result.stdout
+    content = (tmp_path / "mails" / "mail.eml-rapport.pdf-translated-content.txt").read_text(encoding="utf-8")
+    assert "Page numéro 4 du rapport." in content
+    assert "Page numéro 5 du rapport." not in content
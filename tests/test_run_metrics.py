@@ -0,0 +1,97 @@
+import json
+from email.message import EmailMessage
+
+from run_metrics import Metrics
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_nested_stages_are_exclusive(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("run_metrics.time.perf_counter", clock)
+    metrics = Metrics()
+
+    with metrics.timer("pdf"):
+        clock.now += 1.0
+        with metrics.timer("translation"):
+            clock.now += 5.0
+        clock.now += 2.0
+        with metrics.timer("translation"):
+            clock.now += 4.0
+
+    stages = metrics.snapshot({})["stages"]
+    assert stages["pdf"] == {"calls": 1, "seconds": 3.0, "mean": 3.0, "max": 3.0}
+    assert stages["translation"] == {"calls": 2, "seconds": 9.0, "mean": 4.5, "max": 5.0}
+
+
+def test_worker_metrics_are_merged():
+    worker = Metrics()
+    worker.record_time("decode", 0.5)
+    worker.observe("batch_segments", 3)
+    worker.observe("batch_segments", 100)
+    worker.count("segments", 10)
+    worker.count("noop_segments", 4)
+    worker.record_part("text/html", 2000, 0.5)
+    metrics = Metrics()
+    metrics.record_time("decode", 1.5)
+    metrics.count("segments", 10)
+
+    metrics.merge(worker.take())
+
+    assert worker.snapshot({})["stages"] == {}
+    snapshot = metrics.snapshot({"translation_memory.hits": 3, "translation_memory.misses": 1})
+    assert snapshot["stages"]["decode"] == {"calls": 2, "seconds": 2.0, "mean": 1.0, "max": 1.5}
+    assert snapshot["histograms"]["batch_segments"] == {"buckets": {"4": 1, "128": 1}, "count": 2, "sum": 103}
+    assert snapshot["ratios"] == {"cache_hits": 0.75, "noop_segments": 0.2, "duplicate_segments": 0.0}
+    assert snapshot["content_types"]["text/html"] == {"parts": 1, "bytes": 2000, "seconds": 0.5,
+                                                      "bytes_per_second": 4000}
+
+
+def test_prometheus_format():
+    metrics = Metrics()
+    metrics.record_time("translation", 2.5)
+    metrics.observe("batch_characters", 3)
+    metrics.observe("batch_characters", 30)
+    metrics.record_part("application/pdf", 100, 1.0)
+
+    lines = metrics.prometheus({"translation_memory.hits": 2}).splitlines()
+
+    assert 'eml_translator_stage_seconds_total{stage="translation"} 2.5' in lines
+    assert 'eml_translator_stage_calls_total{stage="translation"} 1' in lines
+    assert lines[lines.index("# TYPE eml_translator_batch_characters histogram") + 1:][:5] == [
+        'eml_translator_batch_characters_bucket{le="4"} 1',
+        'eml_translator_batch_characters_bucket{le="32"} 2',
+        'eml_translator_batch_characters_bucket{le="+Inf"} 2',
+        "eml_translator_batch_characters_sum 33",
+        "eml_translator_batch_characters_count 2"]
+    assert "eml_translator_translation_memory_hits_total 2" in lines
+    assert "eml_translator_cache_hits_ratio 1.0" in lines
+    assert 'eml_translator_content_type_bytes_total{content_type="application/pdf"} 100' in lines
+
+
+def test_metrics_file(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    (tmp_path / "mails").mkdir()
+    for index in range(3):
+        message = EmailMessage()
+        message["Subject"] = "Numéro " + str(index)
+        message.set_content("Message numéro " + str(index) + ", en français.\n")
+        message.add_alternative("<p>Message numéro " + str(index) + ", en français.</p>", subtype="html")
+        (tmp_path / "mails" / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+
+    run_translator("-s", server, "--metrics-file", tmp_path / "metrics.json", tmp_path / "mails")
+
+    with open(tmp_path / "metrics.json", encoding="utf-8") as metrics_file:
+        snapshot = json.load(metrics_file)
+    assert {"startup", "read", "decode", "html", "plain_text", "translation", "save_file"} <= set(snapshot["stages"])
+    assert snapshot["counters"]["segments"] == 6
+    assert snapshot["content_types"]["text/html"]["parts"] == 3
+    assert snapshot["content_types"]["text/plain"]["parts"] == 3
+    assert snapshot["histograms"]["batch_segments"]["count"] == snapshot["stages"]["translation"]["calls"]
+    assert [path.name for path in tmp_path.iterdir() if path.name.endswith(".tmp")] == []
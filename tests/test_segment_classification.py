@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+import segment_classification
+
+
+# Original implementations, kept as the reference.
+def legacy_string_has_text(string):
+    for char in string:
+        if ord(char)>=65 and ord(char)<=90:
+            return True
+        if ord(char)>=97 and ord(char)<=122:
+            return True
+        if ord(char)>0xC0:
+            return True
+
+
+def legacy_is_english_charpoint(string):
+    for char in string:
+        if not (0 < ord(char) <= 127):
+            return False
+    return True
+
+
+def legacy_is_noop_text(text):
+    return len(text)==0 or not legacy_string_has_text(text) or legacy_is_english_charpoint(text)
+
+
+# Code points around every boundary of the classification rules.
+EDGE_CHARACTERS = ["\x00", "\x01", " ", "0", "@", "A", "Z", "[", "`", "a", "z", "{", "\x7f", "\x80", "\xa0",
+                   "\xbf", "\xc0", "\xc1", "\xe9", "—", "’", "€", "中", "\ud800", "\U0001f600"]
+
+
+def random_segment(rng):
+    length = rng.choice([0, 1, 2, 3, 8, 40])
+    characters = []
+    for _ in range(length):
+        if rng.random() < 0.7:
+            characters.append(rng.choice(EDGE_CHARACTERS))
+        else:
+            characters.append(chr(rng.randrange(0, 0x110000)))
+    return "".join(characters)
+
+
+def segments():
+    rng = random.Random(1234)
+    return ([random_segment(rng) for _ in range(20000)] + EDGE_CHARACTERS +
+            ["".join(pair) for pair in zip(EDGE_CHARACTERS, reversed(EDGE_CHARACTERS))])
+
+
+@pytest.mark.parametrize("function, legacy", [
+    (segment_classification.string_has_text, lambda segment: bool(legacy_string_has_text(segment))),
+    (segment_classification.is_english_charpoint, legacy_is_english_charpoint),
+    (segment_classification.is_noop_text, legacy_is_noop_text),
+])
+def test_matches_legacy_classification(function, legacy):
+    mismatches = [segment for segment in segments() if function(segment) != legacy(segment)]
+    assert mismatches == []
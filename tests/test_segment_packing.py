@@ -0,0 +1,36 @@
+from email.message import EmailMessage
+
+
+def build_emails():
+    emails = {}
+    for index in range(4):
+        message = EmailMessage()
+        message["Subject"] = "Numéro " + str(index)
+        message.set_content("Message numéro " + str(index) + ", en français.\n\nCordialement, l'équipe.\n")
+        message.add_alternative("<p>Message numéro " + str(index) + ", en français.</p><p>Cordialement, l'équipe.</p>",
+                                subtype="html")
+        message.add_attachment("Pièce jointe numéro " + str(index) + ".\n", filename="note.txt")
+        emails["mail-" + str(index) + ".eml"] = bytes(message)
+    return emails
+
+
+def test_packed_batches_give_the_same_outputs_in_fewer_requests(tmp_path, stub_servers, run_translator):
+    emails = build_emails()
+    outputs = {}
+    stats = {}
+    for pack_emails in ("0", "1", "4"):
+        server = stub_servers.start()
+        (tmp_path / pack_emails).mkdir()
+        for name, email_bytes in emails.items():
+            (tmp_path / pack_emails / name).write_bytes(email_bytes)
+        run_translator("-s", server, "--pack-emails", pack_emails, tmp_path / pack_emails)
+        outputs[pack_emails] = {path.name: path.read_bytes() for path in (tmp_path / pack_emails).iterdir()}
+        stats[pack_emails] = stub_servers.stats(server)
+
+    assert outputs["1"] == outputs["0"]
+    assert outputs["4"] == outputs["0"]
+    # One batch per part, per email, then for the four emails together.
+    assert stats["0"]["translate_requests"] > stats["1"]["translate_requests"] == 4
+    assert stats["4"]["translate_requests"] == 1
+    # The signature shared by every email is only sent once in a packed batch.
+    assert stats["4"]["segments"] == stats["1"]["segments"] - 3
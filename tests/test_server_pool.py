@@ -0,0 +1,152 @@
+import re
+import socket
+from email.message import EmailMessage
+
+import pytest
+
+from server_pool import ServerPool, ServerUnavailable, parse_server
+
+
+def new_pool(*weights, **options):
+    return ServerPool([("http://server" + str(index) + ":5000/", weight) for index, weight in enumerate(weights)],
+                      1, 10.0, **options)
+
+
+def chosen_indexes(pool, count, complete=True):
+    indexes = []
+    for _ in range(count):
+        endpoint = pool.choose()
+        indexes.append(pool.endpoints.index(endpoint))
+        if complete:
+            pool.succeeded(endpoint, 0, 0.0)
+    return indexes
+
+
+def test_batches_in_flight_follow_the_weights():
+    pool = new_pool(3, 1)
+
+    indexes = chosen_indexes(pool, 8, complete=False)
+
+    assert (indexes.count(0), indexes.count(1)) == (6, 2)
+
+
+def test_servers_as_loaded_take_turns():
+    assert chosen_indexes(new_pool(1, 1, 1), 6) == [0, 1, 2, 0, 1, 2]
+    # When every batch is answered before the next one is sent, the heaviest server gets them all.
+    assert chosen_indexes(new_pool(1, 4), 4) == [1, 1, 1, 1]
+
+
+def test_faster_servers_are_chosen_between_servers_as_loaded():
+    pool = new_pool(1, 1, 1)
+    for endpoint, latency in zip(pool.endpoints, (0.002, 0.001, 0.003)):
+        endpoint.seconds_per_character = latency
+
+    assert chosen_indexes(pool, 3) == [1, 1, 1]
+    assert chosen_indexes(pool, 4, complete=False) == [1, 0, 2, 1]
+    # Servers not tried yet come first.
+    pool = new_pool(1, 1)
+    pool.endpoints[0].seconds_per_character = 0.001
+    assert chosen_indexes(pool, 1) == [1]
+
+
+def test_circuit_opens_after_failures_and_closes_when_the_server_answers(monkeypatch):
+    pool = new_pool(1, 1, base_cooldown=0.0)
+    failing, healthy = pool.endpoints
+    for _ in range(3):
+        pool.failed(failing, ConnectionRefusedError("Connection refused"))
+    assert failing.open_until is not None and failing.circuit_opens == 1
+
+    monkeypatch.setattr(failing.api, "languages", lambda timeout: [])
+    pool.check(failing)
+
+    assert failing.open_until is None
+    # Half open: the next failure opens the circuit again.
+    pool.failed(failing, ConnectionRefusedError("Connection refused"))
+    assert failing.circuit_opens == 2
+    for _ in range(3):
+        pool.failed(healthy, ConnectionRefusedError("Connection refused"))
+    with pytest.raises(ServerUnavailable):
+        pool.translate(["Texte"], "fr", "en")
+
+
+def test_servers_not_answering_at_startup_get_no_batches(monkeypatch, capsys):
+    pool = new_pool(1, 1)
+    down, up = pool.endpoints
+
+    def refuse(timeout):
+        raise ConnectionRefusedError("Connection refused")
+    monkeypatch.setattr(down.api, "languages", refuse)
+    monkeypatch.setattr(up.api, "languages", lambda timeout: [{"code": "fr", "name": "French"}])
+
+    assert pool.languages() == [{"code": "fr", "name": "French"}]
+    assert down.open_until is not None and up.open_until is None
+    assert chosen_indexes(pool, 3) == [1, 1, 1]
+    assert "Translation server http://server0:5000/ is not answering: Connection refused" in capsys.readouterr().out
+
+
+def test_parse_server():
+    assert parse_server("http://big:5000,4") == ("http://big:5000", 4.0)
+    assert parse_server("http://big:5000") == ("http://big:5000", 1.0)
+    with pytest.raises(ValueError):
+        parse_server("http://big:5000,0")
+
+
+def write_emails(directory, count):
+    directory.mkdir()
+    for index in range(count):
+        message = EmailMessage()
+        message["Subject"] = "Numéro " + str(index)
+        message.set_content("Message numéro " + str(index) + ", en français.\n")
+        (directory / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+
+
+def server_reports(stdout):
+    """Return the requests and characters reported for each server at the end of a run."""
+    return {url: (int(requests), int(characters)) for url, requests, characters in
+            re.findall(r"^Server (\S+) \(weight \S+\): (\d+) requests, (\d+) characters", stdout, re.MULTILINE)}
+
+
+def test_batches_are_shared_by_weight(tmp_path, stub_servers, run_translator):
+    big = stub_servers.start("--latency", "0.05")
+    small = stub_servers.start("--latency", "0.05")
+    write_emails(tmp_path / "mails", 40)
+
+    completed = run_translator("-s", big + ",3", "-s", small + ",1", "--inflight", "4", "--pack-emails", "1",
+                               tmp_path / "mails")
+
+    big_stats, small_stats = stub_servers.stats(big), stub_servers.stats(small)
+    assert big_stats["translate_requests"] + small_stats["translate_requests"] == 40
+    assert big_stats["translate_requests"] >= 2 * small_stats["translate_requests"] > 0
+    # Per server throughput, as the servers counted it.
+    assert server_reports(completed.stdout) == {
+        big: (big_stats["translate_requests"], big_stats["characters"]),
+        small: (small_stats["translate_requests"], small_stats["characters"])}
+
+
+def test_failing_servers_are_left_out(tmp_path, stub_servers, run_translator):
+    up = stub_servers.start()
+    failing = stub_servers.start("--failure-rate", "1")
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        down = "http://127.0.0.1:" + str(unused.getsockname()[1]) + "/"
+    write_emails(tmp_path / "mails", 12)
+
+    completed = run_translator("-s", down, "-s", failing, "-s", up, "--pack-emails", "1", tmp_path / "mails")
+
+    assert "Translation server " + down + " is not answering" in completed.stdout
+    assert "Translation server " + failing + " keeps failing" in completed.stdout
+    reports = server_reports(completed.stdout)
+    assert reports[down] == (0, 0)
+    assert stub_servers.stats(failing)["translate_requests"] == 3
+    assert stub_servers.stats(up)["translate_requests"] == 12
+    assert re.search(re.escape(failing) + r" .*circuit opened 1 times", completed.stdout)
+    for index in range(12):
+        assert (tmp_path / "mails" / ("mail-" + str(index) + ".eml-translated-mark.mrk")).exists()
+
+    # With the languages cached, the servers are checked in the background.
+    write_emails(tmp_path / "more", 4)
+    completed = run_translator("-s", down, "-s", failing, "-s", up, "--pack-emails", "1", tmp_path / "more")
+
+    assert "Translation server " + down + " is not answering" in completed.stdout
+    for index in range(4):
+        assert (tmp_path / "more" / ("mail-" + str(index) + ".eml-translated-mark.mrk")).exists()
@@ -0,0 +1,149 @@
+import json
+import re
+from email.message import EmailMessage
+from types import SimpleNamespace
+
+from run_metrics import Metrics
+from spam_triage import SpamTriage
+
+
+class FakeBarrier:
+    def __init__(self):
+        self.pending_batches = 0
+        self.closed = False
+        self.finalized = False
+        self.outputs = []
+
+    def defer(self, output, file_path=None):
+        self.outputs.append(output)
+
+    def close(self):
+        self.closed = True
+        if self.pending_batches == 0:
+            self.finalize()
+
+    def finalize(self):
+        for output in self.outputs:
+            output()
+        self.finalized = True
+
+
+class FakeClient:
+    """Chat completion client answering like libretranslate-stub.py, or with wrong answers for packed emails."""
+
+    def __init__(self, answer_packed=True):
+        self.answer_packed = answer_packed
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature):
+        emails = re.split(r"^Email \d+:\n", messages[-1]["content"], flags=re.MULTILINE)[1:]
+        self.requests.append([email.strip() for email in emails])
+        answer = [{"email": index + 1, "spam": "lottery" in email, "summary": email.strip()[:20]}
+                  for index, email in enumerate(emails)]
+        if len(emails) > 1 and not self.answer_packed:
+            answer = answer[:1]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(answer)))])
+
+
+def new_triage(client, saved, max_emails=2, max_tokens=512, cache_path=None):
+    return SpamTriage(client, "model", 2, max_emails, max_tokens, cache_path, Metrics(),
+                      lambda file_path, data: saved.__setitem__(file_path, json.loads(data)), lambda message: None)
+
+
+def triage(spam_triage, texts):
+    barriers = {}
+    for index, text in enumerate(texts):
+        barrier = barriers["mail-" + str(index) + ".eml"] = FakeBarrier()
+        spam_triage.submit("mail-" + str(index) + ".eml", text, barrier)
+        barrier.close()
+    spam_triage.drain()
+    return barriers
+
+
+def test_emails_are_packed_in_requests():
+    client = FakeClient()
+    saved = {}
+    spam_triage = new_triage(client, saved)
+
+    barriers = triage(spam_triage, ["Réunion lundi.", "You won the lottery!", "Compte rendu."])
+
+    assert sorted(client.requests) == [["Compte rendu."], ["Réunion lundi.", "You won the lottery!"]]
+    assert all(barrier.finalized for barrier in barriers.values())
+    assert saved["mail-1.eml-triage.json"] == {"spam": True, "summary": "You won the lottery!", "model": "model",
+                                               "truncated": False}
+    assert saved["mail-0.eml-triage.json"]["spam"] is False
+    assert spam_triage.report() == ("Spam triage: 3 emails, 1 spam, 2 requests, 0 cache hits, "
+                                    "0 without verdict.")
+
+
+def test_emails_are_asked_for_one_by_one_when_packed_answers_are_wrong():
+    client = FakeClient(answer_packed=False)
+    saved = {}
+    spam_triage = new_triage(client, saved)
+
+    triage(spam_triage, ["Réunion lundi.", "You won the lottery!"])
+
+    assert client.requests == [["Réunion lundi.", "You won the lottery!"], ["Réunion lundi."],
+                               ["You won the lottery!"]]
+    assert [saved[name]["spam"] for name in ("mail-0.eml-triage.json", "mail-1.eml-triage.json")] == [False, True]
+    assert spam_triage.requests == 3
+
+
+def test_unanswered_emails_are_saved_without_verdict():
+    def fail(**kwargs):
+        raise ConnectionError("Connection refused")
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fail)))
+    saved = {}
+    spam_triage = new_triage(client, saved)
+
+    barriers = triage(spam_triage, ["Réunion lundi."])
+
+    assert barriers["mail-0.eml"].finalized
+    assert saved["mail-0.eml-triage.json"] == {"spam": None, "summary": None, "model": "model", "truncated": False}
+    assert spam_triage.failures == 1
+
+
+def test_verdicts_are_cached_by_content(tmp_path):
+    cache_path = str(tmp_path / "triage.db")
+    triage(new_triage(FakeClient(), {}, cache_path=cache_path), ["Réunion lundi.", "You won the lottery!"])
+    client = FakeClient()
+    saved = {}
+    spam_triage = new_triage(client, saved, cache_path=cache_path)
+
+    triage(spam_triage, ["You won the lottery!", "Réunion mardi."])
+
+    assert client.requests == [["Réunion mardi."]]
+    assert saved["mail-0.eml-triage.json"]["spam"] is True
+    assert spam_triage.cache_hits == 1
+
+
+def test_long_emails_are_truncated():
+    client = FakeClient()
+    saved = {}
+
+    triage(new_triage(client, saved, max_tokens=2), ["Réunion lundi matin."])
+
+    assert client.requests == [["Réunion"]]
+    assert saved["mail-0.eml-triage.json"]["truncated"] is True
+
+
+def test_triage_files_are_written_with_the_outputs(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    for index, text in enumerate(["Le compte rendu de la réunion est prêt.\n",
+                                  "Vous êtes le winner de notre loterie, réclamez vos bitcoin.\n",
+                                  "Merci pour votre réponse rapide.\n"]):
+        message = EmailMessage()
+        message["Subject"] = "Numéro " + str(index)
+        message.set_content(text)
+        (tmp_path / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+
+    completed = run_translator("-s", server, "-a", server, "--ai-batch-emails", "2", tmp_path)
+
+    verdicts = [json.loads((tmp_path / ("mail-" + str(index) + ".eml-triage.json")).read_text(encoding="utf-8"))
+                for index in range(3)]
+    assert [verdict["spam"] for verdict in verdicts] == [False, True, False]
+    assert verdicts[0]["summary"] == "Subject: Numéro 0 Le compte rendu de la réunion est prêt."
+    stats = stub_servers.stats(server)
+    assert (stats["chat_requests"], stats["chat_emails"]) == (2, 3)
+    assert "Spam triage: 3 emails, 1 spam, 2 requests, 0 cache hits, 0 without verdict." in completed.stdout
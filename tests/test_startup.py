@@ -0,0 +1,64 @@
+import os
+from email.message import EmailMessage
+
+HEAVY_MODULES = ("bs4", "PyPDF2", "openai", "docx_streaming", "html_segmentation")
+
+
+def write_email(directory):
+    directory.mkdir(exist_ok=True)
+    message = EmailMessage()
+    message["Subject"] = "Réunion"
+    message.set_content("Le compte rendu de la réunion est prêt.\n")
+    (directory / "mail.eml").write_bytes(bytes(message))
+
+
+def imported_modules(stderr):
+    """Return the top level modules listed by python -X importtime."""
+    return {line.split("|")[-1].strip().split(".")[0] for line in stderr.splitlines()
+            if line.startswith("import time:")}
+
+
+def test_languages_are_read_from_the_cache(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    cache = tmp_path / "cache"
+    for index in range(2):
+        write_email(tmp_path / ("mails-" + str(index)))
+        run_translator("-s", server, "--metadata-cache", cache, tmp_path / ("mails-" + str(index)))
+    assert stub_servers.stats(server)["languages_requests"] == 1
+    assert [name for name in os.listdir(cache) if name.startswith("languages-")] != []
+
+    write_email(tmp_path / "mails-2")
+    run_translator("-s", server, "--metadata-cache", cache, "--languages-ttl", "0", tmp_path / "mails-2")
+
+    assert stub_servers.stats(server)["languages_requests"] == 2
+    assert (tmp_path / "mails-1" / "mail.eml-body-1.html").exists()
+
+
+def test_expired_languages_are_requested_again(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    cache = tmp_path / "cache"
+    write_email(tmp_path / "mails-0")
+    run_translator("-s", server, "--metadata-cache", cache, tmp_path / "mails-0")
+    for name in os.listdir(cache):
+        os.utime(cache / name, (0, 0))
+
+    write_email(tmp_path / "mails-1")
+    run_translator("-s", server, "--metadata-cache", cache, tmp_path / "mails-1")
+
+    assert stub_servers.stats(server)["languages_requests"] == 2
+
+
+def test_heavy_modules_are_imported_only_when_needed(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    write_email(tmp_path / "whole")
+    write_email(tmp_path / "streamed")
+
+    whole = run_translator("-s", server, tmp_path / "whole", env={"PYTHONPROFILEIMPORTTIME": "1"})
+    streamed = run_translator("-s", server, "--stream-threshold", "0", tmp_path / "streamed",
+                              env={"PYTHONPROFILEIMPORTTIME": "1"})
+
+    assert set(HEAVY_MODULES).isdisjoint(imported_modules(whole.stderr))
+    assert "eml_parser" in imported_modules(whole.stderr)
+    assert set(HEAVY_MODULES + ("eml_parser",)).isdisjoint(imported_modules(streamed.stderr))
+    assert (tmp_path / "streamed" / "mail.eml-body-1.html").read_bytes() == (
+        tmp_path / "whole" / "mail.eml-body-1.html").read_bytes()
@@ -0,0 +1,102 @@
+from email.message import EmailMessage
+
+from text_segmentation import join_pieces, split_paragraph, text_blocks, wrap_like
+
+WRAPPED = ("Bonjour,\n"
+           "\n"
+           "Le compte rendu de la réunion de lundi est prêt, vous le trouverez\n"
+           "en pièce jointe avec les chiffres du trimestre et les décisions\n"
+           "prises.\n"
+           "- Première étape\n"
+           "- Deuxième étape\n"
+           "\n"
+           "> Pouvez-vous m'envoyer le compte rendu de la réunion de lundi dès\n"
+           "> qu'il sera prêt ?\n"
+           ">> Message plus ancien.\n"
+           "-- \n"
+           "Jean Dupont\n"
+           "Service comptable\n")
+
+
+def blocks_of(text):
+    return [(block.kind, block.prefix, block.text) for block in text_blocks(text.splitlines(keepends=True))]
+
+
+def test_wrapped_lines_are_merged_into_paragraphs():
+    assert blocks_of(WRAPPED) == [
+        ("paragraph", "", "Bonjour,"),
+        ("paragraph", "", "Le compte rendu de la réunion de lundi est prêt, vous le trouverez en pièce jointe avec "
+                          "les chiffres du trimestre et les décisions prises."),
+        ("paragraph", "", "- Première étape"),
+        ("paragraph", "", "- Deuxième étape"),
+        ("quote", "> ", "Pouvez-vous m'envoyer le compte rendu de la réunion de lundi dès qu'il sera prêt ?"),
+        ("quote", ">> ", "Message plus ancien."),
+        ("signature", "", "Jean Dupont"),
+        ("signature", "", "Service comptable")]
+
+
+def test_short_lines_are_not_merged():
+    text = "Merci pour votre réponse.\nÀ demain.\nLe compte rendu suit.\n"
+
+    assert [text for kind, prefix, text in blocks_of(text)] == ["Merci pour votre réponse.", "À demain.",
+                                                                 "Le compte rendu suit."]
+
+
+def test_flowed_lines_are_merged():
+    text = "Merci pour \r\nvotre réponse.\r\n-----Original Message-----\r\nÀ demain.\r\n"
+
+    assert blocks_of(text) == [("paragraph", "", "Merci pour votre réponse."), ("paragraph", "", "À demain.")]
+
+
+def test_long_paragraphs_are_split_at_sentences():
+    text = "Première phrase assez longue. Deuxième phrase, encore plus longue ! Troisième phrase.  Fin."
+
+    pieces = split_paragraph(text, 40)
+
+    assert pieces == ["Première phrase assez longue. ", "Deuxième phrase, encore plus longue ! ",
+                      "Troisième phrase.  Fin."]
+    assert "".join(pieces) == text
+    assert join_pieces(pieces, ["First sentence. ", "Second sentence!", "Third sentence. End."]) == (
+        "First sentence. Second sentence! Third sentence. End.")
+
+
+def test_sentences_longer_than_the_limit_are_split_at_words():
+    text = "Un mot " * 10 + "anticonstitutionnellement"
+
+    pieces = split_paragraph(text, 20)
+
+    assert "".join(pieces) == text
+    assert all(len(piece) <= 20 for piece in pieces)
+    assert pieces[0] == "Un mot Un mot Un "
+    assert split_paragraph("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
+    assert split_paragraph("Court.", 10) == ["Court."]
+
+
+def test_translations_are_wrapped_like_their_block():
+    lines = WRAPPED.splitlines(keepends=True)
+    paragraph, quote = text_blocks(lines)[1], text_blocks(lines)[4]
+
+    assert [len(line) for line in wrap_like(paragraph, "word " * 30)] == [64, 64, 19]
+    assert wrap_like(quote, "The report.") == ["> The report."]
+    # Single lines are not wrapped.
+    assert wrap_like(text_blocks(lines)[0], "Hello, " * 20) == ["Hello, " * 20]
+
+
+def test_plain_text_is_translated_by_paragraph(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    message = EmailMessage()
+    message["Subject"] = "Compte rendu"
+    message.set_content(WRAPPED)
+    (tmp_path / "mail.eml").write_bytes(bytes(message))
+
+    run_translator("-s", server, tmp_path)
+
+    translated = (tmp_path / "mail.eml-body-1.html").read_text(encoding="utf-8")
+    assert ("prises. --- \n[AUTO_TRANSLATED] FROM fr: [fr->en] Le compte rendu de la réunion\nde lundi est prêt, "
+            "vous le trouverez en pièce jointe avec les\nchiffres du trimestre et les décisions prises.\n"
+            "- Première étape --- \n[AUTO_TRANSLATED] FROM fr: [fr->en] - Première étape\n") in translated
+    assert ("> qu'il sera prêt ? --- \n> [AUTO_TRANSLATED] FROM fr: [fr->en] Pouvez-vous m'envoyer le\n"
+            "> compte rendu de la réunion de lundi dès qu'il sera prêt ?\n>> Message plus ancien.\n") in translated
+    assert translated.endswith("-- \nJean Dupont\nService comptable\n")
+    # Segments without accents are English or names, and are not sent.
+    assert stub_servers.stats(server)["segments"] == 4
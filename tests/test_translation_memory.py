@@ -0,0 +1,51 @@
+from email.message import EmailMessage
+
+from translation_memory import TranslationMemory
+
+
+def test_whitespace_is_normalized_and_languages_are_part_of_the_key(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.db"), 100)
+    memory.store([("Bonjour à tous.", "Hello everyone.", "fr")], "auto", "en")
+
+    assert memory.lookup(["Bonjour  à\ntous.", "Bonjour à tous."], "auto", "en") == [("Hello everyone.", "fr")] * 2
+    assert memory.lookup(["Bonjour à tous."], "fr", "en") == [None]
+    assert memory.lookup(["Bonjour à tous."], "auto", "de") == [None]
+    assert (memory.hits, memory.misses) == (2, 2)
+
+
+def test_least_recently_used_segments_are_evicted(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.db"), 20)
+    memory.store([("Phrase numéro " + str(index), "Sentence " + str(index), "fr") for index in range(20)], "auto", "en")
+    # Using the first segment makes it the most recently used one.
+    memory.lookup(["Phrase numéro 0"], "auto", "en")
+    memory.store([("Phrase numéro 20", "Sentence 20", "fr")], "auto", "en")
+
+    # 21 segments for 20 places: 2 evicted, as eviction makes room for a twentieth of the memory at once.
+    assert memory.evictions == 2
+    assert memory.row_count == 19
+    assert memory.lookup(["Phrase numéro 0", "Phrase numéro 1", "Phrase numéro 2", "Phrase numéro 3"],
+                         "auto", "en") == [("Sentence 0", "fr"), None, None, ("Sentence 3", "fr")]
+
+    reopened = TranslationMemory(str(tmp_path / "memory.db"), 20)
+    assert reopened.lookup(["Phrase numéro 20"], "auto", "en") == [("Sentence 20", "fr")]
+    assert reopened.row_count == 19
+
+
+def test_second_run_sends_no_segment(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    message = EmailMessage()
+    message["Subject"] = "Compte rendu"
+    message.set_content("Voici le compte rendu de la réunion.\n\nMerci de le relire avant vendredi.\n")
+    for run in ("first", "second"):
+        (tmp_path / run).mkdir()
+        (tmp_path / run / "mail.eml").write_bytes(bytes(message))
+
+    run_translator("-s", server, "-c", tmp_path / "memory.db", tmp_path / "first")
+    sent = stub_servers.stats(server)["segments"]
+    result = run_translator("-s", server, "-c", tmp_path / "memory.db", tmp_path / "second")
+
+    assert sent > 0
+    assert stub_servers.stats(server)["segments"] == sent
+    assert (tmp_path / "second" / "mail.eml-body-1.html").read_text(encoding="utf-8") == \
+        (tmp_path / "first" / "mail.eml-body-1.html").read_text(encoding="utf-8")
+    assert str(sent) + " hits, 0 misses" in result.stdout
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+from email.message import EmailMessage
+
+from conftest import REPO
+
+
+def write_archive(root):
+    (root / "2024").mkdir(parents=True)
+    for index in range(3):
+        message = EmailMessage()
+        message["Subject"] = "Réunion"
+        message.set_content("Le compte rendu de la réunion est prêt.\n")
+        message.add_alternative("<p>Le compte rendu de la <b>réunion</b> est prêt.</p>", subtype="html")
+        if index == 2:
+            message.add_attachment(b"%PDF-1.4 " * 100, maintype="application", subtype="pdf", filename="cr.pdf")
+        (root / ("2024" if index > 0 else "") / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+    (root / "notes.txt").write_text("Not an email.", encoding="utf-8")
+
+
+def count_types(*arguments, cwd):
+    completed = subprocess.run([sys.executable, os.path.join(REPO, "eml-types-count.py"), *map(str, arguments)],
+                               capture_output=True, text=True, timeout=120, cwd=cwd, check=True)
+    return completed.stdout
+
+
+def test_report_is_written_to_results_txt(tmp_path):
+    write_archive(tmp_path / "archive")
+
+    stdout = count_types("-w", "2", tmp_path / "archive", cwd=tmp_path)
+
+    assert (tmp_path / "results.txt").read_text(encoding="utf-8") == (
+        "text/plain: 3\ntext/html: 3\napplication/pdf: 1\n")
+    assert stdout.endswith("text/plain: 3\ntext/html: 3\napplication/pdf: 1\n")
+    assert "Scanning 3 eml files" in stdout
+
+
+def test_scan_measures_the_parts(tmp_path):
+    write_archive(tmp_path / "archive")
+
+    count_types("--scan", "--chars-per-second", "10", "-o", tmp_path / "scan.txt", "--json", tmp_path / "counts.json",
+                tmp_path / "archive", cwd=tmp_path)
+
+    assert not (tmp_path / "results.txt").exists()
+    report = (tmp_path / "scan.txt").read_text(encoding="utf-8").splitlines()
+    assert report[:4] == ["text/plain: 3", "    126 B in total, 42 B on average", "    sizes: <= 64 B: 3",
+                          "    about 117 characters to translate"]
+    assert "Nesting depth: 1: 2, 2: 1" in report
+    assert report[-1] == ("About 234 characters to translate in text bodies, 0.0 hours at 10 characters per "
+                          "second.  PDF and docx attachments come on top.")
+    with open(tmp_path / "counts.json", encoding="utf-8") as counts_file:
+        counts = json.load(counts_file)
+    assert counts["emails"] == 3 and counts["failed"] == []
+    assert {content_type: entry["count"] for content_type, entry in counts["types"].items()} == {
+        "text/plain": 3, "text/html": 3, "application/pdf": 1}
+    # Estimated from the size of the base64 text, line breaks included.
+    assert 900 <= counts["types"]["application/pdf"]["bytes"] < 950
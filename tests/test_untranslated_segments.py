@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from email.message import EmailMessage
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def rejecting_server(stub_servers):
+    """LibreTranslate stub failing on the segments which contain POISON."""
+    return stub_servers.start("--reject", "POISON")
+
+
+def translate(directory, server, *options):
+    subprocess.run([sys.executable, os.path.join(REPO, "eml-translator.py"), "-s", server, *options, str(directory)],
+                   check=True, capture_output=True, timeout=120)
+    with open(os.path.join(directory, "mail.eml-body-1.html"), encoding="utf-8") as body_file:
+        return body_file.read()
+
+
+@pytest.mark.parametrize("options", [["-l", "fr"], []])
+def test_rejected_segment_is_not_annotated(tmp_path, rejecting_server, options):
+    message = EmailMessage()
+    message["Subject"] = "Bonjour"
+    message.set_content("Le premier paragraphe est en français.\n\nDeuxième POISON paragraphe.\n\n"
+                        "Troisième paragraphe ici.\n")
+    (tmp_path / "mail.eml").write_bytes(bytes(message))
+
+    body = translate(tmp_path, rejecting_server, *options)
+
+    assert "Deuxième POISON paragraphe." in body
+    assert "POISON paragraphe. --- " not in body
+    assert body.count("[AUTO_TRANSLATED]") == 2
+    for line in body.splitlines():
+        if "[AUTO_TRANSLATED]" in line:
+            assert "POISON" not in line
+            assert "FROM auto" not in line
+    assert os.path.isfile(tmp_path / "mail.eml-translated-mark.mrk")
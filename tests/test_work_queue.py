@@ -0,0 +1,123 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from email.message import EmailMessage
+
+from work_queue import WorkQueue
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_email(path, text):
+    message = EmailMessage()
+    message["Subject"] = "Réunion"
+    message.set_content(text)
+    path.write_bytes(bytes(message))
+
+
+def statuses(queue_path):
+    with sqlite3.connect(queue_path) as db:
+        return dict(db.execute("SELECT path, COALESCE(status, state) FROM work"))
+
+
+def wait_for_claim(queue_path):
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if "claimed" in statuses(queue_path).values():
+                return
+        except sqlite3.OperationalError:
+            # The replica did not create the queue yet.
+            pass
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_emails_are_claimed_largest_first_and_queued_again_when_they_change(tmp_path):
+    paths = []
+    for index, size in enumerate((10, 30, 20)):
+        path = tmp_path / ("mail-" + str(index) + ".eml")
+        path.write_bytes(b"x" * size)
+        paths.append(str(path))
+    queue = WorkQueue(str(tmp_path / "queue.db"), 60, 1)
+
+    queue.add(paths)
+    assert [queue.claim() for _ in range(4)] == [[paths[1]], [paths[2]], [paths[0]], []]
+    for path in paths:
+        queue.done(path, "translated")
+    queue.add(paths)
+    assert queue.claim() == []
+
+    # A different size, or the same size with a new modification time.
+    (tmp_path / "mail-0.eml").write_bytes(b"y" * 15)
+    os.utime(paths[2], (time.time() + 10, time.time() + 10))
+    queue.add(paths)
+    assert queue.claim() == [paths[2]]
+    # Claimed emails are left to their replica.
+    (tmp_path / "mail-2.eml").write_bytes(b"z" * 12)
+    queue.add(paths)
+    assert queue.claim() == [paths[0]]
+    assert queue.claim() == []
+    assert statuses(tmp_path / "queue.db") == {paths[0]: "claimed", paths[1]: "translated", paths[2]: "claimed"}
+
+
+def test_expired_leases_are_claimed_by_other_replicas(tmp_path):
+    path = tmp_path / "mail.eml"
+    path.write_bytes(b"x")
+    dead = WorkQueue(str(tmp_path / "queue.db"), 0.2, 1)
+    dead.add([str(path)])
+    assert dead.claim() == [str(path)]
+    replica = WorkQueue(str(tmp_path / "queue.db"), 0.2, 1)
+    assert replica.claim() == []
+    assert replica.claimed_by_others() == 1
+
+    time.sleep(0.3)
+    assert replica.claim() == [str(path)]
+    replica.done(str(path), "translated")
+    # The dead replica lost its claim.
+    dead.done(str(path), "skipped")
+    assert statuses(tmp_path / "queue.db") == {str(path): "translated"}
+
+
+def test_replicas_translate_each_email_once(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start("--latency", "0.02")
+    for index in range(10):
+        write_email(tmp_path / ("mail-" + str(index) + ".eml"), "Message numéro " + str(index) + ", en français.\n")
+    command = [sys.executable, os.path.join(REPO, "eml-translator.py"), "-s", server, "-q", str(tmp_path / "queue.db"),
+               "--claim-bytes", "1", str(tmp_path)]
+    replicas = [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(2)]
+    for replica in replicas:
+        assert replica.wait(timeout=120) == 0
+
+    queued = statuses(tmp_path / "queue.db")
+    assert sorted(queued) == sorted(str(tmp_path / ("mail-" + str(index) + ".eml")) for index in range(10))
+    # An email translated by both replicas would have been skipped by the second one.
+    assert set(queued.values()) == {"translated"}
+
+    sent = stub_servers.stats(server)["segments"]
+    write_email(tmp_path / "mail-3.eml", "Message numéro 3, modifié depuis.\n")
+    run_translator("-s", server, "-q", tmp_path / "queue.db", tmp_path)
+    assert "modifié" in (tmp_path / "mail-3.eml-body-1.html").read_text(encoding="utf-8")
+    # Only the modified email was translated again.
+    assert stub_servers.stats(server)["segments"] - sent == 1
+
+
+def test_emails_of_a_dead_replica_are_taken_over(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start("--latency", "1")
+    for index in range(3):
+        write_email(tmp_path / ("mail-" + str(index) + ".eml"), "Message numéro " + str(index) + ", en français.\n")
+    dead = subprocess.Popen([sys.executable, os.path.join(REPO, "eml-translator.py"), "-s", server, "-q",
+                             str(tmp_path / "queue.db"), "--lease", "1", "--claim-bytes", "1", str(tmp_path)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_claim(tmp_path / "queue.db")
+    dead.send_signal(signal.SIGKILL)
+    dead.wait()
+
+    run_translator("-s", server, "-q", tmp_path / "queue.db", "--lease", "1", tmp_path)
+
+    assert set(statuses(tmp_path / "queue.db").values()) == {"translated"}
+    for index in range(3):
+        assert os.path.isfile(tmp_path / ("mail-" + str(index) + ".eml-translated-mark.mrk"))
@@ -0,0 +1,87 @@
+import json
+import os
+import random
+from email.message import EmailMessage
+
+import work_scheduling
+from work_scheduling import EMAIL_SECONDS, WorkProgress, estimate_email, format_duration, schedule_emails
+
+PDF_TYPE = "application/pdf"
+
+
+def write_email(path, text, attachment_size=0, maintype="application", subtype="pdf"):
+    message = EmailMessage()
+    message["Subject"] = "Rapport"
+    message.set_content(text)
+    if attachment_size > 0:
+        message.add_attachment(random.Random(1).randbytes(attachment_size), maintype=maintype, subtype=subtype,
+                               filename="rapport." + subtype)
+    path.write_bytes(bytes(message))
+    return str(path)
+
+
+def test_costs_follow_the_work_of_the_parts(tmp_path):
+    short = write_email(tmp_path / "short.eml", "Le rapport est prêt.\n")
+    long = write_email(tmp_path / "long.eml", "Le rapport annuel est prêt, voici le résumé.\n" * 100)
+    pdf = write_email(tmp_path / "pdf.eml", "Le rapport est prêt.\n", 200 * 1024)
+    image = write_email(tmp_path / "image.eml", "Le rapport est prêt.\n", 200 * 1024, "image", "png")
+
+    costs = {os.path.basename(path)[:-4]: estimate_email(path) for path in (short, long, pdf, image)}
+
+    assert costs["pdf"] > costs["long"] > costs["image"] > costs["short"] > EMAIL_SECONDS
+    # The PDF mostly lies beyond the head of its email, taken to belong to its last part.
+    assert 200 * 1024 * work_scheduling.BYTE_SECONDS[PDF_TYPE] < costs["pdf"] < 2 * 200 * 1024 * (
+        work_scheduling.BYTE_SECONDS[PDF_TYPE])
+    assert estimate_email(str(tmp_path / "missing.eml")) == EMAIL_SECONDS
+
+
+def test_emails_are_ordered_by_cost_and_the_costliest_deferred(tmp_path):
+    paths = [write_email(tmp_path / "short.eml", "Le rapport est prêt.\n"),
+             write_email(tmp_path / "pdf.eml", "Le rapport est prêt.\n", 200 * 1024),
+             write_email(tmp_path / "long.eml", "Le rapport annuel est prêt, voici le résumé.\n" * 100)]
+
+    emails, deferred, costs = schedule_emails(paths, 0)
+    assert [os.path.basename(path) for path in emails] == ["pdf.eml", "long.eml", "short.eml"]
+    assert deferred == [] and set(costs) == set(paths)
+
+    emails, deferred, costs = schedule_emails(paths, (costs[paths[1]] + costs[paths[2]]) / 2)
+    assert [os.path.basename(path) for path in emails] == ["long.eml", "short.eml"]
+    assert [os.path.basename(path) for path in deferred] == ["pdf.eml"]
+
+
+def test_progress_is_weighted_by_cost(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(work_scheduling.time, "time", lambda: now[0])
+    progress = WorkProgress({"a.eml": 3.0, "b.eml": 1.0})
+
+    assert progress.message() == "0.0% of the work done (0 out of 2 .eml files)"
+    now[0] += 90
+    progress.done("a.eml")
+    assert progress.message() == "75.0% of the work done (1 out of 2 .eml files), about 30s left"
+    progress.done("b.eml")
+    assert progress.message() == "100.0% of the work done (2 out of 2 .eml files)"
+
+
+def test_format_duration():
+    assert format_duration(59.9) == "59s"
+    assert format_duration(61) == "1m01s"
+    assert format_duration(3 * 3600 + 5 * 60 + 7) == "3h05m"
+
+
+def test_deferred_emails_are_translated_last(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    (tmp_path / "mails").mkdir()
+    write_email(tmp_path / "mails" / "a-short.eml", "Le rapport est prêt.\n")
+    write_email(tmp_path / "mails" / "b-data.eml", "Le rapport est prêt.\n", 200 * 1024, "application",
+                "octet-stream")
+    write_email(tmp_path / "mails" / "c-long.eml", "Le rapport annuel est prêt, voici le résumé.\n" * 200)
+
+    completed = run_translator("-s", server, "-j", tmp_path / "journal.jsonl", "--defer-above", "1",
+                               tmp_path / "mails")
+
+    assert "1 emails estimated to take more than 1 seconds are deferred to the end of the run" in completed.stdout
+    assert "Translating the 1 deferred emails" in completed.stdout
+    with open(tmp_path / "journal.jsonl", encoding="utf-8") as journal:
+        order = [os.path.basename(json.loads(line)["path"]) for line in journal]
+    # The attachment is only saved, which costs little, but on top of the same text as the short email.
+    assert order == ["b-data.eml", "a-short.eml", "c-long.eml"]
@@ -0,0 +1,62 @@
+import glob
+import os
+import signal
+import subprocess
+import sys
+import time
+from email.message import EmailMessage
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_emails(directory, count):
+    directory.mkdir()
+    for index in range(count):
+        message = EmailMessage()
+        message["Subject"] = "Numéro " + str(index)
+        message.set_content("\n\n".join("Paragraphe " + str(paragraph) + " du message " + str(index) + ", écrit en "
+                                        "français." for paragraph in range(5)) + "\n")
+        message.add_alternative("<p>Version HTML du message " + str(index) + ", écrite en français.</p>",
+                                subtype="html")
+        message.set_boundary("boundary-" + str(index))
+        (directory / ("mail-" + str(index) + ".eml")).write_bytes(bytes(message))
+
+
+def test_workers_give_the_same_outputs(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start()
+    outputs = {}
+    for workers in ("1", "3"):
+        write_emails(tmp_path / workers, 8)
+        result = run_translator("-s", server, "-w", workers, tmp_path / workers)
+        outputs[workers] = {path.name: path.read_bytes() for path in (tmp_path / workers).iterdir()}
+
+    assert "translated: 8" in result.stdout
+    assert len([name for name in outputs["1"] if name.endswith(".mrk")]) == 8
+    assert outputs["3"] == outputs["1"]
+
+
+def test_interrupted_workers_leave_no_partial_outputs(tmp_path, stub_servers, run_translator):
+    server = stub_servers.start("--latency", "0.2")
+    write_emails(tmp_path / "mails", 12)
+    translator = subprocess.Popen([sys.executable, os.path.join(REPO, "eml-translator.py"), "-s", server, "-w", "2",
+                                   str(tmp_path / "mails")], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  text=True)
+    deadline = time.monotonic() + 60
+    while len(glob.glob(str(tmp_path / "mails" / "*.mrk"))) == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    translator.send_signal(signal.SIGINT)
+    output = translator.communicate(timeout=120)[0]
+
+    assert translator.returncode == 130, output
+    names = os.listdir(tmp_path / "mails")
+    assert [name for name in names if name.endswith(".tmp")] == []
+    translated = [name for name in names if name.endswith(".mrk")]
+    assert 0 < len(translated) < 12
+    for index in range(12):
+        outputs = [name for name in names if name.startswith("mail-" + str(index) + ".eml-")]
+        # The marker is written after every other output of the email.
+        assert len(outputs) == (3 if "mail-" + str(index) + ".eml-translated-mark.mrk" in outputs else 0)
+
+    result = run_translator("-s", server, "-w", "2", tmp_path / "mails")
+    assert "translated: " + str(12 - len(translated)) in result.stdout
+    assert len(glob.glob(str(tmp_path / "mails" / "*.mrk"))) == 12
@@ -0,0 +1,151 @@
+import re
+import textwrap
+
+# Quote prefix of a reply line: one or more ">", each optionally preceded by blanks.
+QUOTE_PATTERN = re.compile(r"(?:[ \t]*>)+[ \t]?")
+# First characters of a list item, which starts a new paragraph even in wrapped text.
+BULLET_PATTERN = re.compile(r"\s*(?:[-*+•]|\d{1,3}[.)]|[A-Za-z][.)])\s")
+# Separator of the signature (RFC 3676 section 4.3), and the line above a forwarded or replied to email.
+SIGNATURE_SEPARATORS = frozenset(["-- ", "--"])
+ORIGINAL_MESSAGE_PATTERN = re.compile(r"\s*(?:-{3,}[^-].*-{3,}|_{10,})\s*$")
+# End of a sentence: closing punctuation, then closing quotes or brackets, then whitespace.  CJK punctuation
+# needs no whitespace after it.
+SENTENCE_END_PATTERN = re.compile("[.!?…]+[\"')\\]»”’]*\\s+|[。！？]+\\s*")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# A line shorter than the widest line of its quote level by more than this, for the first word of the next line,
+# ended its paragraph instead of being wrapped.
+WRAP_SLACK = 10
+MIN_WRAP_WIDTH = 40
+
+
+class TextBlock:
+    """Consecutive lines of a plain text translated as one paragraph.
+
+    Attributes:
+        start (int): Index of the first line of the block.
+        end (int): Index of the line after the block.
+        kind (str): "paragraph", "quote" for quoted reply text or "signature" for a line of a signature.
+        prefix (str): Quote prefix of the lines of the block, put back in front of the lines of the translation.
+        width (int | None): Width the lines of the block were wrapped at, None when the block is a single line.
+        text (str): The lines of the block without their quote prefix, joined with spaces.
+    """
+
+    def __init__(self, start, kind, prefix):
+        self.start = start
+        self.end = start
+        self.kind = kind
+        self.prefix = prefix
+        self.width = None
+        self.text = ""
+
+
+def quote_prefix(line):
+    match = QUOTE_PATTERN.match(line)
+    return "" if match is None else match.group(0)
+
+
+def text_blocks(lines):
+    """Split the lines of a plain text into the paragraphs to translate.
+
+    Hard wrapped lines are merged back into paragraphs: a line joins the previous one when it has the same quote
+    prefix and its first word would not have fitted on the previous line, or when the previous line ends with a
+    space (format=flowed, RFC 3676).  Blank lines, list items, quote level changes and signatures end paragraphs.
+    The lines of a signature, from its "-- " separator to the end of the text or the next quoted line, are never
+    merged.
+
+    Args:
+        lines (list): Lines of the text, with their line endings (str.splitlines(keepends=True)).
+
+    Returns:
+        A list of TextBlock in text order.  Blank lines are in no block.
+    """
+    contents = []
+    widths = {}
+    for line in lines:
+        body = line.rstrip("\r\n")
+        prefix = quote_prefix(body)
+        content = body[len(prefix):]
+        contents.append((prefix, content))
+        if len(content.strip()) > 0:
+            widths[prefix.replace(" ", "")] = max(widths.get(prefix.replace(" ", ""), 0), len(content.rstrip()))
+
+    blocks = []
+    block = None
+    in_signature = False
+    for index, (prefix, content) in enumerate(contents):
+        stripped = content.strip()
+        if prefix == "" and (content.rstrip("\t") in SIGNATURE_SEPARATORS or
+                             ORIGINAL_MESSAGE_PATTERN.match(content) is not None):
+            in_signature = content.rstrip("\t") in SIGNATURE_SEPARATORS
+            block = None
+            continue
+        if prefix != "":
+            in_signature = False
+        if len(stripped) == 0:
+            block = None
+            continue
+        if block is not None and not in_signature and block.prefix.replace(" ", "") == prefix.replace(" ", "") \
+                and BULLET_PATTERN.match(content) is None:
+            previous = contents[index - 1][1]
+            width = widths[prefix.replace(" ", "")]
+            first_word = stripped.split(None, 1)[0]
+            if previous.endswith(" ") or \
+                    (width >= MIN_WRAP_WIDTH and len(previous.rstrip()) + 1 + len(first_word) > width - WRAP_SLACK):
+                block.end = index + 1
+                block.width = width
+                block.text += " " + stripped
+                continue
+        block = TextBlock(index, "signature" if in_signature else "quote" if prefix != "" else "paragraph", prefix)
+        block.end = index + 1
+        block.text = stripped
+        blocks.append(block)
+        if in_signature:
+            block = None
+    return blocks
+
+
+def split_paragraph(text, max_length):
+    """Split a paragraph into pieces of at most max_length characters, at sentence boundaries when possible.
+
+    When no sentence ends in the second half of a piece, it is split at whitespace instead, and a word longer than
+    max_length anywhere.
+
+    Returns:
+        A list of pieces which concatenate back to text.  Each piece keeps the whitespace following it.
+    """
+    pieces = []
+    start = 0
+    while len(text) - start > max_length:
+        window_end = start + max_length
+        cut = None
+        for match in SENTENCE_END_PATTERN.finditer(text, start + 1, window_end):
+            cut = match.end()
+        if cut is None or cut - start < max_length // 2:
+            # Rather than a short piece, split the sentence crossing the middle of the window.
+            for match in WHITESPACE_PATTERN.finditer(text, max(start + 1, cut or 0), window_end):
+                cut = match.end()
+        if cut is None:
+            cut = window_end
+        pieces.append(text[start:cut])
+        start = cut
+    pieces.append(text[start:])
+    return pieces
+
+
+def join_pieces(pieces, translations):
+    """Join the translations of the pieces of a paragraph returned by split_paragraph."""
+    return "".join(translation.strip() + (" " if piece[-1:].isspace() else "")
+                   for piece, translation in zip(pieces, translations)).rstrip()
+
+
+def wrap_like(block, text):
+    """Lay text out like the lines of a block: wrapped at the same width, with the same quote prefix.
+
+    Returns:
+        The lines of text, without line endings.
+    """
+    if block.width is None:
+        lines = [text]
+    else:
+        lines = textwrap.wrap(text, width=block.width, break_long_words=False, break_on_hyphens=False) or [""]
+    return [block.prefix + line for line in lines]
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+
+class TranslationMemory:
+    """Disk-backed translation memory, keyed by normalized segment and language pair.
+
+    The database uses SQLite in WAL mode so that several replicas can share the same file.
+    """
+
+    counter_names = ("hits", "misses", "evictions")
+
+    def __init__(self, path: str, max_entries: int):
+        """Open or create a translation memory.
+
+        Args:
+            path (str): Path of the SQLite database file
+            max_entries (int): Number of segments kept before least recently used ones are evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Number of segments in the memory, counted when it is opened and kept up to date by store().  Segments
+        # stored by other replicas are only counted again before evicting.
+        self.row_count = 0
+        self.db = None
+        self.db_pid = None
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the database connection of the current process, opening it on first use.
+
+        Connections are never shared with forked worker processes.
+        """
+        if self.db is None or self.db_pid != os.getpid():
+            self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.db_pid = os.getpid()
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS memory ("
+                            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, source_language TEXT NOT NULL, "
+                            "last_used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+            self.row_count = self.db.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+        return self.db
+
+    @staticmethod
+    def key(text: str, source: str, target: str) -> str:
+        """Build the lookup key of a segment.
+
+        Whitespace is collapsed so that re-wrapped copies of a segment share one entry.
+        """
+        normalized = " ".join(text.split())
+        return hashlib.sha256((source + "\0" + target + "\0" + normalized).encode("utf-8")).hexdigest()
+
+    def lookup(self, texts: list, source: str, target: str) -> list:
+        """Look up segments.
+
+        Returns:
+            One (translation, source_language) tuple per segment, or None for cache misses.
+        """
+        keys = [TranslationMemory.key(text, source, target) for text in texts]
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection().execute("SELECT key, translation, source_language FROM memory WHERE key IN (" +
+                                   ",".join("?" * len(chunk)) + ")", chunk)
+            for key, translation, source_language in rows:
+                found[key] = (translation, source_language)
+        if len(found) > 0:
+            now = time.time()
+            self.connection().executemany("UPDATE memory SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        results = [found.get(key) for key in keys]
+        hits = len([result for result in results if result is not None])
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def store(self, entries: list, source: str, target: str):
+        """Store (text, translation, source_language) tuples and evict the oldest segments when full."""
+        if len(entries) == 0:
+            return
+        now = time.time()
+        rows = {TranslationMemory.key(text, source, target): (translation, source_language)
+                for text, translation, source_language in entries}
+        keys = list(rows)
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Looked up by primary key, unlike counting the whole table.
+            existing = 0
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                existing += db.execute("SELECT COUNT(*) FROM memory WHERE key IN (" + ",".join("?" * len(chunk)) +
+                                       ")", chunk).fetchone()[0]
+            db.executemany("INSERT OR REPLACE INTO memory (key, translation, source_language, last_used) "
+                                "VALUES (?, ?, ?, ?)",
+                                [(key, translation, source_language, now)
+                                 for key, (translation, source_language) in rows.items()])
+            row_count = self.row_count + len(keys) - existing
+            if row_count > self.max_entries:
+                # Other replicas may have stored or evicted segments meanwhile.
+                row_count = db.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+            if row_count > self.max_entries:
+                # Evict a little more than needed so that eviction does not run on every batch.
+                to_evict = row_count - self.max_entries + self.max_entries // 20
+                db.execute("DELETE FROM memory WHERE key IN "
+                                "(SELECT key FROM memory ORDER BY last_used LIMIT ?)", (to_evict,))
+                self.evictions += to_evict
+                row_count -= to_evict
+            db.execute("COMMIT")
+            self.row_count = row_count
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        ratio = 0.0 if total == 0 else 100.0 * self.hits / total
+        return ("Translation memory " + self.path + ": " + str(self.hits) + " hits, " + str(self.misses) +
+                " misses (" + "{:.1f}".format(ratio) + "% hit ratio), " + str(self.evictions) + " evictions.")
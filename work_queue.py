@@ -0,0 +1,151 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class WorkQueue:
+    """Work queue shared by replicas through an SQLite database.
+
+    Replicas claim emails largest first, so that the big mailboxes are spread across replicas. Claims are leases
+    which are renewed by a heartbeat thread, and which other replicas take over once they expire.  Emails are
+    queued with their size and modification time, and done emails which changed since are queued again.
+    """
+
+    def __init__(self, path: str, lease_seconds: float, claim_bytes: int):
+        """Open or create a work queue.
+
+        Args:
+            path (str): Path of the SQLite database file
+            lease_seconds (float): Lifetime of a claim that is not renewed
+            claim_bytes (int): Number of bytes of emails claimed at once
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.claim_bytes = claim_bytes
+        self.owner = socket.gethostname() + ":" + str(os.getpid()) + ":" + os.urandom(4).hex()
+        self.db = None
+        self.db_pid = None
+        self.heartbeat_stop = threading.Event()
+        self.heartbeat_thread = None
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS work ("
+                   "path TEXT PRIMARY KEY, size INTEGER NOT NULL, state TEXT NOT NULL DEFAULT 'pending', "
+                   "owner TEXT, lease_expires REAL, status TEXT, mtime REAL)")
+        columns = [column[1] for column in db.execute("PRAGMA table_info(work)")]
+        # Queues created by earlier versions.
+        if "status" not in columns:
+            db.execute("ALTER TABLE work ADD COLUMN status TEXT")
+        if "mtime" not in columns:
+            db.execute("ALTER TABLE work ADD COLUMN mtime REAL")
+        db.execute("CREATE INDEX IF NOT EXISTS work_state_size ON work (state, size)")
+        return db
+
+    def connection(self) -> sqlite3.Connection:
+        if self.db is None or self.db_pid != os.getpid():
+            self.db = self.connect()
+            self.db_pid = os.getpid()
+        return self.db
+
+    def add(self, pathStrs: list):
+        """Queue new emails, and queue again the emails which failed or whose size or modification time changed.
+
+        Emails claimed by a replica are left to it.  Emails queued by an earlier version have no modification
+        time and are only compared by size.
+        """
+        db = self.connection()
+        for start in range(0, len(pathStrs), 1000):
+            rows = []
+            for pathStr in pathStrs[start:start + 1000]:
+                try:
+                    stat = os.stat(pathStr)
+                except OSError:
+                    continue
+                rows.append((pathStr, stat.st_size, stat.st_mtime))
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT INTO work (path, size, mtime) VALUES (?, ?, ?) ON CONFLICT (path) DO UPDATE "
+                           "SET size = excluded.size, mtime = excluded.mtime, state = 'pending', status = NULL "
+                           "WHERE work.state != 'claimed' AND (work.status = 'failed' OR work.size != excluded.size "
+                           "OR (work.mtime IS NOT NULL AND work.mtime != excluded.mtime))", rows)
+            db.execute("COMMIT")
+
+    def claim(self) -> list:
+        """Claim the largest pending or expired emails, up to claim_bytes (at least one email)."""
+        db = self.connection()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute("SELECT path, size FROM work WHERE state = 'pending' "
+                              "OR (state = 'claimed' AND lease_expires < ?) ORDER BY size DESC LIMIT 256",
+                              (now,)).fetchall()
+            claimed = []
+            claimed_bytes = 0
+            for pathStr, size in rows:
+                if len(claimed) > 0 and claimed_bytes + size > self.claim_bytes:
+                    continue
+                claimed.append(pathStr)
+                claimed_bytes += size
+            db.executemany("UPDATE work SET state = 'claimed', owner = ?, lease_expires = ? WHERE path = ?",
+                           [(self.owner, now + self.lease_seconds, pathStr) for pathStr in claimed])
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def claimed_by_others(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM work WHERE state = 'claimed' AND owner != ?",
+                                         (self.owner,)).fetchone()[0]
+
+    def done(self, pathStr: str, status: str):
+        """Record a claimed email as done, with the status translate_eml_file returned for it."""
+        self.connection().execute("UPDATE work SET state = 'done', status = ?, owner = NULL, lease_expires = NULL "
+                                  "WHERE path = ? AND owner = ?", (status, pathStr, self.owner))
+
+    def release(self):
+        """Give back the emails claimed by this replica which were not completed."""
+        self.connection().execute("UPDATE work SET state = 'pending', owner = NULL, lease_expires = NULL "
+                                  "WHERE state = 'claimed' AND owner = ?", (self.owner,))
+
+    def claimed_paths(self):
+        """Yield claimed emails until none is left to claim."""
+        while True:
+            claimed = self.claim()
+            if len(claimed) == 0:
+                return
+            for pathStr in claimed:
+                yield pathStr
+
+    def wait_for_others(self) -> bool:
+        """Wait a little while other replicas hold claims, so that their emails are claimed again if they die.
+
+        The emails claimed by this replica should be done first, or replicas waiting for each other never stop.
+
+        Returns:
+            bool: False when no other replica holds claims
+        """
+        if self.claimed_by_others() == 0:
+            return False
+        time.sleep(min(5.0, self.lease_seconds / 2))
+        return True
+
+    def start_heartbeat(self):
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat, name="work-queue-heartbeat", daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        self.heartbeat_stop.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+
+    def heartbeat(self):
+        # SQLite connections cannot be shared between threads.
+        db = self.connect()
+        while not self.heartbeat_stop.wait(self.lease_seconds / 3):
+            db.execute("UPDATE work SET lease_expires = ? WHERE state = 'claimed' AND owner = ?",
+                       (time.time() + self.lease_seconds, self.owner))
+        db.close()
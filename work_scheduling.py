@@ -0,0 +1,122 @@
+import io
+import os
+import time
+
+from mime_streaming import MimeScanner
+
+# Bytes read from the start of an email to estimate its cost.  The rest of the email is taken to belong to the
+# part the head ends in, which is nearly always an attachment.
+HEAD_SIZE = 65536
+# Estimated seconds per email and per part, besides the translation of their text.
+EMAIL_SECONDS = 0.01
+PART_SECONDS = 0.002
+# Estimated seconds per character translated, for a server translating about 1000 characters per second.
+CHARACTER_SECONDS = 0.001
+# Estimated seconds per decoded byte of the parts the translator extracts text from, text extraction and
+# translation of the text included, and of the parts it only saves.
+BYTE_SECONDS = {
+    "application/pdf": 0.00003,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": 0.00002,
+}
+SAVED_BYTE_SECONDS = 0.00000001
+# Bytes beyond the head taken to be text when the head ends in a text part.
+TEXT_REMAINDER_SIZE = 262144
+
+
+def part_cost(content_type, size, characters):
+    """Estimated seconds to handle a part measured by MimeScanner, following process_email_part."""
+    if content_type == "message/rfc822":
+        # Its parts are measured on their own.
+        return 0.0
+    if content_type in ("text/plain", "text/html"):
+        return PART_SECONDS + characters * CHARACTER_SECONDS
+    return PART_SECONDS + size * BYTE_SECONDS.get(content_type, SAVED_BYTE_SECONDS)
+
+
+def remainder_cost(content_type, part_size, characters, remainder):
+    """Estimated seconds to handle the bytes of a part beyond the head of its email."""
+    if content_type in ("text/plain", "text/html"):
+        # Long bodies are rare, what follows one is more likely attachments than more text.
+        text = min(remainder, TEXT_REMAINDER_SIZE)
+        return (text * characters / max(1, part_size) * CHARACTER_SECONDS +
+                (remainder - text) * SAVED_BYTE_SECONDS)
+    # Attachments are base64 encoded.
+    return remainder * 3 // 4 * BYTE_SECONDS.get(content_type, SAVED_BYTE_SECONDS)
+
+
+def estimate_email(pathStr):
+    """Estimate the seconds needed to translate an email from its size and the MIME headers of its first bytes.
+
+    Returns:
+        The estimated cost, EMAIL_SECONDS for emails which cannot be read.
+    """
+    try:
+        with open(pathStr, "rb") as eml_file:
+            size = os.fstat(eml_file.fileno()).st_size
+            head = eml_file.read(HEAD_SIZE)
+    except OSError:
+        return EMAIL_SECONDS
+    parts = []
+    try:
+        parts = list(MimeScanner(io.BytesIO(head)).parts())
+    except Exception:
+        pass
+    if len(parts) == 0:
+        return EMAIL_SECONDS + size * SAVED_BYTE_SECONDS
+    cost = EMAIL_SECONDS + sum(part_cost(*part) for part in parts)
+    leaves = [part for part in parts if part[0] != "message/rfc822"]
+    if size > len(head) and len(leaves) > 0:
+        cost += remainder_cost(*leaves[-1], size - len(head))
+    return cost
+
+
+def schedule_emails(pathStrs, defer_above):
+    """Order emails largest estimated cost first, so that workers finish at about the same time.
+
+    Emails estimated over defer_above seconds are deferred: they are translated after the others, so that they do
+    not hold the rest of the archive back.  0 defers none.
+
+    Returns:
+        (emails, deferred, costs): The emails to translate first and the deferred ones, both in the order to
+        translate them, and a dictionary of the cost of every email.
+    """
+    costs = {pathStr: estimate_email(pathStr) for pathStr in pathStrs}
+    ordered = sorted(pathStrs, key=lambda pathStr: -costs[pathStr])
+    if defer_above <= 0:
+        return ordered, [], costs
+    deferred = [pathStr for pathStr in ordered if costs[pathStr] > defer_above]
+    return [pathStr for pathStr in ordered if costs[pathStr] <= defer_above], deferred, costs
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return str(seconds // 3600) + "h" + "%02d" % (seconds // 60 % 60) + "m"
+    if seconds >= 60:
+        return str(seconds // 60) + "m" + "%02d" % (seconds % 60) + "s"
+    return str(seconds) + "s"
+
+
+class WorkProgress:
+    """Progress of a run weighted by the estimated cost of the emails, with the time left at the rate so far."""
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.total_cost = sum(costs.values())
+        self.done_cost = 0.0
+        self.email_count = len(costs)
+        self.done_count = 0
+        self.start_time = time.time()
+
+    def done(self, pathStr):
+        self.done_cost += self.costs.get(pathStr, 0.0)
+        self.done_count += 1
+
+    def message(self) -> str:
+        fraction = self.done_cost / self.total_cost if self.total_cost > 0 else 1.0
+        message = ("{:.1f}".format(100 * fraction) + "% of the work done (" + str(self.done_count) + " out of " +
+                   str(self.email_count) + " .eml files)")
+        if 0 < fraction and self.done_count < self.email_count:
+            elapsed = time.time() - self.start_time
+            message += ", about " + format_duration(elapsed * (1 - fraction) / fraction) + " left"
+        return message